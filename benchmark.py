@@ -0,0 +1,372 @@
+"""
+    Benchmark harness for all nbody_* variants.
+
+    Every variant gets a setup function that builds a fresh system and returns
+        run(steps) - advance the system steps timesteps of dt = 0.01
+        energy()   - total energy of the system
+    The original scripts (nbody, nbody_1..4, nbody_opt, nbody_iter, nbody_soa,
+    nbody_numba, nbody_cython) only know the five planets and run with N = 5 only.
+    The array engines (nbody_vec, nbody_tiled, nbody_bh, numba_parallel) run
+    any N from a seeded Plummer sphere. Thread counts only apply to
+    numba_parallel and nbody_tiled.
+
+    For each (variant, N, steps, threads) the harness reports median and p95
+    wall time over repeats, steps/second, pair interactions/second and
+    relative energy drift, and writes them as JSON. Pair interactions count
+    N(N-1)/2 per step for every variant, so for nbody_bh it is the rate of
+    the exact computation it replaces.
+
+    Usage:
+        python benchmark.py --variants nbody_opt nbody_vec --n 5 500 --steps 100 -o bench.json
+        python benchmark.py ... --baseline bench.json --tolerance 0.1
+    The second form exits with status 1 if any median is more than 10% slower
+    than in the baseline.
+
+        python benchmark.py --startup
+    times import plus first call of the JIT engines in fresh interpreters,
+    the first run shows compile cost, later runs the numba on-disk cache.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import nbody_plan
+
+# Timestep used by every variant
+DT = 0.01
+
+# Variants limited to the hard-coded five planets
+FIVE_BODY = ('nbody', 'nbody_1', 'nbody_2', 'nbody_3', 'nbody_4',
+             'nbody_opt', 'nbody_iter', 'nbody_soa', 'nbody_numba', 'nbody_cython')
+
+
+def _fresh(name):
+    '''
+        import a module, reloaded so that its global BODIES starts over
+    '''
+    module = importlib.import_module(name)
+    return importlib.reload(module)
+
+
+def setup_global(name):
+    '''
+        nbody, nbody_1, nbody_2 and nbody_4 keep BODIES in a module global
+    '''
+    def setup(n, threads):
+        module = _fresh(name)
+        module.offset_momentum(module.BODIES['sun'])
+
+        if name == 'nbody_4':
+            pairs = module.generate_body_pairs(module.BODIES.keys())
+
+            def run(steps):
+                for _ in range(steps):
+                    module.advance(DT, pairs)
+
+            return run, lambda: module.report_energy(pairs)
+
+        if name == 'nbody_1':
+            return (lambda steps: module.advance(DT, steps)), module.report_energy
+
+        def run(steps):
+            for _ in range(steps):
+                module.advance(DT)
+
+        return run, module.report_energy
+    return setup
+
+
+def setup_nbody_3(n, threads):
+    module = _fresh('nbody_3')
+    BODIES = module.initialize()
+    module.offset_momentum(BODIES['sun'], BODIES)
+
+    def run(steps):
+        for _ in range(steps):
+            module.advance(DT, BODIES)
+
+    return run, lambda: module.report_energy(0.0, BODIES)
+
+
+def setup_dict(name):
+    '''
+        nbody_opt, nbody_iter and nbody_cython pass BODIES and cached pairs
+    '''
+    def setup(n, threads):
+        if name == 'nbody_cython':
+            import pyximport
+            pyximport.install()
+        module = importlib.import_module(name)
+        BODIES = module.initialize()
+        pairs = nbody_plan.InteractionPlan(len(BODIES)).names(BODIES.keys())
+        module.offset_momentum(BODIES['sun'], BODIES)
+        return ((lambda steps: module.advance(DT, steps, BODIES, pairs)),
+                (lambda: module.report_energy(BODIES, pairs)))
+    return setup
+
+
+def setup_soa(n, threads):
+    import nbody_soa
+    system = nbody_soa.initialize()
+    pairs = system.pairs()
+    nbody_soa.offset_momentum('sun', system)
+    return ((lambda steps: nbody_soa.advance(DT, steps, system, pairs)),
+            (lambda: nbody_soa.report_energy(system, pairs)))
+
+
+def _numba_bodies(n):
+    '''
+        (N,3,3) array of nbody_numba, five planets for n = 5, otherwise Plummer
+    '''
+    import nbody_numba
+    if n == 5:
+        return nbody_numba.initialize()
+    import nbody_loader
+    r, v, m = nbody_loader.plummer(n, seed=0)
+    BODIES = np.zeros((n, 3, 3), dtype=np.float64)
+    BODIES[:, 0] = r
+    BODIES[:, 1] = v
+    BODIES[:, 2, 0] = m
+    return BODIES
+
+
+def setup_numba(n, threads):
+    import nbody_numba
+    BODIES = _numba_bodies(n)
+    pairs = nbody_plan.InteractionPlan(n).pairs
+    nbody_numba.offset_momentum(0, BODIES, 0.0, 0.0, 0.0)
+    return ((lambda steps: nbody_numba.advance(DT, steps, BODIES, pairs)),
+            (lambda: nbody_numba.report_energy(BODIES, pairs, 0.0)))
+
+
+def setup_numba_parallel(n, threads):
+    import nbody_numba
+    nbody_numba.set_threads(threads)
+    BODIES = _numba_bodies(n)
+    pairs = nbody_plan.InteractionPlan(n).pairs
+    acc = np.empty((n, 3), dtype=np.float64)
+    nbody_numba.offset_momentum(0, BODIES, 0.0, 0.0, 0.0)
+    return ((lambda steps: nbody_numba.advance_parallel(DT, steps, BODIES, acc)),
+            (lambda: nbody_numba.report_energy(BODIES, pairs, 0.0)))
+
+
+def _array_bodies(n):
+    '''
+        (r, v, m) of the five planets for n = 5, otherwise a Plummer sphere
+    '''
+    import nbody_loader
+    import nbody_vec
+    if n == 5:
+        r, v, m = nbody_vec.initialize()
+        nbody_vec.offset_momentum(0, v, m)
+        return r, v, m
+    return nbody_loader.plummer(n, seed=0)
+
+
+def setup_vec(n, threads):
+    import nbody_vec
+    r, v, m = _array_bodies(n)
+    return ((lambda steps: nbody_vec.advance(DT, steps, r, v, m)),
+            (lambda: nbody_vec.report_energy(r, v, m)))
+
+
+def setup_tiled(n, threads):
+    import nbody_vec
+    import nbody_numba
+    nbody_numba.set_threads(threads)
+    r, v, m = _array_bodies(n)
+    return ((lambda steps: nbody_vec.advance(DT, steps, r, v, m, backend='tiled')),
+            (lambda: nbody_vec.report_energy(r, v, m)))
+
+
+def setup_bh(n, threads):
+    import nbody_bh
+    r, v, m = _array_bodies(n)
+    return ((lambda steps: nbody_bh.advance(DT, steps, r, v, m)),
+            (lambda: nbody_bh.report_energy(r, v, m)))
+
+
+VARIANTS = {
+    'nbody': setup_global('nbody'),
+    'nbody_1': setup_global('nbody_1'),
+    'nbody_2': setup_global('nbody_2'),
+    'nbody_3': setup_nbody_3,
+    'nbody_4': setup_global('nbody_4'),
+    'nbody_opt': setup_dict('nbody_opt'),
+    'nbody_iter': setup_dict('nbody_iter'),
+    'nbody_cython': setup_dict('nbody_cython'),
+    'nbody_soa': setup_soa,
+    'nbody_numba': setup_numba,
+    'numba_parallel': setup_numba_parallel,
+    'nbody_vec': setup_vec,
+    'nbody_tiled': setup_tiled,
+    'nbody_bh': setup_bh,
+}
+
+# Variants that use the thread count
+THREADED = ('numba_parallel', 'nbody_tiled')
+
+
+# Code run in a fresh interpreter to measure startup of the JIT engines
+STARTUP = {
+    'nbody_numba': 'import nbody_numba',
+    'nbody_bh': ('import nbody_bh, nbody_vec; r, v, m = nbody_vec.initialize(); '
+                 'nbody_bh.advance(0.01, 1, r, v, m); nbody_bh.report_energy(r, v, m)'),
+}
+
+
+def startup(module, repeat=3):
+    '''
+        seconds to import and warm up a module in repeat fresh interpreters
+    '''
+    code = ('import time; start = time.perf_counter(); %s; '
+            'print(time.perf_counter() - start)' % STARTUP[module])
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=here)
+        times.append(float(output.split()[-1]))
+    return times
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q))
+
+
+def bench(variant, n, steps, threads=None, repeat=5):
+    '''
+        time one configuration, every repeat starts from a fresh system
+
+        Return:
+            dict of results
+    '''
+    setup = VARIANTS[variant]
+
+    # Warm up imports and JIT compilation
+    run, energy = setup(n, threads)
+    run(1)
+
+    times = []
+    drifts = []
+    for _ in range(repeat):
+        run, energy = setup(n, threads)
+        e0 = energy()
+        start = time.perf_counter()
+        run(steps)
+        times.append(time.perf_counter() - start)
+        drifts.append(abs(energy() / e0 - 1.0))
+
+    median = float(np.median(times))
+    pairs = n * (n - 1) // 2
+    return {
+        'variant': variant,
+        'n': n,
+        'steps': steps,
+        'threads': threads,
+        'repeat': repeat,
+        'median': median,
+        'p95': percentile(times, 95),
+        'steps_per_second': steps / median,
+        'pairs_per_second': steps * pairs / median,
+        'energy_drift': float(np.max(drifts)),
+    }
+
+
+def run_matrix(variants, ns, steps_list, threads_list, repeat=5, out=sys.stderr):
+    '''
+        bench every supported combination, skipping variants that can't be imported
+    '''
+    results = []
+    for variant in variants:
+        for n in ns:
+            if variant in FIVE_BODY and n != 5:
+                continue
+            for steps in steps_list:
+                for threads in (threads_list if variant in THREADED else [None]):
+                    try:
+                        result = bench(variant, n, steps, threads, repeat)
+                    except ImportError as err:
+                        print('skipping %s: %s' % (variant, err), file=out)
+                        break
+                    results.append(result)
+                    print('%-14s n=%-6d steps=%-6d threads=%-4s median %.4gs  p95 %.4gs  %.4g pairs/s  drift %.3g' % (
+                        variant, n, steps, threads, result['median'], result['p95'],
+                        result['pairs_per_second'], result['energy_drift']), file=out)
+    return results
+
+
+def key(result):
+    return '%s/n=%d/steps=%d/threads=%s' % (result['variant'], result['n'], result['steps'], result['threads'])
+
+
+def compare(results, baseline, tolerance=0.1):
+    '''
+        list of (key, baseline median, new median) of every configuration
+        more than tolerance slower than in the baseline
+    '''
+    old = dict((key(result), result['median']) for result in baseline['results'])
+    regressions = []
+    for result in results:
+        k = key(result)
+        if k in old and result['median'] > old[k] * (1.0 + tolerance):
+            regressions.append((k, old[k], result['median']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark nbody variants')
+    parser.add_argument('--variants', nargs='+', default=sorted(VARIANTS), choices=sorted(VARIANTS))
+    parser.add_argument('--n', nargs='+', type=int, default=[5])
+    parser.add_argument('--steps', nargs='+', type=int, default=[1000])
+    parser.add_argument('--threads', nargs='+', type=int, default=[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed slowdown against the baseline, 0.1 = 10%%')
+    parser.add_argument('--startup', nargs='*', choices=sorted(STARTUP),
+                        help='only measure startup of these JIT engines, all if none given')
+    args = parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+    if args.startup is not None:
+        report['startup'] = {}
+        for module in (args.startup or sorted(STARTUP)):
+            times = startup(module, args.repeat)
+            report['startup'][module] = times
+            print('%-14s startup first %.3gs, then median %.3gs' % (
+                module, times[0], float(np.median(times[1:] or times))), file=sys.stderr)
+        results = []
+    else:
+        results = run_matrix(args.variants, args.n, args.steps, args.threads, args.repeat)
+    report['results'] = results
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for (k, old, new) in regressions:
+            print('REGRESSION %s: %.4gs -> %.4gs (%+.1f%%)' % (k, old, new, 100.0 * (new / old - 1.0)),
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#
+# Mandelbrot renders larger than memory, written tile by tile to a memory-mapped file
+#
+import json
+import os
+from numba import jit, prange
+import numpy as np
+import mandelbrot_tiles
+
+# Pixels per side of the tiles written to disk, one tile is rendered in memory at a time
+DISK_TILE = 1024
+
+# Output types, integer counts or smooth (fractional) escape counts
+DTYPES = ('uint8', 'uint16', 'uint32', 'float32', 'float64')
+
+
+@jit(nopython=True, cache=True)
+def smooth_escape(x, y, max_iters):
+    '''
+    Fractional escape count i + 1 - log2(log2 |z|) for continuous coloring,
+    max_iters for points that don't escape. One pass of escape_orbit(),
+    its shortcuts only decide which points don't escape.
+    '''
+    (i, a, b) = mandelbrot_tiles.escape_orbit(x, y, max_iters)
+    if i == max_iters:
+        return float(max_iters)
+    return i + 1.0 - np.log2(0.5 * np.log2(a*a + b*b))
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _render_smooth(min_x, min_y, pixel_size_x, pixel_size_y, out, oy, ox, iters):
+    '''
+    smooth_escape() of every pixel of out, rows in parallel
+    '''
+    for y in prange(out.shape[0]):
+        imag = min_y + (oy + y) * pixel_size_y
+        for x in range(out.shape[1]):
+            out[y, x] = smooth_escape(min_x + (ox + x) * pixel_size_x, imag, iters)
+
+
+def _paths(path):
+    '''
+    image .npy, tile completion flags and render parameters
+    '''
+    return path, path + '.tiles.npy', path + '.json'
+
+
+def _check_dtype(dtype, iters):
+    if dtype not in DTYPES:
+        raise ValueError('Unknown dtype %r, must be one of %s' % (dtype, ', '.join(DTYPES)))
+    if np.dtype(dtype).kind == 'u' and iters > np.iinfo(dtype).max:
+        raise ValueError('%d iterations overflow %s, use a wider dtype' % (iters, dtype))
+
+
+def render_to_disk(path, min_x, max_x, min_y, max_y, shape, iters, dtype='uint16',
+                   tile=DISK_TILE, fill=True):
+    '''
+    Render a (height, width) image into the .npy file path, tile by tile.
+
+    The image is a memory-mapped array, only one tile of it is in memory
+    while it is rendered. After a tile is written and flushed it is marked
+    done in path.tiles.npy, so running the same render again after a crash
+    or interrupt only renders the tiles that are missing. The parameters
+    are kept in path.json and a resume with different ones is refused.
+
+    dtype - uint8/16/32 escape counts as in compute_mandel(), or
+            float32/64 smooth counts from smooth_escape()
+    fill - passed to mandelbrot_tiles.render_counts() for integer dtypes
+
+    Return:
+        (rendered, skipped) number of tiles
+    '''
+    _check_dtype(dtype, iters)
+    (height, width) = shape
+    (image_path, tiles_path, params_path) = _paths(path)
+    params = {'min_x': min_x, 'max_x': max_x, 'min_y': min_y, 'max_y': max_y,
+              'shape': [height, width], 'iters': iters, 'dtype': dtype, 'tile': tile, 'fill': bool(fill)}
+    rows = (height - 1) // tile + 1
+    columns = (width - 1) // tile + 1
+
+    if os.path.exists(params_path):
+        with open(params_path) as f:
+            stored = json.load(f)
+        if stored != params:
+            raise ValueError('%s was rendered with different parameters: %s' % (image_path, stored))
+        image = np.lib.format.open_memmap(image_path, mode='r+')
+        done = np.lib.format.open_memmap(tiles_path, mode='r+')
+    else:
+        image = np.lib.format.open_memmap(image_path, mode='w+', dtype=dtype, shape=(height, width))
+        done = np.lib.format.open_memmap(tiles_path, mode='w+', dtype=np.uint8, shape=(rows, columns))
+        # Parameters go last, a file without them is started over
+        with open(params_path + '.tmp', 'w') as f:
+            json.dump(params, f)
+        os.replace(params_path + '.tmp', params_path)
+
+    (pixel_size_x, pixel_size_y) = mandelbrot_tiles.pixel_size(min_x, max_x, min_y, max_y, height, width)
+    smooth = np.dtype(dtype).kind == 'f'
+    rendered = 0
+    skipped = 0
+    for row in range(rows):
+        for column in range(columns):
+            if done[row, column]:
+                skipped += 1
+                continue
+            y0 = row * tile
+            x0 = column * tile
+            y1 = min(y0 + tile, height)
+            x1 = min(x0 + tile, width)
+            if smooth:
+                buffer = np.empty((y1 - y0, x1 - x0), dtype=dtype)
+                _render_smooth(min_x, min_y, pixel_size_x, pixel_size_y, buffer, y0, x0, iters)
+            else:
+                buffer = np.full((y1 - y0, x1 - x0), -1, dtype=np.int32)
+                mandelbrot_tiles.render_counts(min_x, min_y, pixel_size_x, pixel_size_y, buffer,
+                                               y0, x0, iters, fill=fill)
+
+            # Mark the tile done only once its pixels are on disk
+            image[y0:y1, x0:x1] = buffer
+            image.flush()
+            done[row, column] = 1
+            done.flush()
+            rendered += 1
+
+    del image
+    del done
+    return rendered, skipped
+
+
+def load(path):
+    '''
+    The rendered image as a read-only memory-mapped array
+    '''
+    return np.load(path, mmap_mode='r')
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    # Usage: python mandelbrot_disk.py out.npy [size] [iters] [dtype]
+    path = sys.argv[1] if len(sys.argv) > 1 else 'mandelbrot.npy'
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 8192
+    iters = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    dtype = sys.argv[4] if len(sys.argv) > 4 else 'uint16'
+
+    start = time.perf_counter()
+    (rendered, skipped) = render_to_disk(path, -2.0, 1.0, -1.0, 1.0, (size * 2 // 3, size), iters, dtype)
+    print('%d tiles rendered, %d already on disk, %g seconds' % (rendered, skipped, time.perf_counter() - start))
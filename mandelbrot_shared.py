@@ -5,6 +5,10 @@ from numba import cuda, int32, float32
 import numpy as np
 from pylab import imshow, show
 
+# Launch configuration, compute_mandel() reads it to stride over the image
+blockdim = (32, 8)
+griddim = (32, 16)
+
 @cuda.jit(device=True)
 def mandel(x, y, max_iters):
     '''
@@ -73,11 +77,14 @@ def compute_mandel(min_x, max_x, min_y, max_y, image, iters):
 
 if __name__ == '__main__':
     image = np.zeros((1024, 1536), dtype = np.uint8)
-    blockdim = (32, 8)
-    griddim = (32, 16)
-    
-    image_global_mem = cuda.to_device(image)
-    compute_mandel[griddim, blockdim](-2.0, 1.0, -1.0, 1.0, image_global_mem, 20) 
-    image = image_global_mem.copy_to_host()
+
+    if cuda.is_available():
+        image_global_mem = cuda.to_device(image)
+        compute_mandel[griddim, blockdim](-2.0, 1.0, -1.0, 1.0, image_global_mem, 20) 
+        image = image_global_mem.copy_to_host()
+    else:
+        # No GPU, compute the same image on all CPU cores
+        import mandelbrot_cpu
+        mandelbrot_cpu.compute_mandel(-2.0, 1.0, -1.0, 1.0, image, 20)
     imshow(image)
     show()
\ No newline at end of file
@@ -0,0 +1,302 @@
+#
+# A tiled, progressive Mandelbrot renderer that skips most of the iterations
+#
+from numba import jit, prange
+import numpy as np
+
+# Pixels per side of the square tiles rendered in parallel
+TILE = 64
+
+# Rectangles with a side this short or shorter are computed pixel by pixel
+MIN_SIDE = 4
+
+# escape() gives exactly the counts of mandel(). Filling rectangles can miss
+# features thinner than a pixel: at 255 iterations 3 of the 1.5M pixels of
+# the full view differ from compute_mandel(), and none at 1000. The full
+# view renders 5.6x faster than compute_mandel() at 255 iterations and 26x
+# at 5000, mostly from the rectangles inside the set.
+
+
+@jit(nopython=True, cache=True)
+def escape_orbit(x, y, max_iters):
+    '''
+    Escape count of mandel() in mandelbrot_cpu.py and the last z = a + bi
+    of the orbit, with three shortcuts that never change the count:
+
+    Points in the main cardioid or the period-2 bulb never escape,
+    which is a closed form test.
+
+    If z comes back exactly to a value it had before, the orbit is a cycle
+    and never escapes. z is saved at steps 8, 16, 32, ... (Brent's method),
+    so cycles of any length are found with one comparison per step.
+
+    Return:
+        (count, a, b), z is only meaningful for count < max_iters
+    '''
+    xq = x - 0.25
+    q = xq*xq + y*y
+    if q * (q + xq) <= 0.25 * y * y:
+        return max_iters, 0.0, 0.0
+    if (x + 1.0) * (x + 1.0) + y*y <= 0.0625:
+        return max_iters, 0.0, 0.0
+
+    a = 0.0
+    b = 0.0
+    saved_a = 0.0
+    saved_b = 0.0
+    check = 8
+    since = 0
+    for i in range(max_iters):
+        # z*z + c expanded like complex multiplication, same rounding as mandel()
+        real = a*a - b*b + x
+        imag = a*b + b*a + y
+        a = real
+        b = imag
+        if (a*a + b*b) >= 4:
+            return i, a, b
+        if a == saved_a and b == saved_b:
+            return max_iters, a, b
+        since += 1
+        if since == check:
+            saved_a = a
+            saved_b = b
+            since = 0
+            check *= 2
+
+    return max_iters, a, b
+
+
+@jit(nopython=True, cache=True)
+def escape(x, y, max_iters):
+    '''
+    Escape count of mandel() in mandelbrot_cpu.py, see escape_orbit()
+    '''
+    return escape_orbit(x, y, max_iters)[0]
+
+
+@jit(nopython=True, cache=True)
+def _pixel(counts, y, x, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters):
+    '''
+    Count of one pixel, computed once and kept in counts (-1 = not yet)
+    counts[y, x] is pixel (oy + y, ox + x) of the whole image
+    '''
+    if counts[y, x] < 0:
+        counts[y, x] = escape(min_x + (ox + x) * pixel_size_x, min_y + (oy + y) * pixel_size_y, iters)
+    return counts[y, x]
+
+
+@jit(nopython=True, cache=True)
+def _mariani_silver(counts, filled, y0, x0, y1, x1, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters,
+                    min_side):
+    '''
+    Fill the rectangle rows y0..y1, columns x0..x1 (inclusive) of counts,
+    filled is set where a count was filled in instead of iterated.
+
+    If every pixel on the border of a rectangle has the same count, the
+    inside is filled with it without iterating, since the Mandelbrot set and
+    its escape time bands have no holes. Otherwise the rectangle is split in
+    two along its longer side; the halves share the middle line, so every
+    border pixel is only computed once. Rectangles with a side of
+    min_side or less are computed pixel by pixel.
+    '''
+    # A split pops one rectangle and pushes two, each with a side about
+    # halved. Halving both sides of the first rectangle down to one pixel
+    # takes at most 2 * bits of its longer side splits, and the stack never
+    # holds more than one rectangle per split on the path plus one.
+    bits = 1
+    side = max(y1 - y0, x1 - x0)
+    while side > 0:
+        side //= 2
+        bits += 1
+    stack = np.empty((2 * bits + 1, 4), dtype=np.int64)
+    stack[0, 0] = y0
+    stack[0, 1] = x0
+    stack[0, 2] = y1
+    stack[0, 3] = x1
+    top = 1
+    while top > 0:
+        top -= 1
+        ry0 = stack[top, 0]
+        rx0 = stack[top, 1]
+        ry1 = stack[top, 2]
+        rx1 = stack[top, 3]
+
+        if ry1 - ry0 <= min_side or rx1 - rx0 <= min_side:
+            for y in range(ry0, ry1 + 1):
+                for x in range(rx0, rx1 + 1):
+                    _pixel(counts, y, x, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters)
+            continue
+
+        # Compute the border, stop at the first difference, the halves
+        # compute the rest of it
+        first = _pixel(counts, ry0, rx0, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters)
+        uniform = True
+        for x in range(rx0, rx1 + 1):
+            if (_pixel(counts, ry0, x, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters) != first or
+                    _pixel(counts, ry1, x, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters) != first):
+                uniform = False
+                break
+        if uniform:
+            for y in range(ry0 + 1, ry1):
+                if (_pixel(counts, y, rx0, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters) != first or
+                        _pixel(counts, y, rx1, oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters) != first):
+                    uniform = False
+                    break
+
+        # Pixels already known inside, from a coarse pass or a copied
+        # frame, must agree with the border too, otherwise split
+        if uniform:
+            for y in range(ry0 + 1, ry1):
+                for x in range(rx0 + 1, rx1):
+                    if counts[y, x] >= 0 and counts[y, x] != first:
+                        uniform = False
+                        break
+                if not uniform:
+                    break
+
+        if uniform:
+            for y in range(ry0 + 1, ry1):
+                for x in range(rx0 + 1, rx1):
+                    if counts[y, x] < 0:
+                        counts[y, x] = first
+                        filled[y, x] = True
+        elif rx1 - rx0 >= ry1 - ry0:
+            mid = (rx0 + rx1) // 2
+            stack[top, 0] = ry0
+            stack[top, 1] = rx0
+            stack[top, 2] = ry1
+            stack[top, 3] = mid
+            stack[top + 1, 0] = ry0
+            stack[top + 1, 1] = mid
+            stack[top + 1, 2] = ry1
+            stack[top + 1, 3] = rx1
+            top += 2
+        else:
+            mid = (ry0 + ry1) // 2
+            stack[top, 0] = ry0
+            stack[top, 1] = rx0
+            stack[top, 2] = mid
+            stack[top, 3] = rx1
+            stack[top + 1, 0] = mid
+            stack[top + 1, 1] = rx0
+            stack[top + 1, 2] = ry1
+            stack[top + 1, 3] = rx1
+            top += 2
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _render_tiles(min_x, min_y, pixel_size_x, pixel_size_y, counts, filled, oy, ox, iters, tile, min_side):
+    '''
+    Mariani-Silver on every tile of counts, tiles in parallel
+    counts - the rows and columns from (oy, ox) of the whole image
+    '''
+    height = counts.shape[0]
+    width = counts.shape[1]
+
+    rows = (height - 1) // tile + 1
+    columns = (width - 1) // tile + 1
+    for t in prange(rows * columns):
+        y0 = (t // columns) * tile
+        x0 = (t % columns) * tile
+        _mariani_silver(counts, filled, y0, x0, min(y0 + tile, height) - 1, min(x0 + tile, width) - 1,
+                        oy, ox, min_x, min_y, pixel_size_x, pixel_size_y, iters, min_side)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _render_coarse(min_x, max_x, min_y, max_y, counts, image, iters, step):
+    '''
+    Compute every step-th pixel of every step-th row and fill its
+    step x step block of image with it
+    '''
+    height = counts.shape[0]
+    width = counts.shape[1]
+    pixel_size_x = (max_x - min_x) / width
+    pixel_size_y = (max_y - min_y) / height
+
+    for row in prange((height - 1) // step + 1):
+        y = row * step
+        for x in range(0, width, step):
+            count = _pixel(counts, y, x, 0, 0, min_x, min_y, pixel_size_x, pixel_size_y, iters)
+            image[y:y + step, x:x + step] = count
+
+
+def _min_side(fill, tile):
+    return MIN_SIDE if fill else tile
+
+
+def pixel_size(min_x, max_x, min_y, max_y, height, width):
+    '''
+    (pixel_size_x, pixel_size_y) of the pixel mapping of compute_mandel()
+    '''
+    return (max_x - min_x) / width, (max_y - min_y) / height
+
+
+def render_counts(min_x, min_y, pixel_size_x, pixel_size_y, counts, oy=0, ox=0, iters=255, tile=TILE, fill=True,
+                  filled=None):
+    '''
+    Render part of a larger image into counts, an int32 array of -1.
+    counts[y, x] gets pixel (oy + y, ox + x), exactly as it would
+    in a render of the whole image.
+
+    filled - optional bool array of the shape of counts, set True where
+             fill put in a count without iterating the pixel
+    '''
+    if filled is None:
+        filled = np.zeros(counts.shape, dtype=np.bool_)
+    _render_tiles(min_x, min_y, pixel_size_x, pixel_size_y, counts, filled, oy, ox, iters, tile,
+                  _min_side(fill, tile))
+    return counts
+
+
+def progressive(min_x, max_x, min_y, max_y, image, iters, levels=4, tile=TILE, fill=True):
+    '''
+    Render into image from coarse to fine.
+
+    Yields the block size after every pass: first every 2**(levels-1)-th
+    pixel, each drawn as a block, then every half of that, and so on; the
+    last pass (block size 1) renders the full image tile by tile with
+    Mariani-Silver. Pixels of coarse passes are never computed again.
+    image can be shown after every yield.
+
+    fill - False to iterate every pixel instead of filling rectangles,
+           exactly the image of compute_mandel()
+    '''
+    counts = np.full(image.shape, -1, dtype=np.int32)
+    for level in range(levels - 1, 0, -1):
+        step = 2 ** level
+        _render_coarse(min_x, max_x, min_y, max_y, counts, image, iters, step)
+        yield step
+
+    (pixel_size_x, pixel_size_y) = pixel_size(min_x, max_x, min_y, max_y, image.shape[0], image.shape[1])
+    render_counts(min_x, min_y, pixel_size_x, pixel_size_y, counts, 0, 0, iters, tile, fill)
+    image[:] = counts
+    yield 1
+
+
+def render(min_x, max_x, min_y, max_y, image, iters, tile=TILE, fill=True):
+    '''
+    Same signature as compute_mandel() of mandelbrot_cpu.py,
+    without the coarse passes of progressive().
+    '''
+    counts = np.full(image.shape, -1, dtype=np.int32)
+    (pixel_size_x, pixel_size_y) = pixel_size(min_x, max_x, min_y, max_y, image.shape[0], image.shape[1])
+    render_counts(min_x, min_y, pixel_size_x, pixel_size_y, counts, 0, 0, iters, tile, fill)
+    image[:] = counts
+    return image
+
+
+if __name__ == '__main__':
+    import sys
+    import timeit
+    import mandelbrot_cpu
+
+    # Usage: python mandelbrot_tiles.py [iters]
+    iters = int(sys.argv[1]) if len(sys.argv) > 1 else 255
+    image = np.zeros((1024, 1536), dtype=np.uint32)
+    expected = np.zeros_like(image)
+    for (name, function, out) in (('compute_mandel', mandelbrot_cpu.compute_mandel, expected),
+                                  ('render', render, image)):
+        function(-2.0, 1.0, -1.0, 1.0, out, iters)
+        print('%-14s %g seconds' % (name, timeit.timeit(
+            lambda: function(-2.0, 1.0, -1.0, 1.0, out, iters), number=3) / 3))
+    print('pixels different from compute_mandel: %d' % np.count_nonzero(image != expected))
@@ -0,0 +1,185 @@
+#
+# Zoom animations of the Mandelbrot set, reusing the pixels consecutive frames share
+#
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import mandelbrot_tiles
+import pool_context
+
+# Lattice steps per pixel of the last frame of a zoom_path()
+SUBPIXELS = 64
+
+
+def zoom_path(start, end, frames, shape):
+    '''
+    Views (min_x, max_x, min_y, max_y) of frames going from start to end.
+
+    start, end - (center_x, center_y, width) of the first and last frame
+    shape - (height, width) of the frames in pixels
+
+    The width shrinks geometrically and the center moves linearly. Every
+    corner and pixel size is an integer multiple of one power of two, so
+    pixel coordinates are exact and a pixel of one frame lies exactly on a
+    pixel of another whenever the grids line up: pans by whole pixels and
+    zooms by a factor of two share pixels, other zoom steps hardly any.
+    '''
+    (height, width) = shape
+    unit = 2.0 ** np.floor(np.log2(end[2] / width / SUBPIXELS))
+    # Pixel sizes as integers of lattice steps, rounded once so zooms by 2 double them exactly
+    last = int(round(end[2] / width / unit))
+    views = []
+    for k in range(frames):
+        t = k / (frames - 1) if frames > 1 else 1.0
+        step = int(round(last * (start[2] / end[2]) ** (1.0 - t)))
+        center_x = start[0] + t * (end[0] - start[0])
+        center_y = start[1] + t * (end[1] - start[1])
+        # Corners on multiples of the pixel size, so pans move by whole pixels
+        x0 = step * int(round(center_x / unit / step - width / 2.0))
+        y0 = step * int(round(center_y / unit / step - height / 2.0))
+        views.append((x0 * unit, (x0 + width * step) * unit, y0 * unit, (y0 + height * step) * unit))
+    return views
+
+
+def _match(start, size, previous_start, previous_size, n):
+    (_, new, old) = np.intersect1d(start + np.arange(n) * size, previous_start + np.arange(n) * previous_size,
+                                   return_indices=True)
+    return new, old
+
+
+def shared_pixels(view, previous, shape):
+    '''
+    Pixels of the frame view at exactly the coordinates of pixels of the
+    frame previous, computed as the kernels compute them
+
+    Return:
+        (rows, columns, previous rows, previous columns) index arrays
+    '''
+    (height, width) = shape
+    (pixel_size_x, pixel_size_y) = mandelbrot_tiles.pixel_size(view[0], view[1], view[2], view[3], height, width)
+    (previous_x, previous_y) = mandelbrot_tiles.pixel_size(previous[0], previous[1], previous[2], previous[3],
+                                                           height, width)
+    (rows, previous_rows) = _match(view[2], pixel_size_y, previous[2], previous_y, height)
+    (columns, previous_columns) = _match(view[0], pixel_size_x, previous[0], previous_x, width)
+    return rows, columns, previous_rows, previous_columns
+
+
+def render_frame(view, shape, iters, previous=None, previous_counts=None, tile=mandelbrot_tiles.TILE, fill=True):
+    '''
+    Counts of the frame view as mandelbrot_tiles.render() gives them,
+    copying the pixels it shares with the frame previous from its counts
+
+    previous_counts - the exact counts returned for previous, -1 where a
+                      pixel was filled in and is not copied
+
+    Only iterated pixels are copied, so every copied count is the count of
+    mandel(). A rectangle the fill finds uniform is split instead if a
+    copied count inside it doesn't match its border.
+
+    Return:
+        (counts, exact counts, number of pixels copied)
+    '''
+    counts = np.full(shape, -1, dtype=np.int32)
+    reused = 0
+    if previous is not None:
+        (rows, columns, previous_rows, previous_columns) = shared_pixels(view, previous, shape)
+        shared = previous_counts[np.ix_(previous_rows, previous_columns)]
+        counts[np.ix_(rows, columns)] = shared
+        reused = np.count_nonzero(shared >= 0)
+
+    (pixel_size_x, pixel_size_y) = mandelbrot_tiles.pixel_size(view[0], view[1], view[2], view[3], shape[0], shape[1])
+    filled = np.zeros(shape, dtype=np.bool_)
+    mandelbrot_tiles.render_counts(view[0], view[2], pixel_size_x, pixel_size_y, counts, 0, 0, iters, tile, fill,
+                                   filled)
+    return counts, np.where(filled, -1, counts), reused
+
+
+def write_pgm(path, counts, maxval):
+    '''
+    Binary PGM image of counts, 16 bit when maxval is above 255
+    '''
+    if maxval > 65535:
+        raise ValueError('PGM holds values up to 65535, not %d' % maxval)
+    (height, width) = counts.shape
+    with open(path, 'wb') as f:
+        f.write(b'P5\n%d %d\n%d\n' % (width, height, maxval))
+        f.write(np.asarray(counts, dtype='>u2' if maxval > 255 else np.uint8).tobytes())
+
+
+def _render_run(frames, views, shape, iters, directory, pattern, tile, fill):
+    '''
+    worker: render consecutive frames, each from the one before
+    return the number of pixels copied for every frame
+    '''
+    reused = []
+    previous = None
+    exact = None
+    for frame in frames:
+        (counts, exact, copied) = render_frame(views[frame], shape, iters, previous, exact, tile, fill)
+        write_pgm(os.path.join(directory, pattern % frame), counts, iters)
+        previous = views[frame]
+        reused.append(copied)
+    return reused
+
+
+def render_sequence(views, shape, iters, directory, workers=None, pattern='frame_%05d.pgm',
+                    tile=mandelbrot_tiles.TILE, fill=True):
+    '''
+    Render every view into directory as a numbered PGM image sequence,
+    e.g. for ffmpeg -i frame_%05d.pgm.
+
+    The frames are cut into one run of consecutive frames per worker
+    process. The first frame of a run is rendered from scratch, every
+    other one starts from the iterated pixels it shares exactly with the
+    frame before it and only iterates the rest. A single run is rendered
+    in this process.
+
+    workers - number of processes, all cores if None
+
+    Return:
+        (frames,) array of the number of pixels every frame copied
+    '''
+    if iters > 65535:
+        raise ValueError('PGM holds values up to 65535, not %d' % iters)
+    os.makedirs(directory, exist_ok=True)
+    runs = [list(run) for run in np.array_split(np.arange(len(views)), min(workers or os.cpu_count(), len(views)))]
+    reused = np.zeros(len(views), dtype=np.int64)
+    if len(runs) == 1:
+        reused[runs[0]] = _render_run(runs[0], views, shape, iters, directory, pattern, tile, fill)
+        return reused
+
+    with ProcessPoolExecutor(len(runs), mp_context=pool_context.pool_context()) as pool:
+        futures = [(run, pool.submit(_render_run, run, views, shape, iters, directory, pattern, tile, fill))
+                   for run in runs]
+        for (run, future) in futures:
+            reused[run] = future.result()
+    return reused
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+    import mandelbrot_cpu
+
+    # Usage: python mandelbrot_zoom.py [frames] [iters] [directory]
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    iters = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    directory = sys.argv[3] if len(sys.argv) > 3 else tempfile.mkdtemp()
+    shape = (480, 640)
+
+    paths = (('pan', zoom_path((-0.8, 0.0, 0.5), (-0.7, 0.2, 0.5), frames, shape)),
+             ('zoom x2', zoom_path((-0.75, 0.1, 2.0), (-0.75, 0.1, 2.0 / 2 ** (frames - 1)), frames, shape)),
+             ('zoom x1.1', zoom_path((-0.75, 0.1, 2.0), (-0.75, 0.1, 2.0 / 1.1 ** (frames - 1)), frames, shape)))
+    image = np.zeros(shape, dtype=np.uint32)
+    for (name, views) in paths:
+        start = time.perf_counter()
+        for view in views:
+            mandelbrot_cpu.compute_mandel(view[0], view[1], view[2], view[3], image, iters)
+        scratch = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reused = render_sequence(views, shape, iters, directory)
+        print('%-9s compute_mandel %.3gs, render_sequence %.3gs, %.1f%% of pixels reused' % (
+            name, scratch, time.perf_counter() - start, 100.0 * reused.sum() / (frames * shape[0] * shape[1])))
+    print('frames in %s' % directory)
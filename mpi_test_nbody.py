@@ -0,0 +1,44 @@
+'''
+Test script for the MPI N-body driver.
+To run test: mpiexec -n N python mpi_test_nbody.py
+where N is any positive integer.
+Not named test_*.py, so plain unittest/pytest discovery doesn't initialise MPI.
+'''
+
+import unittest
+from mpi4py import MPI
+import numpy as np
+import nbody_loader
+import nbody_mpi
+import nbody_vec
+
+class TestNbodyMPI(unittest.TestCase):
+
+    def setUp(self):
+        self.comm = MPI.COMM_WORLD
+        self.rank = self.comm.Get_rank()
+
+    def test_partition(self):
+        '''
+        Blocks should cover all bodies once and differ in size by at most one.
+        '''
+        counts, displs = nbody_mpi.partition(10, 4)
+        self.assertEqual(list(counts), [3, 3, 2, 2])
+        self.assertEqual(list(displs), [0, 3, 6, 8])
+
+    def test_advance(self):
+        '''
+        Every rank should end up with the same positions and energy as the serial engine.
+        '''
+        bodies = nbody_loader.plummer(50, seed=4)
+        (r, v, m) = [x.copy() for x in bodies]
+        nbody_vec.advance(1e-3, 20, r, v, m)
+        expected = nbody_vec.report_energy(r, v, m)
+
+        (r_mpi, v_mpi, m_mpi, counts, displs) = nbody_mpi.scatter_bodies(bodies, self.comm)
+        nbody_mpi.advance(1e-3, 20, r_mpi, v_mpi, m_mpi, counts, displs, self.comm)
+        self.assertTrue(np.allclose(r, r_mpi, rtol=1e-12, atol=1e-12))
+        self.assertAlmostEqual(expected, nbody_mpi.report_energy(r_mpi, v_mpi, m_mpi, counts, displs, self.comm), places=10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,299 @@
+"""
+    N-body simulation.
+    Barnes-Hut tree code using numba.
+
+    Instead of visiting every pair, each step builds an octree over the bodies
+    and every body walks the tree. A cell of size s at distance d from the body
+    is treated as a single point mass at its center of mass when s / d < theta,
+    otherwise the walk opens the cell and visits its children.
+    theta = 0 visits every body and gives the exact pairwise result,
+    larger theta is faster and less accurate. Cost per step is O(N log N).
+
+    advance(), report_energy() and offset_momentum() take the same (r, v, m)
+    arrays as nbody_vec, so this is a drop-in replacement for its advance().
+"""
+from numba import jit
+import numpy as np
+import nbody_integrators
+import nbody_vec
+
+# Default opening angle
+THETA = 0.5
+
+# Deeper trees only happen for (nearly) coincident bodies
+MAX_DEPTH = 64
+
+# child[node, octant] is -1 for an empty octant, a node index >= 0
+# or a body b stored as -(b + 2)
+EMPTY = -1
+
+
+@jit(nopython=True, cache=True)
+def _grow(child, center, half, capacity):
+    '''
+        double the capacity of the node arrays
+    '''
+    new_child = np.full((2 * capacity, 8), EMPTY, dtype=np.int64)
+    new_center = np.empty((2 * capacity, 3), dtype=np.float64)
+    new_half = np.empty(2 * capacity, dtype=np.float64)
+    new_child[:capacity] = child
+    new_center[:capacity] = center
+    new_half[:capacity] = half
+    return new_child, new_center, new_half
+
+
+@jit(nopython=True, cache=True)
+def _octant(p, c):
+    '''
+        index 0..7 of the octant of point p around center c
+    '''
+    k = 0
+    if p[0] >= c[0]:
+        k |= 1
+    if p[1] >= c[1]:
+        k |= 2
+    if p[2] >= c[2]:
+        k |= 4
+    return k
+
+
+@jit(nopython=True, cache=True)
+def build_tree(r, m):
+    '''
+        build an octree over the bodies
+        return child, half size, center of mass and mass of every node,
+        node 0 is the root and children always have larger indices than parents
+    '''
+    n = len(r)
+    capacity = 2 * n + 8
+    child = np.full((capacity, 8), EMPTY, dtype=np.int64)
+    center = np.empty((capacity, 3), dtype=np.float64)
+    half = np.empty(capacity, dtype=np.float64)
+
+    # Root is the bounding cube of all bodies
+    lo = r[0].copy()
+    hi = r[0].copy()
+    for b in range(n):
+        for k in range(3):
+            lo[k] = min(lo[k], r[b, k])
+            hi[k] = max(hi[k], r[b, k])
+    size = 0.0
+    for k in range(3):
+        center[0, k] = 0.5 * (lo[k] + hi[k])
+        size = max(size, hi[k] - lo[k])
+    half[0] = 0.5 * size * (1.0 + 1e-12) + 1e-300
+    nodes = 1
+
+    for b in range(n):
+        node = 0
+        depth = 0
+        while True:
+            k = _octant(r[b], center[node])
+            c = child[node, k]
+            if c == EMPTY:
+                child[node, k] = -(b + 2)
+                break
+            if c >= 0:
+                node = c
+                depth += 1
+                continue
+
+            # Octant holds a single body, split it into a new cell
+            if depth >= MAX_DEPTH:
+                raise ValueError('Bodies are too close to each other to build the tree')
+            if nodes == capacity:
+                child, center, half = _grow(child, center, half, capacity)
+                capacity *= 2
+            new = nodes
+            nodes += 1
+            half[new] = 0.5 * half[node]
+            for i in range(3):
+                if (k >> i) & 1:
+                    center[new, i] = center[node, i] + half[new]
+                else:
+                    center[new, i] = center[node, i] - half[new]
+            other = -(c + 2)
+            child[new, _octant(r[other], center[new])] = c
+            child[node, k] = new
+            node = new
+            depth += 1
+
+    # Accumulate masses and centers of mass from the leaves up
+    mass = np.zeros(nodes, dtype=np.float64)
+    com = np.zeros((nodes, 3), dtype=np.float64)
+    for node in range(nodes - 1, -1, -1):
+        for k in range(8):
+            c = child[node, k]
+            if c == EMPTY:
+                continue
+            if c >= 0:
+                mass[node] += mass[c]
+                for i in range(3):
+                    com[node, i] += mass[c] * com[c, i]
+            else:
+                other = -(c + 2)
+                mass[node] += m[other]
+                for i in range(3):
+                    com[node, i] += m[other] * r[other, i]
+        for i in range(3):
+            com[node, i] /= mass[node]
+
+    return child[:nodes], half[:nodes], com, mass
+
+
+@jit(nopython=True, cache=True)
+def tree_accelerations(r, m, theta, out):
+    '''
+        compute the acceleration of every body by walking the octree
+        out - (N,3) buffer for the result
+    '''
+    child, half, com, mass = build_tree(r, m)
+    theta2 = theta * theta
+    stack = np.empty(8 * MAX_DEPTH + 8, dtype=np.int64)
+
+    for b in range(len(r)):
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        stack[0] = 0
+        top = 1
+        while top > 0:
+            top -= 1
+            node = stack[top]
+            dx = r[b, 0] - com[node, 0]
+            dy = r[b, 1] - com[node, 1]
+            dz = r[b, 2] - com[node, 2]
+            dist2 = dx * dx + dy * dy + dz * dz
+
+            # Far enough away, use the cell as a point mass
+            size = 2.0 * half[node]
+            if size * size < theta2 * dist2:
+                mag = mass[node] * dist2 ** (-1.5)
+                ax -= dx * mag
+                ay -= dy * mag
+                az -= dz * mag
+                continue
+
+            # Otherwise open the cell
+            for k in range(8):
+                c = child[node, k]
+                if c >= 0:
+                    stack[top] = c
+                    top += 1
+                elif c != EMPTY:
+                    other = -(c + 2)
+                    if other == b:
+                        continue
+                    dx = r[b, 0] - r[other, 0]
+                    dy = r[b, 1] - r[other, 1]
+                    dz = r[b, 2] - r[other, 2]
+                    mag = m[other] * (dx * dx + dy * dy + dz * dz) ** (-1.5)
+                    ax -= dx * mag
+                    ay -= dy * mag
+                    az -= dz * mag
+
+        out[b, 0] = ax
+        out[b, 1] = ay
+        out[b, 2] = az
+
+    return out
+
+
+def accelerations(r, m, theta=THETA, out=None):
+    '''
+        Barnes-Hut replacement for nbody_vec.accelerations()
+    '''
+    if out is None:
+        out = np.empty_like(r)
+    return tree_accelerations(r, m, theta, out)
+
+
+# Same signature as nbody_vec.advance() with an opening angle
+def advance(dt, iterations, r, v, m, theta=THETA, integrator='euler'):
+    '''
+        advance the system iterations timesteps in place
+        integrator - name or function from nbody_integrators
+    '''
+    def accel(r, m, out):
+        return tree_accelerations(r, m, theta, out)
+
+    integrate = nbody_integrators.get_integrator(integrator)
+    return integrate(dt, iterations, r, v, m, accel)
+
+
+def force_error(r, m, theta=THETA):
+    '''
+        compare tree accelerations against the exact pairwise result
+
+        Return:
+            (max, rms) of |a_tree - a_exact| / |a_exact| over all bodies
+    '''
+    exact = nbody_vec.accelerations(r, m)
+    approx = accelerations(r, m, theta)
+    error = np.sqrt(np.sum((approx - exact) ** 2, axis=1) / np.sum(exact * exact, axis=1))
+    return float(np.max(error)), float(np.sqrt(np.mean(error * error)))
+
+
+@jit(nopython=True, cache=True)
+def report_energy(r, v, m, e=0.0):
+    '''
+        compute the exact energy and return it so that it can be printed
+        loops over pairs instead of building pair arrays, so memory stays O(N)
+    '''
+    n = len(m)
+    for i in range(n):
+        for j in range(i + 1, n):
+            dx = r[i, 0] - r[j, 0]
+            dy = r[i, 1] - r[j, 1]
+            dz = r[i, 2] - r[j, 2]
+            e -= (m[i] * m[j]) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
+
+    for i in range(n):
+        e += m[i] * (v[i, 0] * v[i, 0] + v[i, 1] * v[i, 1] + v[i, 2] * v[i, 2]) / 2.
+
+    return e
+
+
+offset_momentum = nbody_vec.offset_momentum
+
+
+def nbody(loops, reference, iterations, bodies=None, theta=THETA, integrator='euler'):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - index of body at center of system
+        iterations - number of timesteps to advance
+        bodies - optional (r, v, m) arrays, the five planets if None
+        theta - opening angle of the tree walk
+        integrator - name or function from nbody_integrators
+    '''
+    integrator = nbody_integrators.get_integrator(integrator)
+
+    if bodies is None:
+        r, v, m = nbody_vec.initialize()
+    else:
+        r, v, m = bodies
+
+    offset_momentum(reference, v, m)
+
+    for _ in range(loops):
+        advance(0.01, iterations, r, v, m, theta, integrator)
+        print(report_energy(r, v, m))
+
+
+if __name__ == '__main__':
+    import sys
+    import timeit
+    import nbody_loader
+
+    # Usage: python nbody_bh.py [N] [theta]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    theta = float(sys.argv[2]) if len(sys.argv) > 2 else THETA
+    r, v, m = nbody_loader.plummer(n, seed=0)
+
+    # Compile once before timing
+    accelerations(r[:8], m[:8], theta)
+    print('theta %g, %d bodies, one step: %g seconds' % (
+        theta, n, timeit.timeit(lambda: advance(0.001, 1, r, v, m, theta), number=1)))
+    if n <= 20000:
+        print('force error (max, rms):', force_error(r, m, theta))
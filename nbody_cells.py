@@ -0,0 +1,256 @@
+"""
+    N-body simulation.
+    Short-range softened forces with a cell list and Verlet neighbor list.
+
+    Instead of every pair from combinations(), only pairs closer than a cutoff
+    radius interact, through a softened kernel that doesn't blow up in close
+    encounters:
+        a_i = -sum_j m_j (r_i - r_j) / (|r_i - r_j|^2 + eps^2)^1.5,  |r_i - r_j| < cutoff
+
+    Neighbor pairs are found by binning bodies into cubic cells of size
+    cutoff + skin and only looking at the 27 surrounding cells.
+    The pair list is kept until some body has moved more than skin / 2
+    since it was built, so most steps touch O(N) pairs and do no search at all.
+
+    The accelerations plug into nbody_integrators like nbody_vec.accelerations.
+"""
+from numba import jit
+import numpy as np
+import nbody_integrators
+
+
+@jit(nopython=True, cache=True)
+def _cell_grid(r, reach):
+    '''
+        cell of every body on a grid of cubes at least reach wide
+        return cell index per body, grid dimensions and bodies sorted by cell
+        with start offsets of every cell
+    '''
+    n = len(r)
+    lo = r[0].copy()
+    hi = r[0].copy()
+    for b in range(n):
+        for k in range(3):
+            lo[k] = min(lo[k], r[b, k])
+            hi[k] = max(hi[k], r[b, k])
+
+    # Grow cells if the box would need many more cells than bodies
+    size = reach
+    while True:
+        dims = np.empty(3, dtype=np.int64)
+        total = 1
+        for k in range(3):
+            dims[k] = int((hi[k] - lo[k]) / size) + 1
+            total *= dims[k]
+        if total <= 8 * n + 27:
+            break
+        size *= 2.0
+
+    cell = np.empty(n, dtype=np.int64)
+    for b in range(n):
+        cx = min(int((r[b, 0] - lo[0]) / size), dims[0] - 1)
+        cy = min(int((r[b, 1] - lo[1]) / size), dims[1] - 1)
+        cz = min(int((r[b, 2] - lo[2]) / size), dims[2] - 1)
+        cell[b] = (cx * dims[1] + cy) * dims[2] + cz
+
+    # Counting sort of bodies by cell
+    start = np.zeros(total + 1, dtype=np.int64)
+    for b in range(n):
+        start[cell[b] + 1] += 1
+    for c in range(total):
+        start[c + 1] += start[c]
+    order = np.empty(n, dtype=np.int64)
+    fill = start[:-1].copy()
+    for b in range(n):
+        order[fill[cell[b]]] = b
+        fill[cell[b]] += 1
+
+    return cell, dims, order, start
+
+
+@jit(nopython=True, cache=True)
+def _scan_pairs(r, reach, cell, dims, order, start, pairs_i, pairs_j, count_only):
+    '''
+        walk the 27 neighbor cells of every body, count or store pairs i < j
+        closer than reach
+    '''
+    reach2 = reach * reach
+    found = 0
+    for i in range(len(r)):
+        c = cell[i]
+        cz = c % dims[2]
+        cy = (c // dims[2]) % dims[1]
+        cx = c // (dims[1] * dims[2])
+        for ox in range(max(cx - 1, 0), min(cx + 2, dims[0])):
+            for oy in range(max(cy - 1, 0), min(cy + 2, dims[1])):
+                for oz in range(max(cz - 1, 0), min(cz + 2, dims[2])):
+                    other = (ox * dims[1] + oy) * dims[2] + oz
+                    for k in range(start[other], start[other + 1]):
+                        j = order[k]
+                        if j <= i:
+                            continue
+                        dx = r[i, 0] - r[j, 0]
+                        dy = r[i, 1] - r[j, 1]
+                        dz = r[i, 2] - r[j, 2]
+                        if dx * dx + dy * dy + dz * dz < reach2:
+                            if not count_only:
+                                pairs_i[found] = i
+                                pairs_j[found] = j
+                            found += 1
+    return found
+
+
+def build_pairs(r, reach):
+    '''
+        index arrays (i, j) of all pairs i < j closer than reach
+    '''
+    cell, dims, order, start = _cell_grid(r, reach)
+    empty = np.empty(0, dtype=np.int64)
+    count = _scan_pairs(r, reach, cell, dims, order, start, empty, empty, True)
+    pairs_i = np.empty(count, dtype=np.int64)
+    pairs_j = np.empty(count, dtype=np.int64)
+    _scan_pairs(r, reach, cell, dims, order, start, pairs_i, pairs_j, False)
+    return pairs_i, pairs_j
+
+
+class NeighborList(object):
+    '''
+        Verlet neighbor list of pairs within cutoff + skin
+        rebuilt only when a body moved more than skin / 2 since the last build
+
+        cutoff - interaction radius
+        skin - extra radius kept in the list, larger means fewer rebuilds
+               but more pairs per step
+        builds - number of times the list was built
+    '''
+    __slots__ = ('cutoff', 'skin', 'pairs_i', 'pairs_j', 'r_built', 'builds')
+
+    def __init__(self, cutoff, skin=None):
+        self.cutoff = cutoff
+        self.skin = 0.1 * cutoff if skin is None else skin
+        self.pairs_i = None
+        self.pairs_j = None
+        self.r_built = None
+        self.builds = 0
+
+    def update(self, r):
+        '''
+            rebuild the pair list if r moved too far from the last build
+            return True if it was rebuilt
+        '''
+        if self.r_built is not None and len(self.r_built) == len(r):
+            moved = _max_displacement2(r, self.r_built)
+            if moved <= 0.25 * self.skin * self.skin:
+                return False
+        self.pairs_i, self.pairs_j = build_pairs(r, self.cutoff + self.skin)
+        self.r_built = r.copy()
+        self.builds += 1
+        return True
+
+
+@jit(nopython=True, cache=True)
+def _max_displacement2(r, r_built):
+    moved = 0.0
+    for b in range(len(r)):
+        dx = r[b, 0] - r_built[b, 0]
+        dy = r[b, 1] - r_built[b, 1]
+        dz = r[b, 2] - r_built[b, 2]
+        moved = max(moved, dx * dx + dy * dy + dz * dz)
+    return moved
+
+
+@jit(nopython=True, cache=True)
+def pair_accelerations(r, m, pairs_i, pairs_j, cutoff, softening, out):
+    '''
+        softened accelerations over the listed pairs closer than cutoff
+        out - (N,3) buffer for the result
+    '''
+    out[:] = 0.0
+    cutoff2 = cutoff * cutoff
+    eps2 = softening * softening
+    for p in range(len(pairs_i)):
+        i = pairs_i[p]
+        j = pairs_j[p]
+        dx = r[i, 0] - r[j, 0]
+        dy = r[i, 1] - r[j, 1]
+        dz = r[i, 2] - r[j, 2]
+        dist2 = dx * dx + dy * dy + dz * dz
+        if dist2 >= cutoff2:
+            continue
+        mag = (dist2 + eps2) ** (-1.5)
+        b2 = m[j] * mag
+        b1 = m[i] * mag
+        out[i, 0] -= dx * b2
+        out[i, 1] -= dy * b2
+        out[i, 2] -= dz * b2
+        out[j, 0] += dx * b1
+        out[j, 1] += dy * b1
+        out[j, 2] += dz * b1
+    return out
+
+
+@jit(nopython=True, cache=True)
+def _pair_energy(r, v, m, pairs_i, pairs_j, cutoff, softening):
+    e = 0.0
+    cutoff2 = cutoff * cutoff
+    eps2 = softening * softening
+    for p in range(len(pairs_i)):
+        i = pairs_i[p]
+        j = pairs_j[p]
+        dx = r[i, 0] - r[j, 0]
+        dy = r[i, 1] - r[j, 1]
+        dz = r[i, 2] - r[j, 2]
+        dist2 = dx * dx + dy * dy + dz * dz
+        if dist2 < cutoff2:
+            e -= (m[i] * m[j]) / ((dist2 + eps2) ** 0.5)
+    for i in range(len(m)):
+        e += m[i] * (v[i, 0] * v[i, 0] + v[i, 1] * v[i, 1] + v[i, 2] * v[i, 2]) / 2.
+    return e
+
+
+def make_accelerations(neighbors, softening):
+    '''
+        accel(r, m, out) for nbody_integrators using a neighbor list
+    '''
+    def accel(r, m, out):
+        neighbors.update(r)
+        return pair_accelerations(r, m, neighbors.pairs_i, neighbors.pairs_j,
+                                  neighbors.cutoff, softening, out)
+    return accel
+
+
+def advance(dt, iterations, r, v, m, neighbors, softening=0.0, integrator='euler'):
+    '''
+        advance the system iterations timesteps in place with short-range forces
+        neighbors - NeighborList, keeps its pairs between calls
+        softening - softening length eps
+        integrator - name or function from nbody_integrators
+    '''
+    integrate = nbody_integrators.get_integrator(integrator)
+    return integrate(dt, iterations, r, v, m, make_accelerations(neighbors, softening))
+
+
+def report_energy(r, v, m, neighbors, softening=0.0):
+    '''
+        kinetic plus truncated, softened potential energy
+        -m_i m_j / sqrt(d^2 + eps^2) for every pair closer than the cutoff
+    '''
+    neighbors.update(r)
+    return _pair_energy(r, v, m, neighbors.pairs_i, neighbors.pairs_j, neighbors.cutoff, softening)
+
+
+if __name__ == '__main__':
+    import sys
+    import timeit
+    import nbody_loader
+
+    # Usage: python nbody_cells.py [N] [cutoff]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    cutoff = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    r, v, m = nbody_loader.uniform(n, seed=0, radius=1.0, velocity=0.01)
+    neighbors = NeighborList(cutoff)
+
+    advance(1e-3, 1, r, v, m, neighbors, 1e-3)
+    seconds = timeit.timeit(lambda: advance(1e-3, 100, r, v, m, neighbors, 1e-3), number=1)
+    print('%d bodies, cutoff %g: %g seconds per step, %d pairs, %d builds' % (
+        n, cutoff, seconds / 100, len(neighbors.pairs_i), neighbors.builds))
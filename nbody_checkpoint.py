@@ -0,0 +1,229 @@
+"""
+    Checkpoint and restart of N-body simulation state.
+
+    A checkpoint file is a memory-mapped array of two snapshot slots.
+    Each slot holds step count, simulated time, the energy the run started
+    with, integrator state and an (N,7) table of positions, velocities and
+    masses (see nbody_loader). The integrator state is the step size of
+    'adaptive' and the running compensation of the Kahan integrators, so a
+    resumed run continues exactly as an uninterrupted one.
+    Saves alternate between the slots and a slot's sequence number is written
+    last, after the table is flushed, so a crash in the middle of a save
+    always leaves the previous snapshot intact.
+
+    save() only copies the state and returns, a background thread writes
+    it to the file. If the thread is still busy when the next save() comes,
+    the older pending snapshot is dropped in favor of the new one, so the
+    compute loop never waits on the disk. An error in the thread, e.g. a
+    full disk, is raised by the next save(), wait() or close().
+"""
+import os
+import threading
+import numpy as np
+import nbody_integrators
+import nbody_loader
+
+# Number of alternating slots in a file
+SLOTS = 2
+
+
+def snapshot_dtype(n):
+    '''
+        record layout of one slot for n bodies
+    '''
+    return np.dtype([
+        ('sequence', '<i8'),
+        ('n', '<i8'),
+        ('step', '<i8'),
+        ('time', '<f8'),
+        ('energy', '<f8'),
+        ('integrator', 'S16'),
+        ('h', '<f8'),
+        ('compensation', '<f8', (2, n, 3)),
+        ('table', '<f8', (n, nbody_loader.COLUMNS))])
+
+
+def _bodies_in_file(path):
+    '''
+        number of bodies of an existing checkpoint file
+    '''
+    head = np.fromfile(path, dtype='<i8', count=2)
+    return int(head[1])
+
+
+def _latest(slots):
+    '''
+        newest complete snapshot of the slots, None if nothing was saved yet
+    '''
+    slot = int(np.argmax(slots['sequence']))
+    record = slots[slot]
+    if record['sequence'] == 0:
+        return None
+    r, v, m = nbody_loader.split_table(record['table'])
+    return {'step': int(record['step']),
+            'time': float(record['time']),
+            'energy': float(record['energy']),
+            'integrator': record['integrator'].decode(),
+            'h': float(record['h']),
+            'compensation': np.array(record['compensation']),
+            'r': r, 'v': v, 'm': m}
+
+
+def integrator_state(integrator):
+    '''
+        (name, step size, compensation) to store for an integrator, step size
+        is nan unless the integrator adapts it, compensation is the (2,N,3)
+        array of cr and cv of a Kahan integrator, None for the others
+    '''
+    if integrator is None:
+        return '', np.nan, None
+    if isinstance(integrator, nbody_integrators.Adaptive):
+        return 'adaptive', np.nan if integrator.h is None else integrator.h, None
+    if isinstance(integrator, nbody_integrators.Compensated):
+        compensation = None
+        if integrator.cr is not None:
+            compensation = np.stack([integrator.cr, integrator.cv])
+        return integrator.method + '_kahan', np.nan, compensation
+    for name, function in nbody_integrators.INTEGRATORS.items():
+        if function is integrator:
+            return name, np.nan, None
+    return str(integrator)[:16], np.nan, None
+
+
+def restore_integrator(integrator, h, compensation=None):
+    '''
+        put a stored step size back into an adaptive integrator and
+        a stored compensation into a Kahan integrator
+    '''
+    if isinstance(integrator, nbody_integrators.Adaptive) and not np.isnan(h):
+        integrator.h = h
+    if isinstance(integrator, nbody_integrators.Compensated) and compensation is not None:
+        integrator.cr = compensation[0].copy()
+        integrator.cv = compensation[1].copy()
+    return integrator
+
+
+class Checkpointer(object):
+    '''
+        periodic, non-blocking snapshots of one simulation in a memory-mapped file
+        path - checkpoint file, created if it does not exist
+        n - number of bodies, taken from the file if it exists
+    '''
+
+    def __init__(self, path, n=None):
+        self.path = path
+        if os.path.exists(path):
+            file_n = _bodies_in_file(path)
+            if n is not None and n != file_n:
+                raise ValueError('%s holds %d bodies, not %d' % (path, file_n, n))
+            self.slots = np.memmap(path, dtype=snapshot_dtype(file_n), mode='r+', shape=(SLOTS,))
+        else:
+            if n is None:
+                raise ValueError('Number of bodies is needed to create %s' % path)
+            self.slots = np.memmap(path, dtype=snapshot_dtype(n), mode='w+', shape=(SLOTS,))
+            self.slots['n'] = n
+            self.slots.flush()
+
+        self.sequence = int(np.max(self.slots['sequence']))
+        self._pending = None
+        self._busy = False
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def latest(self):
+        '''
+            newest complete snapshot as a dict with keys
+            step, time, energy, integrator, h, compensation, r, v, m
+            or None if nothing was saved yet
+        '''
+        return _latest(self.slots)
+
+    def save(self, step, time, r, v, m, integrator=None, energy=np.nan):
+        '''
+            copy the state and queue it for writing, returns immediately
+            energy - energy at the start of the run, to measure drift from
+        '''
+        if self._error is not None:
+            raise self._error
+        name, h, compensation = integrator_state(integrator)
+        if compensation is None:
+            compensation = 0.0
+        snapshot = (step, time, energy, name, h, compensation, nbody_loader.join_table(r, v, m))
+        with self._condition:
+            self._pending = snapshot
+            self._condition.notify_all()
+
+    def wait(self):
+        '''
+            block until every queued snapshot is on disk
+        '''
+        with self._condition:
+            while self._pending is not None or self._busy:
+                self._condition.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        '''
+            write the last queued snapshot and stop the writer thread
+        '''
+        with self._condition:
+            while self._pending is not None or self._busy:
+                self._condition.wait()
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        del self.slots
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                snapshot = self._pending
+                self._pending = None
+                self._busy = True
+
+            try:
+                self._write(*snapshot)
+            except Exception as err:
+                # Raised again in the simulation thread by save(), wait() or close()
+                self._error = err
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _write(self, step, time, energy, name, h, compensation, table):
+        # Overwrite the older slot, then mark it valid
+        slot = int(np.argmin(self.slots['sequence']))
+        record = self.slots[slot:slot + 1]
+        record['sequence'] = 0
+        record['step'] = step
+        record['time'] = time
+        record['energy'] = energy
+        record['integrator'] = name.encode()
+        record['h'] = h
+        record['compensation'] = compensation
+        record['table'] = table
+        self.slots.flush()
+
+        self.sequence += 1
+        record['sequence'] = self.sequence
+        self.slots.flush()
+
+
+def load_checkpoint(path):
+    '''
+        newest snapshot of a checkpoint file, see Checkpointer.latest()
+    '''
+    n = _bodies_in_file(path)
+    return _latest(np.memmap(path, dtype=snapshot_dtype(n), mode='r', shape=(SLOTS,)))
@@ -7,8 +7,17 @@
     Optimized Runtime with cython:  8.240735985360569 seconds
     Speedup to original:            13.740614409342216x
     Speedup to w/o cython:          4.024142205819004x
+
+    There is no runtime precision mode here as in nbody_ensemble and
+    nbody_numba: the ctypedef real below fixes the type when the module
+    is compiled.
 """
-from itertools import combinations
+import nbody_plan
+
+# Precision of all typed variables, double to match the Python and numba versions.
+# With float the float64 state is truncated to float32 on every step.
+# BODIES itself always holds Python floats.
+ctypedef double real
 
 
 # Initialize BODIES and return it
@@ -16,20 +25,20 @@ def initialize():
     '''
         initialize statue of BODIES
     '''
-    cdef float PI = 3.14159265358979323
-    cdef float SOLAR_MASS = 4 * PI * PI
-    cdef float DAYS_PER_YEAR = 365.24
-
-    cdef float r1[3]
-    cdef float r2[3]
-    cdef float r3[3]
-    cdef float r4[3]
-    cdef float r5[3]
-    cdef float v1[3]
-    cdef float v2[3]
-    cdef float v3[3]
-    cdef float v4[3]
-    cdef float v5[3]
+    cdef real PI = 3.14159265358979323
+    cdef real SOLAR_MASS = 4 * PI * PI
+    cdef real DAYS_PER_YEAR = 365.24
+
+    cdef real r1[3]
+    cdef real r2[3]
+    cdef real r3[3]
+    cdef real r4[3]
+    cdef real r5[3]
+    cdef real v1[3]
+    cdef real v2[3]
+    cdef real v3[3]
+    cdef real v4[3]
+    cdef real v5[3]
     
     r1 = [0.0, 0.0, 0.0]
     v1 = [0.0, 0.0, 0.0]
@@ -42,7 +51,7 @@ def initialize():
     r5 = [1.53796971148509165e+01, -2.59193146099879641e+01, 1.79258772950371181e-01]
     v5 = [2.68067772490389322e-03 * DAYS_PER_YEAR, 1.62824170038242295e-03 * DAYS_PER_YEAR, -9.51592254519715870e-05 * DAYS_PER_YEAR]
     
-    cdef float m1,m2,m3,m4,m5
+    cdef real m1,m2,m3,m4,m5
     m1 = SOLAR_MASS
     m2 = 9.54791938424326609e-04 * SOLAR_MASS
     m3 = 2.85885980666130812e-04 * SOLAR_MASS
@@ -60,11 +69,11 @@ def initialize():
 
 # Add iterations
 # Add BODIES to parameters
-def advance(float dt, int iterations, dict BODIES, list cached_body_pairs):
+def advance(real dt, int iterations, dict BODIES, list cached_body_pairs):
     '''
         advance the system one timestep
     '''
-    cdef float x1,y1,z1,x2,y2,z2,m1,m2,dx,dy,dz,mag,b1,b2
+    cdef real x1,y1,z1,x2,y2,z2,m1,m2,dx,dy,dz,mag,b1,b2
     cdef list v1,v2,r
     for _ in range(iterations):
         # Remove nested for-loop with cached body pairs
@@ -99,12 +108,12 @@ def advance(float dt, int iterations, dict BODIES, list cached_body_pairs):
     return BODIES
     
 # Add BODIES and cached_body_pairs to parameters
-def report_energy(dict BODIES, list cached_body_pairs, float e=0.0):
+def report_energy(dict BODIES, list cached_body_pairs, real e=0.0):
     '''
         compute the energy and return it so that it can be printed
     '''
     # Remove nested for-loop with cached body pairs
-    cdef float x1,x2,y1,y2,z1,z2,m1,m2,dx,dy,dz
+    cdef real x1,x2,y1,y2,z1,z2,m1,m2,dx,dy,dz
     cdef list v1,v2
     for body1, body2 in cached_body_pairs:
         ((x1, y1, z1), v1, m1) = BODIES[body1]
@@ -116,7 +125,7 @@ def report_energy(dict BODIES, list cached_body_pairs, float e=0.0):
         # Compute energy
         e -= (m1 * m2) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
     
-    cdef float vx,vy,vz,m
+    cdef real vx,vy,vz,m
     cdef list r
     for body in BODIES.keys():
         (r, [vx, vy, vz], m) = BODIES[body]
@@ -125,12 +134,12 @@ def report_energy(dict BODIES, list cached_body_pairs, float e=0.0):
     return e
 
 # Add BODIES to parameters
-def offset_momentum(tuple ref, dict BODIES, float px=0.0, float py=0.0, float pz=0.0):
+def offset_momentum(tuple ref, dict BODIES, real px=0.0, real py=0.0, real pz=0.0):
     '''
         ref is the body in the center of the system
         offset values from this reference
     '''
-    cdef float vx,vy,vz,m
+    cdef real vx,vy,vz,m
     cdef list v,r
     for body in BODIES.keys():
         (r, [vx, vy, vz], m) = BODIES[body]
@@ -146,18 +155,21 @@ def offset_momentum(tuple ref, dict BODIES, float px=0.0, float py=0.0, float pz
     # Add returned value
     return BODIES
 
-def nbody(int loops, str reference, int iterations):
+def nbody(int loops, str reference, int iterations, plan=None):
     '''
         nbody simulation
         loops - number of loops to run
         reference - body at center of system
         iterations - number of timesteps to advance
+        plan - optional nbody_plan.InteractionPlan of the bodies
     '''
     # Set up global state
     BODIES = initialize()  
 
     # Generator all body pairs
-    cached_body_pairs = list(combinations(BODIES.keys(), 2))
+    if plan is None:
+        plan = nbody_plan.InteractionPlan(len(BODIES))
+    cached_body_pairs = plan.names(BODIES.keys())
 
     # Add BODIES to parameters
     offset_momentum(BODIES[reference], BODIES)
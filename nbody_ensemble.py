@@ -0,0 +1,237 @@
+"""
+    N-body simulation.
+    Ensembles of independent systems advanced together.
+
+    A parameter sweep runs M copies of the same system with perturbed
+    initial conditions. With only 10 pairs per five-body system, one system
+    can't keep a core busy, so all M systems are stored together:
+        r - (M,N,3) float64 positions
+        v - (M,N,3) float64 velocities
+        m - (M,N) float64 masses
+    and one jitted kernel advances every system, in parallel over systems.
+    report_energy() returns one energy per system.
+
+    Precision modes trade accuracy for memory bandwidth:
+        float64 - float64 storage and arithmetic
+        mixed   - float32 storage, float64 arithmetic and accumulation
+                  within a step, rounded into storage once per step
+        float32 - float32 storage and arithmetic
+    Energies are always summed in float64. compare_precision() measures
+    the energy error of each mode against the float64 run.
+"""
+import time
+from numba import jit, prange
+import numpy as np
+import nbody_vec
+
+# Storage and arithmetic type of every precision mode
+PRECISIONS = {
+    'float64': (np.float64, np.float64),
+    'mixed': (np.float32, np.float64),
+    'float32': (np.float32, np.float32),
+}
+
+
+def precision_types(precision):
+    '''
+        (storage, arithmetic) types of a precision mode, shared with nbody_numba
+    '''
+    try:
+        return PRECISIONS[precision]
+    except KeyError:
+        raise ValueError('Unknown precision %r, must be one of %s' % (
+            precision, ', '.join(sorted(PRECISIONS))))
+
+
+def precision_report(run, precisions):
+    '''
+        time run(precision), which returns the energies of one run as an
+        array over loops (and systems), in every precision mode
+
+        Return:
+            dict of precision -> dict of
+                seconds - wall time of the run
+                drift - max over systems of |E_end / E_start - 1|
+                error - max over loops and systems of |E - E_float64| / |E_float64|
+    '''
+    energies = {}
+    report = {}
+    for precision in ('float64',) + tuple(p for p in precisions if p != 'float64'):
+        start = time.perf_counter()
+        e = energies[precision] = np.asarray(run(precision))
+        seconds = time.perf_counter() - start
+        reference = energies['float64']
+        report[precision] = {
+            'seconds': seconds,
+            'drift': float(np.max(np.abs(e[-1] / e[0] - 1.0))),
+            'error': float(np.max(np.abs((e - reference) / reference))),
+        }
+    return report
+
+
+def initialize(systems, seed=None, scale=1e-6, bodies=None, precision='float64'):
+    '''
+        systems copies of one system, each with perturbed initial conditions
+        systems - number of systems M
+        seed - seed of the random perturbations
+        scale - relative size of the gaussian perturbation of positions and velocities
+        bodies - (r, v, m) of the system to copy, the five planets if None
+        precision - storage type is float32 unless precision is 'float64'
+
+        Return:
+            r, v (M,N,3) and m (M,N); the first system is not perturbed
+    '''
+    storage = precision_types(precision)[0]
+    if bodies is None:
+        bodies = nbody_vec.initialize()
+    r0, v0, m0 = bodies
+    rng = np.random.default_rng(seed)
+
+    r = np.repeat(r0[np.newaxis], systems, axis=0)
+    v = np.repeat(v0[np.newaxis], systems, axis=0)
+    m = np.repeat(m0[np.newaxis], systems, axis=0)
+    r[1:] *= 1.0 + scale * rng.standard_normal(r[1:].shape)
+    v[1:] *= 1.0 + scale * rng.standard_normal(v[1:].shape)
+    return r.astype(storage), v.astype(storage), m.astype(storage)
+
+
+def offset_momentum(ref, v, m):
+    '''
+        ref is the index of the body in the center of every system
+        offset its velocity so the total momentum of each system is zero
+    '''
+    p = -np.einsum('sn,snk->sk', m, v, dtype=np.float64)
+    v[:, ref] += p / m[:, ref, np.newaxis]
+    return v
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _advance(consts, iterations, r, v, m):
+    '''
+        advance all systems iterations timesteps in place, one system per thread
+        consts - dt and -1.5 in the arithmetic type
+
+        Every step works on a copy of the system in the arithmetic type, so
+        in mixed mode all pair contributions are summed in float64 and the
+        state is rounded into float32 storage once per step.
+    '''
+    dt = consts[0]
+    exponent = consts[1]
+    systems, n = m.shape
+    for s in prange(systems):
+        rs = np.empty((n, 3), dtype=consts.dtype)
+        vs = np.empty((n, 3), dtype=consts.dtype)
+        ms = np.empty(n, dtype=consts.dtype)
+        for i in range(n):
+            ms[i] = m[s, i]
+        for _ in range(iterations):
+            for i in range(n):
+                for k in range(3):
+                    rs[i, k] = r[s, i, k]
+                    vs[i, k] = v[s, i, k]
+
+            # Update vs over all pairs of this system
+            for i in range(n):
+                for j in range(i + 1, n):
+                    dx = rs[i, 0] - rs[j, 0]
+                    dy = rs[i, 1] - rs[j, 1]
+                    dz = rs[i, 2] - rs[j, 2]
+                    mag = dt * ((dx * dx + dy * dy + dz * dz) ** exponent)
+                    b2 = ms[j] * mag
+                    b1 = ms[i] * mag
+                    vs[i, 0] -= dx * b2
+                    vs[i, 1] -= dy * b2
+                    vs[i, 2] -= dz * b2
+                    vs[j, 0] += dx * b1
+                    vs[j, 1] += dy * b1
+                    vs[j, 2] += dz * b1
+
+            # Update rs, then round the step into storage
+            for i in range(n):
+                for k in range(3):
+                    r[s, i, k] = rs[i, k] + dt * vs[i, k]
+                    v[s, i, k] = vs[i, k]
+
+
+def advance(dt, iterations, r, v, m, precision='float64'):
+    '''
+        advance all systems iterations timesteps in place
+        precision - arithmetic is float32 for 'float32', float64 otherwise,
+                    storage is the type of r, v and m
+    '''
+    arithmetic = precision_types(precision)[1]
+    _advance(np.array([dt, -1.5], dtype=arithmetic), iterations, r, v, m)
+    return r, v
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def report_energy(r, v, m):
+    '''
+        compute the energy of every system in float64
+        return (M,) array of energies
+    '''
+    systems, n = m.shape
+    e = np.zeros(systems)
+    for s in prange(systems):
+        es = 0.0
+        for i in range(n):
+            for j in range(i + 1, n):
+                dx = 0.0 + r[s, i, 0] - r[s, j, 0]
+                dy = 0.0 + r[s, i, 1] - r[s, j, 1]
+                dz = 0.0 + r[s, i, 2] - r[s, j, 2]
+                es -= (m[s, i] * 1.0 * m[s, j]) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
+        for i in range(n):
+            vx = 0.0 + v[s, i, 0]
+            vy = 0.0 + v[s, i, 1]
+            vz = 0.0 + v[s, i, 2]
+            es += m[s, i] * (vx * vx + vy * vy + vz * vz) / 2.
+        e[s] = es
+    return e
+
+
+def nbody(loops, reference, iterations, systems, seed=None, scale=1e-6, precision='float64'):
+    '''
+        ensemble nbody simulation
+        loops - number of loops to run
+        reference - index of body at center of every system
+        iterations - number of timesteps to advance
+        systems - number of perturbed copies of the five planets
+        precision - 'float64', 'mixed' or 'float32'
+        return (loops + 1, M) array of energies, at the start and after every loop
+    '''
+    r, v, m = initialize(systems, seed, scale, precision=precision)
+    offset_momentum(reference, v, m)
+
+    energies = np.empty((loops + 1, systems))
+    energies[0] = report_energy(r, v, m)
+    for loop in range(loops):
+        advance(0.01, iterations, r, v, m, precision)
+        energies[loop + 1] = report_energy(r, v, m)
+    return energies
+
+
+def compare_precision(loops, iterations, systems, seed=0, precisions=('float64', 'mixed', 'float32')):
+    '''
+        run the same ensemble in every precision mode
+        return precision_report() of the runs
+    '''
+    # Compile every type combination before timing
+    for precision in precisions:
+        nbody(1, 0, 1, 2, precision=precision)
+    return precision_report(lambda precision: nbody(loops, 0, iterations, systems, seed, precision=precision),
+                            precisions)
+
+
+if __name__ == '__main__':
+    import sys
+    import timeit
+
+    # Usage: python nbody_ensemble.py [systems]
+    systems = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nbody(1, 0, 1, 2)
+    print('%d systems: %g seconds' % (systems, timeit.timeit(
+        lambda: nbody(10, 0, 1000, systems, seed=0), number=1)))
+
+    print('%-8s %10s %12s %12s' % ('mode', 'seconds', 'drift', 'error'))
+    for precision, row in sorted(compare_precision(10, 1000, systems).items()):
+        print('%-8s %10.4g %12.3g %12.3g' % (precision, row['seconds'], row['drift'], row['error']))
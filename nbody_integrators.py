@@ -0,0 +1,312 @@
+"""
+    Time integrators for the array based N-body engines.
+
+    Every integrator has the same signature as the loop in nbody_vec.advance():
+        integrator(dt, iterations, r, v, m, accel)
+    and updates r and v in place. accel(r, m, out) writes the accelerations
+    of all bodies into out, e.g. nbody_vec.accelerations or a Barnes-Hut walk.
+
+    euler    - symplectic Euler, the update all nbody_* variants use, 1st order
+    verlet   - leapfrog / velocity Verlet (kick-drift-kick), 2nd order
+    yoshida4 - 4th order Yoshida composition of leapfrog, 3 forces per step
+    Adaptive - velocity Verlet with a step size chosen from a local error
+               tolerance by step doubling, still ends exactly at dt * iterations
+
+    Compensated - euler or verlet with Kahan compensated updates of r and v,
+                  the rounding error of every r += dt * v is carried into
+                  the next step instead of being lost, which matters most
+                  for float32 arrays and runs of millions of steps
+
+    Higher order schemes reach the same energy error with a much larger dt.
+
+    euler and verlet also take an EnergyMonitor. On the steps it asks for,
+    accel(r, m, out, potential) also writes the potential energy into
+    potential[0] from the pair distances it computes anyway, so monitoring
+    energy costs no extra pass over the pairs.
+"""
+import numpy as np
+
+
+class EnergyMonitor(object):
+    '''
+        total energy every few steps, taken from the force computation
+        every - record the energy of every every-th state
+        step - index of the current state, counted over all advance() calls
+        steps, energies - recorded states and their energies
+    '''
+    __slots__ = ('every', 'step', 'steps', 'energies', '_potential', '_last')
+
+    def __init__(self, every=1, step=0):
+        self.every = every
+        self.step = step
+        self.steps = []
+        self.energies = []
+        self._potential = np.zeros(1)
+        self._last = -1
+
+    def potential(self):
+        '''
+            buffer to pass to accel() if the current state should be recorded
+        '''
+        if self.step % self.every != 0 or self.step == self._last:
+            return None
+        return self._potential
+
+    def record(self, v, m):
+        '''
+            add kinetic energy to the potential accel() just wrote
+        '''
+        self._last = self.step
+        self.steps.append(self.step)
+        self.energies.append(float(self._potential[0] + np.dot(m, np.einsum('ij,ij->i', v, v)) / 2.))
+
+    def pop(self):
+        '''
+            return and forget the recorded (steps, energies)
+        '''
+        steps, energies = self.steps, self.energies
+        self.steps, self.energies = [], []
+        return steps, energies
+
+
+def _accel(accel, r, m, a, monitor):
+    '''
+        call accel, asking for the potential energy if the monitor wants this state
+    '''
+    potential = None if monitor is None else monitor.potential()
+    if potential is None:
+        accel(r, m, a)
+        return False
+    accel(r, m, a, potential)
+    return True
+
+
+def euler(dt, iterations, r, v, m, accel, monitor=None):
+    '''
+        symplectic Euler, velocities first and then positions
+        monitor - optional EnergyMonitor
+    '''
+    a = np.empty_like(r)
+    # dt * v goes here, r += dt * v would allocate a temporary every step
+    scratch = np.empty_like(r)
+    for _ in range(iterations):
+        # r and v still belong to the same state here
+        if _accel(accel, r, m, a, monitor):
+            monitor.record(v, m)
+        a *= dt
+        v += a
+        np.multiply(v, dt, out=scratch)
+        r += scratch
+        if monitor is not None:
+            monitor.step += 1
+    return r, v
+
+
+def verlet(dt, iterations, r, v, m, accel, monitor=None):
+    '''
+        velocity Verlet in kick-drift-kick form
+        one force evaluation per step, the last one is reused by the next step
+        monitor - optional EnergyMonitor
+    '''
+    a = np.empty_like(r)
+    scratch = np.empty_like(r)
+    if _accel(accel, r, m, a, monitor):
+        monitor.record(v, m)
+    half = 0.5 * dt
+    for _ in range(iterations):
+        np.multiply(a, half, out=scratch)
+        v += scratch
+        np.multiply(v, dt, out=scratch)
+        r += scratch
+        if monitor is not None:
+            monitor.step += 1
+        recorded = _accel(accel, r, m, a, monitor)
+        np.multiply(a, half, out=scratch)
+        v += scratch
+
+        # Only after the second kick are r and v at the same time
+        if recorded:
+            monitor.record(v, m)
+    return r, v
+
+
+# Yoshida (1990) coefficients
+W1 = 1.0 / (2.0 - 2.0 ** (1.0 / 3.0))
+W0 = -(2.0 ** (1.0 / 3.0)) * W1
+YOSHIDA_C = (0.5 * W1, 0.5 * (W0 + W1), 0.5 * (W0 + W1), 0.5 * W1)
+YOSHIDA_D = (W1, W0, W1)
+
+
+def yoshida4(dt, iterations, r, v, m, accel):
+    '''
+        4th order Yoshida integrator, drift-kick-drift-kick-drift-kick-drift
+    '''
+    a = np.empty_like(r)
+    scratch = np.empty_like(r)
+    c = [ci * dt for ci in YOSHIDA_C]
+    d = [di * dt for di in YOSHIDA_D]
+    for _ in range(iterations):
+        for k in range(3):
+            np.multiply(v, c[k], out=scratch)
+            r += scratch
+            accel(r, m, a)
+            np.multiply(a, d[k], out=scratch)
+            v += scratch
+        np.multiply(v, c[3], out=scratch)
+        r += scratch
+    return r, v
+
+
+class Adaptive(object):
+    '''
+        velocity Verlet with adaptive step size
+
+        Every step of size h is compared with two steps of size h/2.
+        The step is accepted when the largest position difference is below
+        tol * (1 + largest |r|), otherwise it is retried with a smaller h.
+        The step size that worked last is kept for the next call.
+
+        tol - local error tolerance
+        steps, rejected - number of accepted and rejected steps so far
+    '''
+    __slots__ = ('tol', 'h', 'steps', 'rejected')
+
+    def __init__(self, tol=1e-10):
+        self.tol = tol
+        self.h = None
+        self.steps = 0
+        self.rejected = 0
+
+    def __call__(self, dt, iterations, r, v, m, accel):
+        '''
+            advance the system by dt * iterations in steps of varying size
+        '''
+        total = dt * iterations
+        if self.h is None:
+            self.h = dt
+
+        t = 0.0
+        while t < total:
+            h = min(self.h, total - t)
+
+            # One full step and two half steps from the same state
+            r1, v1 = r.copy(), v.copy()
+            verlet(h, 1, r1, v1, m, accel)
+            r2, v2 = r.copy(), v.copy()
+            verlet(0.5 * h, 2, r2, v2, m, accel)
+
+            err = np.max(np.abs(r1 - r2)) / (self.tol * (1.0 + np.max(np.abs(r2))))
+
+            # Local error of Verlet is O(h^3)
+            factor = 2.0 if err == 0.0 else min(2.0, max(0.2, 0.9 * err ** (-1.0 / 3.0)))
+            if err <= 1.0:
+                r[...] = r2
+                v[...] = v2
+                t += h
+                self.steps += 1
+                # Don't let the last, shortened step shrink the next one
+                if h == self.h:
+                    self.h = h * factor
+            else:
+                self.rejected += 1
+                self.h = h * factor
+
+        return r, v
+
+
+def _kahan_add(x, dx, c, tmp):
+    '''
+        x += dx with compensation c, dx is used as scratch space
+    '''
+    dx -= c
+    np.add(x, dx, out=tmp)
+    np.subtract(tmp, x, out=c)
+    c -= dx
+    x[...] = tmp
+
+
+class Compensated(object):
+    '''
+        euler or verlet with Kahan compensated position and velocity updates
+
+        The compensation of every body is kept between calls, so a run split
+        into many advance() calls sums the same as one long call.
+
+        method - 'euler' or 'verlet'
+        cr, cv - running compensation of r and v
+    '''
+    __slots__ = ('method', 'cr', 'cv')
+
+    def __init__(self, method='euler'):
+        if method not in ('euler', 'verlet'):
+            raise ValueError('Compensated summation supports euler and verlet, not %r' % (method,))
+        self.method = method
+        self.cr = None
+        self.cv = None
+
+    def __call__(self, dt, iterations, r, v, m, accel):
+        '''
+            advance the system iterations timesteps in place
+        '''
+        if self.cr is None or self.cr.shape != r.shape or self.cr.dtype != r.dtype:
+            self.cr = np.zeros_like(r)
+            self.cv = np.zeros_like(v)
+        a = np.empty_like(r)
+        dx = np.empty_like(r)
+        tmp = np.empty_like(r)
+
+        if self.method == 'euler':
+            for _ in range(iterations):
+                accel(r, m, a)
+                np.multiply(a, dt, out=dx)
+                _kahan_add(v, dx, self.cv, tmp)
+                np.multiply(v, dt, out=dx)
+                _kahan_add(r, dx, self.cr, tmp)
+            return r, v
+
+        half = 0.5 * dt
+        accel(r, m, a)
+        for _ in range(iterations):
+            np.multiply(a, half, out=dx)
+            _kahan_add(v, dx, self.cv, tmp)
+            np.multiply(v, dt, out=dx)
+            _kahan_add(r, dx, self.cr, tmp)
+            accel(r, m, a)
+            np.multiply(a, half, out=dx)
+            _kahan_add(v, dx, self.cv, tmp)
+        return r, v
+
+
+# Integrators that take an EnergyMonitor
+MONITORED = (euler, verlet)
+
+INTEGRATORS = {
+    'euler': euler,
+    'verlet': verlet,
+    'leapfrog': verlet,
+    'yoshida4': yoshida4,
+}
+
+
+def get_integrator(integrator):
+    '''
+        integrator - a name from INTEGRATORS, 'adaptive', 'euler_kahan',
+                     'verlet_kahan' or a callable
+        return the integrator function
+
+        'adaptive' and the Kahan variants return a new object with fresh
+        state on every call. Drivers that call advance() repeatedly get the
+        integrator once and pass the object, so step size and compensation
+        carry over between calls.
+    '''
+    if callable(integrator):
+        return integrator
+    if integrator == 'adaptive':
+        return Adaptive()
+    if integrator in ('euler_kahan', 'verlet_kahan'):
+        return Compensated(integrator[:-len('_kahan')])
+    try:
+        return INTEGRATORS[integrator]
+    except KeyError:
+        raise ValueError('Unknown integrator %r, must be one of %s' % (
+            integrator, ', '.join(sorted(INTEGRATORS) + ['adaptive', 'euler_kahan', 'verlet_kahan'])))
@@ -0,0 +1,185 @@
+"""
+    Loading and generating initial conditions for N-body simulation.
+
+    Every function returns bodies in the array layout used by nbody_vec:
+        r - (N,3) float64 positions
+        v - (N,3) float64 velocities
+        m - (N,) float64 masses
+
+    On disk a system is a table with one row per body and 7 columns:
+        x, y, z, vx, vy, vz, m
+
+    Supported formats, picked by file extension:
+        .csv - comma separated text, lines starting with '#' are ignored
+        .npy - numpy (N,7) float64 array
+        .bin - raw little-endian float64 values, row by row
+"""
+import os
+import numpy as np
+
+# Number of columns per body
+COLUMNS = 7
+
+# File formats by extension
+FORMATS = ('csv', 'npy', 'bin')
+
+
+def _format(path, fmt):
+    '''
+        use fmt if given, otherwise guess the format from the file extension
+    '''
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format %r, must be one of %s' % (fmt, ', '.join(FORMATS)))
+    return fmt
+
+
+def split_table(data):
+    '''
+        split an (N,7) table into contiguous r, v, m arrays
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim != 2 or data.shape[1] != COLUMNS:
+        raise ValueError('Bodies must be a table of shape (N, %d), got %s' % (COLUMNS, data.shape))
+
+    r = np.ascontiguousarray(data[:, 0:3])
+    v = np.ascontiguousarray(data[:, 3:6])
+    m = np.ascontiguousarray(data[:, 6])
+    return r, v, m
+
+
+def join_table(r, v, m):
+    '''
+        build an (N,7) table from r, v, m arrays
+    '''
+    data = np.empty((len(m), COLUMNS), dtype=np.float64)
+    data[:, 0:3] = r
+    data[:, 3:6] = v
+    data[:, 6] = m
+    return data
+
+
+def load_bodies(path, fmt=None):
+    '''
+        read initial conditions of any number of bodies from a file
+        path - file to read
+        fmt - 'csv', 'npy' or 'bin', guessed from the extension if None
+
+        Return:
+            r, v, m arrays
+    '''
+    fmt = _format(path, fmt)
+
+    if fmt == 'csv':
+        data = np.loadtxt(path, delimiter=',', comments='#', dtype=np.float64, ndmin=2)
+    elif fmt == 'npy':
+        data = np.load(path)
+    else:
+        data = np.fromfile(path, dtype='<f8')
+        if data.size % COLUMNS != 0:
+            raise ValueError('Size of %s is not a multiple of %d float64 values' % (path, COLUMNS))
+        data = data.reshape(-1, COLUMNS)
+
+    return split_table(data)
+
+
+def save_bodies(path, r, v, m, fmt=None):
+    '''
+        write bodies to a file that load_bodies() can read back
+    '''
+    fmt = _format(path, fmt)
+    data = join_table(r, v, m)
+
+    if fmt == 'csv':
+        np.savetxt(path, data, delimiter=',', fmt='%.17g', header='x,y,z,vx,vy,vz,m')
+    elif fmt == 'npy':
+        np.save(path, data)
+    else:
+        data.astype('<f8').tofile(path)
+
+
+def _to_center_of_mass(r, v, m):
+    '''
+        move the system into its center of mass frame
+    '''
+    total = np.sum(m)
+    r -= np.dot(m, r) / total
+    v -= np.dot(m, v) / total
+
+
+def _random_directions(rng, n):
+    '''
+        n random unit vectors, uniform on the sphere
+    '''
+    cos_theta = rng.uniform(-1.0, 1.0, n)
+    sin_theta = np.sqrt(1.0 - cos_theta * cos_theta)
+    phi = rng.uniform(0.0, 2.0 * np.pi, n)
+
+    u = np.empty((n, 3), dtype=np.float64)
+    u[:, 0] = sin_theta * np.cos(phi)
+    u[:, 1] = sin_theta * np.sin(phi)
+    u[:, 2] = cos_theta
+    return u
+
+
+def uniform(n, seed=None, radius=1.0, total_mass=1.0, velocity=0.0):
+    '''
+        generate n equal mass bodies uniformly distributed in a sphere
+        n - number of bodies
+        seed - seed of the random generator, same seed gives same system
+        radius - radius of the sphere
+        total_mass - sum of all masses
+        velocity - scale of random gaussian velocities, 0 for a cold start
+    '''
+    if n < 2:
+        raise ValueError('n must be at least 2')
+    rng = np.random.default_rng(seed)
+
+    # Radius ~ R * U^(1/3) gives uniform density
+    r = _random_directions(rng, n) * (radius * rng.uniform(0.0, 1.0, n) ** (1.0 / 3.0))[:, np.newaxis]
+    v = rng.normal(0.0, velocity, (n, 3)) if velocity > 0 else np.zeros((n, 3), dtype=np.float64)
+    m = np.full(n, total_mass / n, dtype=np.float64)
+
+    _to_center_of_mass(r, v, m)
+    return r, v, m
+
+
+def plummer(n, seed=None, scale=1.0, total_mass=1.0):
+    '''
+        generate a Plummer sphere of n equal mass bodies in virial equilibrium
+        n - number of bodies
+        seed - seed of the random generator, same seed gives same system
+        scale - Plummer radius
+        total_mass - sum of all masses
+
+        Uses G = 1 like the rest of the simulation.
+        Sampling follows Aarseth, Henon & Wielen (1974).
+    '''
+    if n < 2:
+        raise ValueError('n must be at least 2')
+    rng = np.random.default_rng(seed)
+
+    # Radii from the inverse of the cumulative mass profile,
+    # clipped to avoid a handful of bodies at huge distances
+    x = rng.uniform(0.0, 0.999, n)
+    radius = scale / np.sqrt(x ** (-2.0 / 3.0) - 1.0)
+    r = _random_directions(rng, n) * radius[:, np.newaxis]
+
+    # Speed as a fraction q of the escape speed, q sampled from g(q) = q^2 (1-q^2)^3.5
+    # by rejection, vectorized over all bodies still waiting for a sample
+    q = np.empty(n, dtype=np.float64)
+    todo = np.arange(n)
+    while len(todo) > 0:
+        q_try = rng.uniform(0.0, 1.0, len(todo))
+        g_try = rng.uniform(0.0, 0.1, len(todo))
+        accept = g_try < q_try * q_try * (1.0 - q_try * q_try) ** 3.5
+        q[todo[accept]] = q_try[accept]
+        todo = todo[~accept]
+
+    escape = np.sqrt(2.0 * total_mass) * (radius * radius + scale * scale) ** (-0.25)
+    v = _random_directions(rng, n) * (q * escape)[:, np.newaxis]
+    m = np.full(n, total_mass / n, dtype=np.float64)
+
+    _to_center_of_mass(r, v, m)
+    return r, v, m
@@ -0,0 +1,254 @@
+"""
+    N-body simulation.
+    Domain decomposition over MPI ranks using mpi4py.
+
+    Bodies are split into contiguous blocks, one block per rank.
+    Every rank keeps a full copy of the positions r and masses m,
+    but only advances the velocities of its own block.
+    After each timestep the new positions of every block are exchanged
+    with a buffer based Allgatherv on the numpy arrays (no pickling),
+    and energies are summed over ranks with Allreduce.
+
+    To run: mpiexec -n N python nbody_mpi.py [bodies] [steps]
+    To measure scaling: mpiexec -n N python nbody_mpi.py scaling [bodies] [steps]
+    To test: mpiexec -n N python mpi_test_nbody.py
+
+    Import mpi4py before any module that compiles numba parallel kernels:
+    with numba's TBB threading layer started first, MPI hangs at exit.
+"""
+import sys
+from mpi4py import MPI
+import numpy as np
+import nbody_loader
+import nbody_vec
+
+
+def partition(n, size):
+    '''
+        split n bodies into size contiguous blocks as evenly as possible
+        return counts and displacements (start index) of every block
+    '''
+    counts = np.full(size, n // size, dtype=np.int64)
+    counts[:n % size] += 1
+    displs = np.zeros(size, dtype=np.int64)
+    displs[1:] = np.cumsum(counts)[:-1]
+    return counts, displs
+
+
+def scatter_bodies(bodies, comm=MPI.COMM_WORLD, root=0):
+    '''
+        broadcast positions and masses from root, keep velocities of the own block
+        bodies - (r, v, m) arrays, only used on root
+
+        Return:
+            r - (N,3) positions, full copy on every rank
+            v - (n_local,3) velocities of the own block
+            m - (N,) masses, full copy on every rank
+            counts, displs - block layout from partition()
+    '''
+    rank = comm.Get_rank()
+
+    # Broadcast number of bodies first to allocate buffers
+    n = np.zeros(1, dtype=np.int64)
+    if rank == root:
+        n[0] = len(bodies[2])
+    comm.Bcast([n, MPI.INT64_T], root=root)
+    n = int(n[0])
+
+    if rank == root:
+        table = nbody_loader.join_table(*bodies)
+    else:
+        table = np.empty((n, nbody_loader.COLUMNS), dtype=np.float64)
+    comm.Bcast([table, MPI.DOUBLE], root=root)
+    r, v, m = nbody_loader.split_table(table)
+
+    counts, displs = partition(n, comm.Get_size())
+    lo = displs[rank]
+    hi = lo + counts[rank]
+    return r, np.ascontiguousarray(v[lo:hi]), m, counts, displs
+
+
+def local_accelerations(r, m, lo, hi, out):
+    '''
+        accelerations of bodies lo..hi-1 from all N bodies
+        out - (hi-lo,3) buffer for the result
+    '''
+    # d[i, j] = r[lo + i] - r[j]
+    d = r[lo:hi, np.newaxis, :] - r[np.newaxis, :, :]
+    dist2 = np.einsum('ijk,ijk->ij', d, d)
+
+    # Remove self interaction
+    rows = np.arange(hi - lo)
+    dist2[rows, rows + lo] = np.inf
+
+    inv3 = dist2 ** (-1.5)
+    inv3 *= m
+    np.einsum('ijk,ij->ik', d, inv3, out=out)
+    np.negative(out, out=out)
+    return out
+
+
+def advance(dt, iterations, r, v, m, counts, displs, comm=MPI.COMM_WORLD):
+    '''
+        advance the system iterations timesteps in place
+        r - (N,3) positions, updated on every rank
+        v - (n_local,3) velocities of the own block
+    '''
+    rank = comm.Get_rank()
+    lo = displs[rank]
+    hi = lo + counts[rank]
+
+    a = np.empty_like(v)
+    r_local = np.empty_like(v)
+    recv = [r, counts * 3, displs * 3, MPI.DOUBLE]
+    for _ in range(iterations):
+        # Update vs of the own block
+        local_accelerations(r, m, lo, hi, a)
+        a *= dt
+        v += a
+
+        # Update rs of the own block, then share them with all ranks
+        np.multiply(v, dt, out=r_local)
+        r_local += r[lo:hi]
+        comm.Allgatherv([r_local, MPI.DOUBLE], recv)
+
+    return r, v
+
+
+def report_energy(r, v, m, counts, displs, comm=MPI.COMM_WORLD):
+    '''
+        compute the energy and return it so that it can be printed
+        every rank adds kinetic energy of its block and potential energy
+        of pairs (i, j) with i in its block and j > i, then Allreduce sums them
+    '''
+    rank = comm.Get_rank()
+    lo = displs[rank]
+    hi = lo + counts[rank]
+
+    e = np.zeros(1, dtype=np.float64)
+    for i in range(lo, hi):
+        d = r[i] - r[i + 1:]
+        e[0] -= m[i] * np.sum(m[i + 1:] / np.sqrt(np.einsum('ij,ij->i', d, d)))
+    e[0] += np.sum(m[lo:hi] * np.einsum('ij,ij->i', v, v)) / 2.
+
+    total = np.zeros(1, dtype=np.float64)
+    comm.Allreduce([e, MPI.DOUBLE], [total, MPI.DOUBLE], op=MPI.SUM)
+    return float(total[0])
+
+
+def offset_momentum(ref, v, m, counts, displs, comm=MPI.COMM_WORLD):
+    '''
+        ref is the index of the body in the center of the system
+        offset its velocity so the total momentum is zero
+    '''
+    rank = comm.Get_rank()
+    lo = displs[rank]
+    hi = lo + counts[rank]
+
+    p = -np.dot(m[lo:hi], v)
+    total = np.zeros(3, dtype=np.float64)
+    comm.Allreduce([p, MPI.DOUBLE], [total, MPI.DOUBLE], op=MPI.SUM)
+    if lo <= ref < hi:
+        v[ref - lo] += total / m[ref]
+    return v
+
+
+def nbody(loops, reference, iterations, bodies=None, comm=MPI.COMM_WORLD):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - index of body at center of system
+        iterations - number of timesteps to advance
+        bodies - optional (r, v, m) arrays on rank 0, the five planets if None
+    '''
+    if comm.Get_rank() == 0 and bodies is None:
+        bodies = nbody_vec.initialize()
+    r, v, m, counts, displs = scatter_bodies(bodies, comm)
+
+    offset_momentum(reference, v, m, counts, displs, comm)
+
+    for _ in range(loops):
+        advance(0.01, iterations, r, v, m, counts, displs, comm)
+        e = report_energy(r, v, m, counts, displs, comm)
+        if comm.Get_rank() == 0:
+            print(e)
+
+
+def time_steps(n, steps, comm):
+    '''
+        seconds per timestep for a Plummer sphere of n bodies on comm
+    '''
+    bodies = nbody_loader.plummer(n, seed=0) if comm.Get_rank() == 0 else None
+    r, v, m, counts, displs = scatter_bodies(bodies, comm)
+
+    # One step to warm up, then time the slowest rank
+    advance(1e-4, 1, r, v, m, counts, displs, comm)
+    comm.Barrier()
+    start = MPI.Wtime()
+    advance(1e-4, steps, r, v, m, counts, displs, comm)
+    elapsed = np.array([MPI.Wtime() - start])
+    comm.Allreduce(MPI.IN_PLACE, [elapsed, MPI.DOUBLE], op=MPI.MAX)
+    return elapsed[0] / steps
+
+
+def scaling(n, steps, comm=MPI.COMM_WORLD):
+    '''
+        strong and weak scaling on 1, 2, 4, ... ranks of comm
+        strong - n bodies for every number of ranks
+        weak - n * sqrt(P) bodies on P ranks, so pair work per rank stays constant
+
+        Return on rank 0:
+            list of (kind, ranks, bodies, seconds per step, speedup, efficiency),
+            None on other ranks
+    '''
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    results = []
+
+    p = 1
+    while p <= size:
+        # Ranks >= p sit out this round
+        sub = comm.Split(0 if rank < p else MPI.UNDEFINED, rank)
+        if sub != MPI.COMM_NULL:
+            weak_n = int(round(n * p ** 0.5))
+            results.append(('strong', p, n, time_steps(n, steps, sub)))
+            results.append(('weak', p, weak_n, time_steps(weak_n, steps, sub)))
+            sub.Free()
+        comm.Barrier()
+        p *= 2
+
+    if rank != 0:
+        return None
+
+    base = dict((kind, t) for (kind, p, bodies, t) in results if p == 1)
+    table = []
+    for (kind, p, bodies, t) in results:
+        speedup = base[kind] / t
+        if kind == 'strong':
+            table.append((kind, p, bodies, t, speedup, speedup / p))
+        else:
+            table.append((kind, p, bodies, t, speedup * p, speedup))
+    return table
+
+
+if __name__ == '__main__':
+    comm = MPI.COMM_WORLD
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'scaling':
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+        steps = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        table = scaling(n, steps, comm)
+        if comm.Get_rank() == 0:
+            print('%-6s %5s %8s %14s %8s %10s' % ('kind', 'ranks', 'bodies', 'sec/step', 'speedup', 'efficiency'))
+            for row in table:
+                print('%-6s %5d %8d %14.6g %8.3f %10.3f' % row)
+    else:
+        n = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+        steps = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        bodies = None
+        if n > 0 and comm.Get_rank() == 0:
+            bodies = nbody_loader.plummer(n, seed=0)
+        start = MPI.Wtime()
+        nbody(10, 0, steps, bodies, comm)
+        if comm.Get_rank() == 0:
+            print('%g seconds on %d ranks' % (MPI.Wtime() - start, comm.Get_size()))
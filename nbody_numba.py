@@ -11,14 +11,32 @@
 
     Vectorization slows down the program a lot. I guess vectorization leads to some overheads,
     which may be much more than performance improvement we get from vectorization.
+
+    advance_parallel() splits the force computation across cores with prange.
+    Every thread owns whole rows i and sums the forces of all j on body i,
+    so no two threads write the same velocity. This does every pair twice,
+    which pays off once there are more bodies than the 5 planets.
+    Set the number of threads with set_threads() or NUMBA_NUM_THREADS.
+
+    nbody_parallel(precision=...) runs the same kernel on float32 storage,
+    with float64 ('mixed') or float32 arithmetic, the modes of
+    nbody_ensemble.PRECISIONS.
+    compare_precision() reports the energy drift of every mode and its
+    error against the float64 run.
+
+    Kernels are compiled with cache=True, so only the first import compiles them
+    and later processes load the machine code from __pycache__.
+    Measure startup with: python benchmark.py --startup
 """
-from itertools import combinations
-from numba import jit, int32, float64, void, vectorize
+from numba import jit, int32, float64, void, vectorize, prange
+import numba
 import numpy as np
+import nbody_ensemble
+import nbody_plan
 
 
 # Initialize BODIES and return it
-@jit('float64[:,:,:]()')
+@jit('float64[:,:,:]()', forceobj=True, cache=True)
 def initialize():
     '''
         initialize statue of BODIES
@@ -76,14 +94,14 @@ def initialize():
     return BODIES
 
 
-@vectorize([float64(float64, float64)])
+@vectorize([float64(float64, float64)], cache=True)
 def vec_deltas(x, y):
     return x - y
 
 
 # Add iterations
 # Add BODIES to parameters
-@jit('void(float64, int32, float64[:,:,:], int32[:,:])', nopython=True)
+@jit('void(float64, int32, float64[:,:,:], int32[:,:])', nopython=True, cache=True)
 def advance(dt, iterations, BODIES, cached_body_pairs):
     '''
         advance the system one timestep
@@ -122,8 +140,109 @@ def advance(dt, iterations, BODIES, cached_body_pairs):
             r += dt * v
 
 
+# Parallel version of advance() over rows of bodies
+@jit('void(float64, int32, float64[:,:,:], float64[:,:])', nopython=True, parallel=True, cache=True)
+def advance_parallel(dt, iterations, BODIES, acc):
+    '''
+        advance the system iterations timesteps on all cores
+        acc - (N,3) buffer for the velocity updates of one timestep
+    '''
+    n = len(BODIES)
+    for _ in range(iterations):
+        # Each body i only writes its own row of acc
+        for i in prange(n):
+            x1 = BODIES[i, 0, 0]
+            y1 = BODIES[i, 0, 1]
+            z1 = BODIES[i, 0, 2]
+            ax = 0.0
+            ay = 0.0
+            az = 0.0
+            for j in range(n):
+                if i == j:
+                    continue
+
+                # Compute deltas
+                dx = x1 - BODIES[j, 0, 0]
+                dy = y1 - BODIES[j, 0, 1]
+                dz = z1 - BODIES[j, 0, 2]
+
+                # Compute mag and b2
+                mag = dt * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
+                b2 = BODIES[j, 2, 0] * mag
+                ax -= dx * b2
+                ay -= dy * b2
+                az -= dz * b2
+            acc[i, 0] = ax
+            acc[i, 1] = ay
+            acc[i, 2] = az
+
+        # Update vs and rs
+        for i in prange(n):
+            for k in range(3):
+                BODIES[i, 1, k] += acc[i, k]
+                BODIES[i, 0, k] += dt * BODIES[i, 1, k]
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _advance_precision(consts, iterations, BODIES, acc):
+    '''
+        advance_parallel() for float64 or float32 BODIES
+        consts - dt, -1.5 and zero in the arithmetic type, every delta starts
+                 from zero so it is computed in that type whatever the storage
+        acc - (N,3) buffer in the arithmetic type
+
+        Forces are summed in the arithmetic type and each step is rounded
+        into storage once.
+    '''
+    dt = consts[0]
+    exponent = consts[1]
+    zero = consts[2]
+    n = len(BODIES)
+    for _ in range(iterations):
+        for i in prange(n):
+            x1 = zero + BODIES[i, 0, 0]
+            y1 = zero + BODIES[i, 0, 1]
+            z1 = zero + BODIES[i, 0, 2]
+            ax = zero
+            ay = zero
+            az = zero
+            for j in range(n):
+                if i == j:
+                    continue
+                dx = x1 - BODIES[j, 0, 0]
+                dy = y1 - BODIES[j, 0, 1]
+                dz = z1 - BODIES[j, 0, 2]
+                mag = dt * ((dx * dx + dy * dy + dz * dz) ** exponent)
+                b2 = BODIES[j, 2, 0] * mag
+                ax -= dx * b2
+                ay -= dy * b2
+                az -= dz * b2
+            acc[i, 0] = ax
+            acc[i, 1] = ay
+            acc[i, 2] = az
+
+        for i in prange(n):
+            for k in range(3):
+                vk = zero + BODIES[i, 1, k] + acc[i, k]
+                BODIES[i, 1, k] = vk
+                BODIES[i, 0, k] = zero + BODIES[i, 0, k] + dt * vk
+
+
+def set_threads(threads=None):
+    '''
+        set the number of threads used by advance_parallel()
+        threads - None for all cores numba was started with,
+                  larger values are capped to that number
+        return the number of threads in use
+    '''
+    if threads is None or threads > numba.config.NUMBA_NUM_THREADS:
+        threads = numba.config.NUMBA_NUM_THREADS
+    numba.set_num_threads(threads)
+    return numba.get_num_threads()
+
+
 # Add BODIES and cached_body_pairs to parameters
-@jit('float64(float64[:,:,:], int32[:,:], float64)', nopython=True)
+@jit('float64(float64[:,:,:], int32[:,:], float64)', nopython=True, cache=True)
 def report_energy(BODIES, cached_body_pairs, e=0.0):
     '''
         compute the energy and return it so that it can be printed
@@ -154,7 +273,7 @@ def report_energy(BODIES, cached_body_pairs, e=0.0):
 
 
 # Add BODIES to parameters
-@jit('void(int32, float64[:,:,:], float64, float64, float64)', nopython=True)
+@jit('void(int32, float64[:,:,:], float64, float64, float64)', nopython=True, cache=True)
 def offset_momentum(ref, BODIES, px=0.0, py=0.0, pz=0.0):
     '''
         ref is the body in the center of the system
@@ -179,19 +298,23 @@ def offset_momentum(ref, BODIES, px=0.0, py=0.0, pz=0.0):
     #return BODIES
     
 
-@jit('void(int32, int32, int32)')
-def nbody(loops, reference, iterations):
+# Plain Python driver, compiling it in object mode made nothing faster
+# but cost most of the import time
+def nbody(loops, reference, iterations, plan=None):
     '''
         nbody simulation
         loops - number of loops to run
         reference - body at center of system
         iterations - number of timesteps to advance
+        plan - optional nbody_plan.InteractionPlan of the bodies
     '''
     # Set up global state
     BODIES = initialize()  
 
     # Generator all body pairs
-    cached_body_pairs = np.array(list(combinations(range(5), 2)), dtype=np.int32)
+    if plan is None:
+        plan = nbody_plan.InteractionPlan(len(BODIES))
+    cached_body_pairs = plan.pairs
 
     # Add BODIES to parameters
     offset_momentum(reference, BODIES, 0.0, 0.0, 0.0)
@@ -202,6 +325,72 @@ def nbody(loops, reference, iterations):
         print(report_energy(BODIES, cached_body_pairs, 0.0))
 
 
+def _energies(loops, reference, iterations, BODIES, plan, precision):
+    '''
+        generate the energy at the start and after every loop of advance_parallel()
+    '''
+    (storage, arithmetic) = nbody_ensemble.precision_types(precision)
+
+    if BODIES is None:
+        BODIES = initialize()
+    if plan is None:
+        plan = nbody_plan.InteractionPlan(len(BODIES))
+    cached_body_pairs = plan.pairs
+    acc = np.empty((len(BODIES), 3), dtype=arithmetic)
+
+    offset_momentum(reference, BODIES, 0.0, 0.0, 0.0)
+    # The kernel runs on the bodies in plan order
+    state = plan.gather(BODIES).astype(storage, copy=False)
+    consts = np.array([0.01, -1.5, 0.0], dtype=arithmetic)
+
+    # report_energy() is compiled for float64, energies are always summed in float64
+    yield report_energy(BODIES, cached_body_pairs, 0.0)
+    for _ in range(loops):
+        if state.dtype == np.float64 and arithmetic == np.float64:
+            advance_parallel(0.01, iterations, state, acc)
+        else:
+            _advance_precision(consts, iterations, state, acc)
+        plan.scatter(state, BODIES)
+        yield report_energy(BODIES, cached_body_pairs, 0.0)
+
+
+def nbody_parallel(loops, reference, iterations, threads=None, BODIES=None, plan=None, precision='float64'):
+    '''
+        nbody simulation with advance_parallel()
+        loops - number of loops to run
+        reference - index of body at center of system
+        iterations - number of timesteps to advance
+        threads - number of threads, None for all cores
+        BODIES - optional (N,3,3) array, the five planets of initialize() if None,
+                 holds the final state
+        plan - optional nbody_plan.InteractionPlan, pairs for report_energy()
+               and order of the bodies in the kernel
+        precision - 'float64', 'mixed' (float32 storage, float64 arithmetic)
+                    or 'float32'
+    '''
+    set_threads(threads)
+
+    energies = _energies(loops, reference, iterations, BODIES, plan, precision)
+    next(energies)
+    for e in energies:
+        print(e)
+
+
+def compare_precision(loops, iterations, BODIES=None, precisions=('float64', 'mixed', 'float32')):
+    '''
+        run nbody_parallel() in every precision mode from the same state
+        BODIES - (N,3,3) initial state, the five planets if None
+        return nbody_ensemble.precision_report() of the runs
+    '''
+    if BODIES is None:
+        BODIES = initialize()
+    # Compile every type combination before timing
+    for precision in precisions:
+        list(_energies(1, 0, 1, BODIES.copy(), None, precision))
+    return nbody_ensemble.precision_report(
+        lambda precision: list(_energies(loops, 0, iterations, BODIES.copy(), None, precision)), precisions)
+
+
 if __name__ == '__main__':
 
     # Compute total runtime for 1 run
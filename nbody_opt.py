@@ -6,7 +6,7 @@
     Optimized Runtime:  165.8094674285046 / 5 = 33.16189348570092 seconds
     Speedup:    3.4145449406516915x
 """
-from itertools import combinations
+import nbody_plan
 
 
 # Initialize BODIES and return it
@@ -135,18 +135,21 @@ def offset_momentum(ref, BODIES, px=0.0, py=0.0, pz=0.0):
     # Add returned value
     return BODIES
 
-def nbody(loops, reference, iterations):
+def nbody(loops, reference, iterations, plan=None):
     '''
         nbody simulation
         loops - number of loops to run
         reference - body at center of system
         iterations - number of timesteps to advance
+        plan - optional nbody_plan.InteractionPlan of the bodies
     '''
     # Set up global state
     BODIES = initialize()  
 
     # Generator all body pairs
-    cached_body_pairs = list(combinations(BODIES.keys(), 2))
+    if plan is None:
+        plan = nbody_plan.InteractionPlan(len(BODIES))
+    cached_body_pairs = plan.names(BODIES.keys())
 
     # Add BODIES to parameters
     offset_momentum(BODIES[reference], BODIES)
@@ -0,0 +1,206 @@
+"""
+    Interaction plans: the pairs every engine loops over, built in one place.
+
+    The engines used to build their pair lists each their own way,
+    combinations() of names in nbody_opt/nbody_iter, an int32 array in
+    nbody_numba, np.triu_indices in nbody_vec. An InteractionPlan holds
+    the pairs i < j once as index arrays and hands them out in whatever
+    form an engine takes:
+        plan.i, plan.j     - int64 arrays, e.g. nbody_vec.report_energy()
+        plan.pairs         - (P,2) int32 array, nbody_numba.advance()
+        plan.tuples()      - list of (i, j), nbody_soa.advance()
+        plan.names(keys)   - list of (name1, name2), nbody_opt.advance()
+
+    The all-pairs force kernels take the tile and order instead of pairs,
+    nbody_vec.accelerations(plan=), nbody_tiled.accelerations(plan=) and
+    nbody_numba.nbody_parallel(plan=), and move the bodies with
+        plan.gather(x)       - rows of x in plan order
+        plan.scatter(x, out) - rows in plan order back into out
+    nbody_bh and nbody_cells keep their own spatial order, the octree and
+    the cell lists.
+
+    Pairs are ordered tile by tile: bodies are cut into blocks of `tile`
+    and all pairs between two blocks come together, so the loop over pairs
+    keeps reusing 2 * tile bodies while they are still in cache instead of
+    streaming over all N for every i. With order=, e.g. morton_order(r),
+    the blocks also hold bodies that are close in space.
+
+    Measured with nbody_cells.pair_accelerations() over the plan at
+    N = 4000-8000 (python nbody_plan.py), the three orders are within 10%:
+    that kernel is bound by the pow() per pair and by streaming the index
+    arrays themselves, so the plan is where to tune order, not a speedup
+    by itself.
+
+    For N <= tile and no order the pairs come out exactly as
+    combinations(range(n), 2), so the five planets run bit for bit as before.
+    The plan stores all N(N-1)/2 pairs, so pair lists are meant for N up
+    to ~10^4. They are built on first use, a plan that only hands its tile
+    and order to a force kernel costs O(N) at any N.
+"""
+import numpy as np
+
+# Default tile size of every tiled kernel. 2 * 256 bodies * 7 doubles still
+# fit in a 32 KB L1; at N = 8000 nbody_tiled is up to 10% faster than at 64
+# and the pair-list kernel of nbody_cells is the same within noise
+TILE = 256
+
+
+def morton_order(r, bits=10):
+    '''
+        permutation of bodies along a Z-order curve through their positions,
+        bodies close in the order are close in space
+    '''
+    lo = r.min(axis=0)
+    span = np.maximum(r.max(axis=0) - lo, np.finfo(np.float64).tiny)
+    cells = ((r - lo) / span * ((1 << bits) - 1)).astype(np.uint64)
+
+    code = np.zeros(len(r), dtype=np.uint64)
+    for bit in range(bits):
+        for k in range(3):
+            code |= ((cells[:, k] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3 * bit + k)
+    return np.argsort(code, kind='stable')
+
+
+class InteractionPlan(object):
+    '''
+        all pairs i < j of n bodies, precomputed in tiled order
+
+        n - number of bodies
+        tile - bodies per block
+        order - optional permutation of the bodies, e.g. morton_order(r),
+                blocks are cut from it instead of from range(n)
+        i, j - pair index arrays, i < j for every pair, built on first use
+    '''
+    __slots__ = ('n', 'tile', 'order', '_i', '_j', '_pairs')
+
+    def __init__(self, n, tile=TILE, order=None):
+        self.n = n
+        self.tile = tile
+        self.order = None if order is None else np.asarray(order, dtype=np.int64)
+        self._i = None
+        self._j = None
+        self._pairs = None
+
+    def _build(self):
+        n = self.n
+        tile = self.tile
+        bodies = np.arange(n, dtype=np.int64) if self.order is None else self.order
+        starts = range(0, n, tile)
+        blocks_i = []
+        blocks_j = []
+        for a in starts:
+            block_a = bodies[a:a + tile]
+            # Pairs within the block, then with every later block
+            (u, w) = np.triu_indices(len(block_a), 1)
+            blocks_i.append(block_a[u])
+            blocks_j.append(block_a[w])
+            for b in starts:
+                if b <= a:
+                    continue
+                block_b = bodies[b:b + tile]
+                blocks_i.append(np.repeat(block_a, len(block_b)))
+                blocks_j.append(np.tile(block_b, len(block_a)))
+
+        i = np.concatenate(blocks_i) if blocks_i else np.empty(0, dtype=np.int64)
+        j = np.concatenate(blocks_j) if blocks_j else np.empty(0, dtype=np.int64)
+
+        # Sorted bodies can make a pair come out as j < i
+        swap = i > j
+        (i[swap], j[swap]) = (j[swap], i[swap])
+        self._i = i
+        self._j = j
+
+    @property
+    def i(self):
+        if self._i is None:
+            self._build()
+        return self._i
+
+    @property
+    def j(self):
+        if self._j is None:
+            self._build()
+        return self._j
+
+    @classmethod
+    def from_positions(cls, r, tile=TILE, bits=10):
+        '''
+            plan with blocks of bodies that are close in space
+        '''
+        return cls(len(r), tile, morton_order(r, bits))
+
+    def __len__(self):
+        return len(self.i)
+
+    @property
+    def pairs(self):
+        '''
+            (P,2) int32 array of nbody_numba
+        '''
+        if self._pairs is None:
+            self._pairs = np.ascontiguousarray(np.stack([self.i, self.j], axis=1), dtype=np.int32)
+        return self._pairs
+
+    def gather(self, x):
+        '''
+            rows of x in plan order, x itself without an order
+        '''
+        if self.order is None:
+            return x
+        return x[self.order]
+
+    def scatter(self, x, out):
+        '''
+            write rows x, in plan order, back into out in index order
+        '''
+        if self.order is None:
+            if x is not out:
+                out[...] = x
+        else:
+            out[self.order] = x
+        return out
+
+    def indices(self):
+        '''
+            (i, j) arrays, like np.triu_indices(n, 1)
+        '''
+        return self.i, self.j
+
+    def tuples(self):
+        '''
+            list of (i, j) pairs of ints
+        '''
+        return list(zip(self.i.tolist(), self.j.tolist()))
+
+    def names(self, keys):
+        '''
+            list of (name1, name2) pairs for the dict engines
+            keys - name of every body, in index order
+        '''
+        keys = list(keys)
+        return [(keys[i], keys[j]) for (i, j) in zip(self.i.tolist(), self.j.tolist())]
+
+
+if __name__ == '__main__':
+    import sys
+    import timeit
+    import nbody_cells
+    import nbody_loader
+
+    # Usage: python nbody_plan.py [N]
+    # Force kernel over the pairs in plain, tiled and tiled + Morton order
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    r, v, m = nbody_loader.plummer(n, seed=0)
+    shuffle = np.random.default_rng(0).permutation(n)
+    r, v, m = r[shuffle], v[shuffle], m[shuffle]
+    out = np.empty_like(r)
+    plans = {
+        'triu': InteractionPlan(n, tile=n),
+        'tiled': InteractionPlan(n),
+        'tiled+morton': InteractionPlan.from_positions(r),
+    }
+    for name, plan in plans.items():
+        nbody_cells.pair_accelerations(r, m, plan.i, plan.j, np.inf, 0.0, out)
+        seconds = min(timeit.repeat(lambda: nbody_cells.pair_accelerations(
+            r, m, plan.i, plan.j, np.inf, 0.0, out), number=1, repeat=5))
+        print('%-14s %8.4f s  %.4g pairs/s' % (name, seconds, len(plan) / seconds))
@@ -0,0 +1,170 @@
+"""
+    N-body simulation.
+    Many independent runs on a pool of processes.
+
+    Sweeps run one nbody() per initial condition. run_jobs() fans them out
+    over a ProcessPoolExecutor, one process per core by default, and yields
+    every energy as soon as a worker computed it, after every loop of every
+    job, in the order they arrive.
+
+    States never go through pickle: all jobs' bodies are packed into one
+    multiprocessing.shared_memory block of (N,7) tables as in nbody_loader,
+        x, y, z, vx, vy, vz, m
+    workers read their initial conditions from it and write their final
+    state back in place. Only offsets and (job, loop, energy) messages are
+    sent between processes. The block is unlinked once the generator finishes.
+    Closing the generator early, or a failed job, stops the other jobs
+    after their current loop and cancels those not started yet.
+
+    Engines are the array modules with advance(dt, iterations, r, v, m,
+    integrator=...) and report_energy(r, v, m), 'vec' or 'bh'.
+"""
+import importlib
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import nbody_integrators
+import nbody_loader
+import pool_context
+
+# Module of every engine, imported in the workers
+ENGINES = {
+    'vec': 'nbody_vec',
+    'bh': 'nbody_bh',
+}
+
+# Queue of (job, loop, energy) messages and stop event of a worker process
+_progress = None
+_stop = None
+
+
+def _table(block, rows):
+    return np.ndarray((rows, nbody_loader.COLUMNS), dtype=np.float64, buffer=block.buf)
+
+
+def _init(progress, stop):
+    global _progress, _stop
+    _progress = progress
+    _stop = stop
+    # Energies nobody reads after an early stop must not keep the worker from exiting
+    progress.cancel_join_thread()
+
+
+def _run(name, rows, job, start, n, engine, loops, reference, iterations, dt, integrator):
+    '''
+        worker: run one job on rows start:start + n of the shared block
+        send (job, loop, energy) at the start and after every loop, the
+        final state is in the block before the last energy is sent
+    '''
+    module = importlib.import_module(ENGINES[engine])
+    # Once per job, so an adaptive step size carries over between loops
+    integrator = nbody_integrators.get_integrator(integrator)
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        table = _table(block, rows)[start:start + n]
+        (r, v, m) = nbody_loader.split_table(table)
+        if reference is not None:
+            module.offset_momentum(reference, v, m)
+
+        energy = module.report_energy(r, v, m)
+        for loop in range(loops):
+            if _stop.is_set():
+                return
+            _progress.put((job, loop, energy))
+            module.advance(dt, iterations, r, v, m, integrator=integrator)
+            energy = module.report_energy(r, v, m)
+
+        table[:] = nbody_loader.join_table(r, v, m)
+        del table
+        _progress.put((job, loops, energy))
+    finally:
+        block.close()
+
+
+def run_jobs(bodies, loops, iterations, dt=0.01, reference=0, engine='vec',
+             integrator='euler', workers=None):
+    '''
+        run one simulation per initial condition on a process pool
+        bodies - list of (r, v, m) initial conditions, sizes may differ
+        loops, iterations - energies are taken every iterations steps, loops times
+        reference - index of the body whose velocity offsets the momentum,
+                    None to start from the given velocities
+        engine - key of ENGINES
+        workers - number of processes, all cores if None
+
+        Yield:
+            (job, loop, energy, state) as soon as a worker computed it, job is
+            the index into bodies, loop is 0 for the initial energy and loops
+            for the last one. state is the final (r, v, m) with the last
+            energy of a job, None before
+    '''
+    if engine not in ENGINES:
+        raise ValueError('Unknown engine %r, must be one of %s' % (engine, ', '.join(sorted(ENGINES))))
+
+    starts = np.cumsum([0] + [len(m) for (r, v, m) in bodies])
+    rows = int(starts[-1])
+    size = max(rows * nbody_loader.COLUMNS * 8, 1)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    context = pool_context.pool_context()
+    progress = context.Queue()
+    stop = context.Event()
+    table = None
+    try:
+        table = _table(block, rows)
+        for (job, (r, v, m)) in enumerate(bodies):
+            table[starts[job]:starts[job + 1]] = nbody_loader.join_table(r, v, m)
+
+        with ProcessPoolExecutor(workers or os.cpu_count(), mp_context=context,
+                                 initializer=_init, initargs=(progress, stop)) as pool:
+            futures = [pool.submit(_run, block.name, rows, job, int(starts[job]), len(m), engine,
+                                   loops, reference, iterations, dt, integrator)
+                       for (job, (r, v, m)) in enumerate(bodies)]
+            remaining = len(bodies) * (loops + 1)
+            try:
+                while remaining:
+                    try:
+                        (job, loop, energy) = progress.get(timeout=0.1)
+                    except queue.Empty:
+                        # A failed job sends no more energies, raise its error
+                        for future in futures:
+                            if future.done() and future.exception() is not None:
+                                raise future.exception()
+                        continue
+                    remaining -= 1
+                    state = None
+                    if loop == loops:
+                        state = nbody_loader.split_table(table[starts[job]:starts[job + 1]])
+                    yield job, loop, energy, state
+            finally:
+                if remaining:
+                    # Closed early or failed, nobody reads the energies any more:
+                    # running jobs stop after their loop, the others never start
+                    stop.set()
+                    pool.shutdown(cancel_futures=True)
+    finally:
+        # The block can only be closed once no array uses its buffer
+        table = None
+        progress.close()
+        block.close()
+        block.unlink()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    # Usage: python nbody_pool.py [jobs] [bodies] [loops] [iterations]
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 2 * os.cpu_count()
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    loops = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    iterations = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+
+    bodies = [nbody_loader.plummer(n, seed=seed) for seed in range(jobs)]
+    start = time.perf_counter()
+    initial = {}
+    for (job, loop, energy, state) in run_jobs(bodies, loops, iterations, dt=1e-3, reference=None):
+        initial.setdefault(job, energy)
+        print('job %d loop %d: %.3fs, drift %.3g' % (job, loop, time.perf_counter() - start, energy / initial[job] - 1.0))
+    print('%d jobs of %d bodies: %g seconds' % (jobs, n, time.perf_counter() - start))
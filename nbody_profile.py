@@ -0,0 +1,198 @@
+"""
+    Opt-in instrumentation of the nbody_* simulation loops.
+
+    Every variant's nbody() looks up advance(), report_energy() and
+    offset_momentum() as module globals on each call. instrument() swaps
+    them for timing wrappers for the duration of a with block and puts the
+    originals back afterwards, so nothing in the variants changes and a run
+    without instrument() pays nothing at all. It works the same for pure
+    Python functions and numba dispatchers; for the JIT engines the first
+    advance() call includes compilation unless the cache is warm.
+
+        with nbody_profile.instrument(nbody_opt) as profiler:
+            nbody_opt.nbody(10, 'sun', 1000)
+        print(profiler.format())
+
+    Steps are counted from the iterations argument of advance() where it has
+    one, one step per call otherwise. Pair interactions assume all
+    N(N-1)/2 pairs per step, N = bodies.
+
+    profile() runs a function under cProfile and writes pstats output
+    (snakeviz, gprof2dot, pstats); with perf=True it also enables the
+    perf map trampoline of Python 3.12+, so `perf record` shows Python
+    function names.
+
+    Usage: python nbody_profile.py module [loops] [iterations] [--cprofile out.prof] [--perf]
+"""
+import cProfile
+import inspect
+import sys
+import time
+from contextlib import contextmanager
+
+# Module functions timed by instrument()
+PHASES = ('advance', 'report_energy', 'offset_momentum')
+
+
+class Profiler(object):
+    '''
+        per phase timers and step counters
+        bodies - number of bodies, for pair interactions per second
+        calls, seconds - dicts of phase -> number of calls and total time
+        steps - timesteps advanced
+    '''
+    __slots__ = ('bodies', 'calls', 'seconds', 'steps')
+
+    def __init__(self, bodies=5):
+        self.bodies = bodies
+        self.calls = dict((phase, 0) for phase in PHASES)
+        self.seconds = dict((phase, 0.0) for phase in PHASES)
+        self.steps = 0
+
+    def wrap(self, phase, function):
+        '''
+            function with its calls timed as phase
+        '''
+        self.calls.setdefault(phase, 0)
+        self.seconds.setdefault(phase, 0.0)
+        counts_steps = phase == 'advance' and _takes_iterations(function)
+        calls, seconds = self.calls, self.seconds
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds[phase] += clock() - start
+                calls[phase] += 1
+                if phase == 'advance':
+                    if not counts_steps:
+                        self.steps += 1
+                    else:
+                        self.steps += int(kwargs['iterations'] if 'iterations' in kwargs else args[1])
+        timed.__wrapped__ = function
+        return timed
+
+    def report(self):
+        '''
+            dict of phases, steps, steps_per_second and pairs_per_second,
+            rates are over the time spent in advance()
+        '''
+        advancing = self.seconds.get('advance', 0.0)
+        pairs = self.bodies * (self.bodies - 1) // 2
+        return {
+            'phases': dict((phase, {'calls': self.calls[phase], 'seconds': self.seconds[phase]})
+                           for phase in self.calls),
+            'steps': self.steps,
+            'steps_per_second': self.steps / advancing if advancing else 0.0,
+            'pairs_per_second': self.steps * pairs / advancing if advancing else 0.0,
+        }
+
+    def format(self):
+        '''
+            report() as a table
+        '''
+        report = self.report()
+        total = sum(self.seconds.values()) or 1.0
+        lines = ['%-16s %8s %12s %7s' % ('phase', 'calls', 'seconds', '%')]
+        for phase in sorted(self.calls, key=lambda phase: -self.seconds[phase]):
+            lines.append('%-16s %8d %12.6g %6.1f%%' % (
+                phase, self.calls[phase], self.seconds[phase], 100.0 * self.seconds[phase] / total))
+        lines.append('%d steps, %.4g steps/s, %.4g pairs/s' % (
+            report['steps'], report['steps_per_second'], report['pairs_per_second']))
+        return '\n'.join(lines)
+
+
+def _takes_iterations(function):
+    try:
+        parameters = list(inspect.signature(getattr(function, 'py_func', function)).parameters)
+    except (TypeError, ValueError):
+        return False
+    return len(parameters) > 1 and parameters[1] == 'iterations'
+
+
+@contextmanager
+def instrument(module, bodies=5, phases=PHASES, profiler=None):
+    '''
+        time the phases of module while the with block runs
+        module - an nbody_* module, its globals are replaced and restored
+        bodies - number of bodies simulated
+        phases - names of the module functions to time
+        yield the Profiler
+    '''
+    if profiler is None:
+        profiler = Profiler(bodies)
+    originals = {}
+    try:
+        for phase in phases:
+            if hasattr(module, phase):
+                originals[phase] = getattr(module, phase)
+                setattr(module, phase, profiler.wrap(phase, originals[phase]))
+        yield profiler
+    finally:
+        for (phase, function) in originals.items():
+            setattr(module, phase, function)
+
+
+def profile(function, *args, **kwargs):
+    '''
+        run function(*args) under cProfile
+        output - write pstats data to this file
+        perf - enable the perf trampoline so perf record sees Python frames
+        return (result, cProfile.Profile)
+    '''
+    output = kwargs.pop('output', None)
+    perf = kwargs.pop('perf', False)
+    if perf:
+        if not hasattr(sys, 'activate_stack_trampoline'):
+            raise RuntimeError('perf support needs Python 3.12 or newer')
+        sys.activate_stack_trampoline('perf')
+
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(function, *args, **kwargs)
+    finally:
+        if perf:
+            sys.deactivate_stack_trampoline()
+    if output is not None:
+        profiler.dump_stats(output)
+    return result, profiler
+
+
+def main(argv=None):
+    import argparse
+    import importlib
+    import io
+    from contextlib import redirect_stdout
+
+    parser = argparse.ArgumentParser(description='Time the phases of an nbody variant')
+    parser.add_argument('module', help='nbody variant, e.g. nbody_opt or nbody_numba')
+    parser.add_argument('loops', nargs='?', type=int, default=10)
+    parser.add_argument('iterations', nargs='?', type=int, default=1000)
+    parser.add_argument('--reference', help="body at the center, 'sun' or 0 by default")
+    parser.add_argument('--cprofile', help='also write cProfile stats to this file')
+    parser.add_argument('--perf', action='store_true', help='enable the perf trampoline')
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(args.module)
+    reference = args.reference
+    if reference is None:
+        # Array engines index bodies, the dict engines name them
+        reference = 0 if args.module in ('nbody_numba', 'nbody_vec', 'nbody_bh') else 'sun'
+    elif reference.isdigit():
+        reference = int(reference)
+
+    with instrument(module) as profiler:
+        with redirect_stdout(io.StringIO()):
+            if args.cprofile or args.perf:
+                profile(module.nbody, args.loops, reference, args.iterations,
+                        output=args.cprofile, perf=args.perf)
+            else:
+                module.nbody(args.loops, reference, args.iterations)
+    print(profiler.format())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
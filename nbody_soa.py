@@ -0,0 +1,273 @@
+"""
+    N-body simulation.
+    Structure of arrays body store.
+
+    nbody_opt keeps every body as a ([x, y, z], [vx, vy, vz], m) tuple of
+    lists in a dict, so every pair in the inner loop looks up two dict
+    entries and unpacks two tuples and two lists. BodySystem keeps one
+    contiguous array('d') per coordinate instead:
+        x, y, z, vx, vy, vz, m - column of every body, indexed by position
+    and advance() runs over integer pairs of column indices, on list copies
+    of the columns within one call. For the five planets this runs within
+    about 10% of nbody_opt.advance(), CPython spends the time on indexing
+    either way; the columns convert to nbody_vec arrays without copying
+    per body tuples.
+
+    Name based access still works: system['sun'] is a small Body view that
+    unpacks like the tuples of nbody_opt,
+        (r, [vx, vy, vz], m) = system['sun']
+    with r and v writable Vector views into the columns, so the advance(),
+    report_energy() and offset_momentum() of nbody_opt, nbody_iter and
+    nbody_3 run unchanged on a BodySystem, just not faster.
+"""
+from array import array
+import numpy as np
+import nbody_plan
+
+# Names of the coordinate columns, in (r, v) order
+COLUMNS = ('x', 'y', 'z', 'vx', 'vy', 'vz')
+
+
+class Vector(object):
+    '''
+        writable view of 3 columns at one body, behaves like [x, y, z]
+    '''
+    __slots__ = ('columns', 'i')
+
+    def __init__(self, columns, i):
+        self.columns = columns
+        self.i = i
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, k):
+        return self.columns[k][self.i]
+
+    def __setitem__(self, k, value):
+        self.columns[k][self.i] = value
+
+    def __iter__(self):
+        i = self.i
+        for column in self.columns:
+            yield column[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class Body(object):
+    '''
+        view of one body of a BodySystem, unpacks like (r, v, m)
+    '''
+    __slots__ = ('system', 'i')
+
+    def __init__(self, system, i):
+        self.system = system
+        self.i = i
+
+    @property
+    def r(self):
+        system = self.system
+        return Vector((system.x, system.y, system.z), self.i)
+
+    @property
+    def v(self):
+        system = self.system
+        return Vector((system.vx, system.vy, system.vz), self.i)
+
+    @property
+    def m(self):
+        return self.system.m[self.i]
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, k):
+        return (self.r, self.v, self.m)[k]
+
+    def __iter__(self):
+        yield self.r
+        yield self.v
+        yield self.m
+
+    def __repr__(self):
+        return 'Body(%r, r=%r, v=%r, m=%r)' % (self.system.names[self.i], self.r, self.v, self.m)
+
+
+class BodySystem(object):
+    '''
+        bodies stored as one array('d') column per coordinate
+
+        names - name of every body, system[name] and system[index] give a Body
+        x, y, z, vx, vy, vz, m - columns
+    '''
+    __slots__ = ('names', 'index') + COLUMNS + ('m',)
+
+    def __init__(self, names, r, v, m):
+        '''
+            names - N names
+            r, v - N (x, y, z) triples of positions and velocities
+            m - N masses
+        '''
+        self.names = tuple(names)
+        self.index = dict((name, i) for (i, name) in enumerate(self.names))
+        for (k, name) in enumerate(COLUMNS[:3]):
+            setattr(self, name, array('d', [float(row[k]) for row in r]))
+        for (k, name) in enumerate(COLUMNS[3:]):
+            setattr(self, name, array('d', [float(row[k]) for row in v]))
+        self.m = array('d', [float(mass) for mass in m])
+
+    @classmethod
+    def from_dict(cls, BODIES):
+        '''
+            system from a {name: (r, v, m)} dict of nbody_opt.initialize()
+        '''
+        names = list(BODIES.keys())
+        return cls(names, [BODIES[name][0] for name in names],
+                   [BODIES[name][1] for name in names], [BODIES[name][2] for name in names])
+
+    @classmethod
+    def from_arrays(cls, r, v, m, names=None):
+        '''
+            system from the (N,3), (N,3), (N,) arrays of nbody_vec
+            names - defaults to the body indices as strings
+        '''
+        if names is None:
+            names = [str(i) for i in range(len(m))]
+        return cls(names, r, v, m)
+
+    def to_arrays(self):
+        '''
+            copy into (r, v, m) arrays of nbody_vec
+        '''
+        r = np.array([self.x, self.y, self.z]).T.copy()
+        v = np.array([self.vx, self.vy, self.vz]).T.copy()
+        return r, v, np.array(self.m)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def keys(self):
+        return self.names
+
+    def __getitem__(self, name):
+        if isinstance(name, int):
+            return Body(self, name)
+        return Body(self, self.index[name])
+
+    def pairs(self, plan=None):
+        '''
+            index pairs (i, j), i < j, for advance() and report_energy()
+            plan - nbody_plan.InteractionPlan, all pairs in default order if None
+        '''
+        if plan is None:
+            plan = nbody_plan.InteractionPlan(len(self.names))
+        return plan.tuples()
+
+
+def initialize():
+    '''
+        the five planets of nbody_opt as a BodySystem
+    '''
+    import nbody_opt
+    return BodySystem.from_dict(nbody_opt.initialize())
+
+
+def advance(dt, iterations, system, pairs):
+    '''
+        advance the system iterations timesteps
+        pairs - index pairs from system.pairs()
+    '''
+    # Reading an array('d') boxes a new float every time, so the loop runs
+    # on list copies of the columns and writes them back once per call
+    x, y, z = list(system.x), list(system.y), list(system.z)
+    vx, vy, vz = list(system.vx), list(system.vy), list(system.vz)
+    m = list(system.m)
+    bodies = range(len(m))
+    for _ in range(iterations):
+        for (i, j) in pairs:
+            dx = x[i] - x[j]
+            dy = y[i] - y[j]
+            dz = z[i] - z[j]
+
+            # Update vs
+            mag = dt * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
+            b2 = m[j] * mag
+            b1 = m[i] * mag
+            vx[i] -= dx * b2
+            vy[i] -= dy * b2
+            vz[i] -= dz * b2
+            vx[j] += dx * b1
+            vy[j] += dy * b1
+            vz[j] += dz * b1
+
+        # Update rs
+        for i in bodies:
+            x[i] += dt * vx[i]
+            y[i] += dt * vy[i]
+            z[i] += dt * vz[i]
+
+    for (name, column) in zip(COLUMNS, (x, y, z, vx, vy, vz)):
+        getattr(system, name)[:] = array('d', column)
+    return system
+
+
+def report_energy(system, pairs, e=0.0):
+    '''
+        compute the energy and return it so that it can be printed
+    '''
+    x, y, z = system.x, system.y, system.z
+    m = system.m
+    for (i, j) in pairs:
+        dx = x[i] - x[j]
+        dy = y[i] - y[j]
+        dz = z[i] - z[j]
+        e -= (m[i] * m[j]) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
+
+    for (mass, vxi, vyi, vzi) in zip(m, system.vx, system.vy, system.vz):
+        e += mass * (vxi * vxi + vyi * vyi + vzi * vzi) / 2.
+    return e
+
+
+def offset_momentum(ref, system):
+    '''
+        ref is the name or index of the body in the center of the system
+        offset its velocity so the total momentum is zero
+    '''
+    i = ref if isinstance(ref, int) else system.index[ref]
+    m = system.m
+    for column in (system.vx, system.vy, system.vz):
+        p = -sum(mass * vk for (mass, vk) in zip(m, column))
+        column[i] = p / m[i]
+    return system
+
+
+def nbody(loops, reference, iterations, plan=None):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - name of the body at center of system
+        iterations - number of timesteps to advance
+        plan - optional nbody_plan.InteractionPlan of the bodies
+    '''
+    system = initialize()
+    pairs = system.pairs(plan)
+    offset_momentum(reference, system)
+
+    for _ in range(loops):
+        advance(0.01, iterations, system, pairs)
+        print(report_energy(system, pairs))
+
+
+if __name__ == '__main__':
+
+    # Compute total runtime for 1 run
+    import timeit
+    print(timeit.timeit("nbody(100, 'sun', 20000)", setup="from __main__ import nbody", number=1))
@@ -0,0 +1,249 @@
+"""
+    Streaming trajectory output for N-body simulation.
+
+    A trajectory file is append-only and made of framed chunks:
+        file header  - MAGIC, number of bodies (int64)
+        chunk header - CHUNK, number of frames (int64), compressed flag (int64),
+                       payload size in bytes (int64)
+        payload      - steps (k int64), positions (k,N,3) and velocities (k,N,3)
+                       as little-endian float64, zlib compressed if the flag is set
+
+    A chunk is only written once it is complete, so a file cut short by a crash
+    can still be read up to its last full chunk. Opening such a file for
+    writing again cuts off the torn chunk first, so frames written after a
+    resume follow the last full chunk and stay readable. A run resumed from
+    an older checkpoint calls truncate(step) first, so the steps it repeats
+    are not in the file twice.
+
+    TrajectoryWriter.write() copies a frame into a bounded queue and returns,
+    a background thread collects frames into chunks and writes them,
+    so I/O overlaps with advance(). When the queue is full write() waits,
+    which bounds memory if the disk can't keep up.
+"""
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+
+MAGIC = b'NBTRAJ1\0'
+CHUNK = b'NBCHUNK\0'
+HEADER = struct.Struct('<8sq')
+CHUNK_HEADER = struct.Struct('<8sqqq')
+
+# Marks the end of the frames in the queue
+_STOP = None
+
+
+class TrajectoryWriter(object):
+    '''
+        background writer of every k-th frame of a simulation
+        path - trajectory file, frames are appended after its last complete
+               chunk if it already exists
+        n - number of bodies
+        every - keep frames whose step is a multiple of every
+        chunk - number of frames per chunk
+        compress - zlib compress chunks
+        queue_size - number of frames that can wait for the writer thread
+    '''
+
+    def __init__(self, path, n, every=1, chunk=64, compress=False, queue_size=16):
+        self.path = path
+        self.n = n
+        self.every = every
+        self.chunk = chunk
+        self.compress = compress
+        self.frames = 0
+
+        try:
+            self._file = open(path, 'r+b')
+        except FileNotFoundError:
+            self._file = open(path, 'w+b')
+        if len(self._file.read(HEADER.size)) < HEADER.size:
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(HEADER.pack(MAGIC, n))
+        else:
+            stored = _read_header(path)
+            if stored != n:
+                self._file.close()
+                raise ValueError('%s holds %d bodies, not %d' % (path, stored, n))
+            # Drop a chunk torn by a crash, new chunks go after the last full one
+            end = HEADER.size
+            for (k, compressed, payload, end) in _scan(self._file):
+                pass
+            self._file.seek(end)
+            self._file.truncate()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def truncate(self, step):
+        '''
+            drop every frame after step from the file, e.g. the frames a
+            crashed run wrote after its last checkpoint, before the first
+            write() of a resumed run
+        '''
+        if self.frames:
+            raise ValueError('truncate() must come before the first write()')
+        end = HEADER.size
+        for (k, compressed, payload, chunk_end) in _scan(self._file):
+            (steps, r, v) = _decode(payload, k, compressed, self.n)
+            keep = int(np.count_nonzero(steps <= step))
+            if keep < k:
+                # Rewrite the chunk with the frames up to step only
+                self._file.seek(end)
+                if keep:
+                    self._file.write(_pack(steps[:keep], r[:keep], v[:keep], compressed))
+                end = self._file.tell()
+                break
+            end = chunk_end
+        self._file.seek(end)
+        self._file.truncate()
+        self._file.flush()
+
+    def wants(self, step):
+        '''
+            True if the frame of this step should be recorded
+        '''
+        return step % self.every == 0
+
+    def write(self, step, r, v):
+        '''
+            queue a copy of one frame, skipped unless wants(step)
+        '''
+        if self._error is not None:
+            raise self._error
+        if not self.wants(step):
+            return
+        self._queue.put((step, r.copy(), v.copy()))
+        self.frames += 1
+
+    def close(self):
+        '''
+            write the frames still in the queue and close the file
+        '''
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self):
+        steps = []
+        r = np.empty((self.chunk, self.n, 3), dtype='<f8')
+        v = np.empty((self.chunk, self.n, 3), dtype='<f8')
+        while True:
+            frame = self._queue.get()
+            if frame is _STOP:
+                break
+            # After an error keep taking frames, so write() and close() never block
+            if self._error is not None:
+                continue
+            try:
+                r[len(steps)] = frame[1]
+                v[len(steps)] = frame[2]
+                steps.append(frame[0])
+                if len(steps) == self.chunk:
+                    self._flush(steps, r, v)
+                    steps = []
+            except Exception as err:
+                # Raised again in the simulation thread by the next write() or close()
+                self._error = err
+
+        if steps and self._error is None:
+            try:
+                self._flush(steps, r, v)
+            except Exception as err:
+                self._error = err
+
+    def _flush(self, steps, r, v):
+        k = len(steps)
+        self._file.write(_pack(steps, r[:k], v[:k], self.compress))
+        self._file.flush()
+
+
+def _pack(steps, r, v, compress):
+    '''
+        chunk header and payload of frames r, v (k,N,3) at steps (k,)
+    '''
+    payload = np.array(steps, dtype='<i8').tobytes() + r.astype('<f8').tobytes() + v.astype('<f8').tobytes()
+    if compress:
+        payload = zlib.compress(payload)
+    return CHUNK_HEADER.pack(CHUNK, len(steps), int(bool(compress)), len(payload)) + payload
+
+
+def _decode(payload, k, compressed, n):
+    '''
+        (steps, r, v) of the payload of one chunk, views of its bytes
+    '''
+    if compressed:
+        payload = zlib.decompress(payload)
+    data = np.frombuffer(payload, dtype=np.uint8)
+    steps = data[:8 * k].view('<i8')
+    frame = 8 * k * n * 3
+    r = data[8 * k:8 * k + frame].view('<f8').reshape(k, n, 3)
+    v = data[8 * k + frame:8 * k + 2 * frame].view('<f8').reshape(k, n, 3)
+    return steps, r, v
+
+
+def _read_header(path):
+    '''
+        number of bodies in a trajectory file
+    '''
+    with open(path, 'rb') as f:
+        magic, n = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('%s is not a trajectory file' % path)
+    return n
+
+
+def _scan(f):
+    '''
+        generate (k, compressed, payload, end offset) for every complete chunk
+        of the open trajectory file f, stops at the first torn one
+    '''
+    f.seek(HEADER.size)
+    while True:
+        head = f.read(CHUNK_HEADER.size)
+        if len(head) < CHUNK_HEADER.size:
+            return
+        magic, k, compressed, size = CHUNK_HEADER.unpack(head)
+        if magic != CHUNK:
+            return
+        payload = f.read(size)
+        if len(payload) < size:
+            return
+        yield k, compressed, payload, f.tell()
+
+
+def iter_chunks(path):
+    '''
+        generate (steps, r, v) for every complete chunk of a trajectory file
+        steps - (k,) int64, r and v - (k,N,3) float64
+    '''
+    n = _read_header(path)
+    with open(path, 'rb') as f:
+        for (k, compressed, payload, end) in _scan(f):
+            yield _decode(payload, k, compressed, n)
+
+
+def read_trajectory(path):
+    '''
+        read a whole trajectory file
+        return steps (F,), r (F,N,3) and v (F,N,3)
+    '''
+    n = _read_header(path)
+    chunks = list(iter_chunks(path))
+    if not chunks:
+        return (np.empty(0, dtype=np.int64), np.empty((0, n, 3)), np.empty((0, n, 3)))
+    return tuple(np.concatenate(part) for part in zip(*chunks))
@@ -0,0 +1,345 @@
+"""
+    N-body simulation.
+    Vectorized nbody_opt using numpy arrays.
+
+    Bodies are stored as contiguous arrays instead of a dict of tuples:
+        r - (N,3) float64 positions
+        v - (N,3) float64 velocities
+        m - (N,) float64 masses
+
+    All pairwise deltas, mag factors and velocity updates of one timestep are
+    computed with whole-array operations, so there is no per-pair Python loop.
+    The work is still O(N^2) per step and the temporaries are (N,N,3).
+"""
+import functools
+import numpy as np
+import nbody_checkpoint
+import nbody_integrators
+
+
+# Initialize r, v, m and return them
+def initialize():
+    '''
+        initialize statue of bodies in array layout
+        the order of bodies is sun, jupiter, saturn, uranus, neptune
+    '''
+    PI = 3.14159265358979323
+    SOLAR_MASS = 4 * PI * PI
+    DAYS_PER_YEAR = 365.24
+
+    r = np.array([
+        [0.0, 0.0, 0.0],
+        [4.84143144246472090e+00,
+         -1.16032004402742839e+00,
+         -1.03622044471123109e-01],
+        [8.34336671824457987e+00,
+         4.12479856412430479e+00,
+         -4.03523417114321381e-01],
+        [1.28943695621391310e+01,
+         -1.51111514016986312e+01,
+         -2.23307578892655734e-01],
+        [1.53796971148509165e+01,
+         -2.59193146099879641e+01,
+         1.79258772950371181e-01]], dtype=np.float64)
+
+    v = np.array([
+        [0.0, 0.0, 0.0],
+        [1.66007664274403694e-03 * DAYS_PER_YEAR,
+         7.69901118419740425e-03 * DAYS_PER_YEAR,
+         -6.90460016972063023e-05 * DAYS_PER_YEAR],
+        [-2.76742510726862411e-03 * DAYS_PER_YEAR,
+         4.99852801234917238e-03 * DAYS_PER_YEAR,
+         2.30417297573763929e-05 * DAYS_PER_YEAR],
+        [2.96460137564761618e-03 * DAYS_PER_YEAR,
+         2.37847173959480950e-03 * DAYS_PER_YEAR,
+         -2.96589568540237556e-05 * DAYS_PER_YEAR],
+        [2.68067772490389322e-03 * DAYS_PER_YEAR,
+         1.62824170038242295e-03 * DAYS_PER_YEAR,
+         -9.51592254519715870e-05 * DAYS_PER_YEAR]], dtype=np.float64)
+
+    m = np.array([
+        SOLAR_MASS,
+        9.54791938424326609e-04 * SOLAR_MASS,
+        2.85885980666130812e-04 * SOLAR_MASS,
+        4.36624404335156298e-05 * SOLAR_MASS,
+        5.15138902046611451e-05 * SOLAR_MASS], dtype=np.float64)
+
+    return r, v, m
+
+
+def accelerations(r, m, out=None, potential=None, plan=None):
+    '''
+        compute the acceleration of every body from all other bodies
+        r - (N,3) positions
+        m - (N,) masses
+        out - optional (N,3) buffer for the result
+        potential - optional 1-element array, gets the potential energy
+                    computed from the same pair distances
+        plan - optional nbody_plan.InteractionPlan, rows are done plan.tile
+               at a time in plan order, so the temporaries are (tile,N,3)
+               instead of (N,N,3)
+    '''
+    if out is None:
+        out = np.empty_like(r)
+    if plan is not None:
+        return _planned_accelerations(r, m, out, potential, plan)
+
+    # All pairwise deltas at once, d[i, j] = r[i] - r[j]
+    d = r[:, np.newaxis, :] - r[np.newaxis, :, :]
+
+    # inv3[i, j] = |r[i] - r[j]| ** -3, with the diagonal removed
+    dist2 = np.einsum('ijk,ijk->ij', d, d)
+    np.fill_diagonal(dist2, np.inf)
+    inv3 = dist2 ** (-1.5)
+
+    # Every pair appears twice in the full matrix
+    if potential is not None:
+        np.sqrt(dist2, out=dist2)
+        np.reciprocal(dist2, out=dist2)
+        potential[0] = -0.5 * np.dot(m, np.dot(dist2, m))
+
+    # a[i] = -sum_j m[j] * d[i, j] * inv3[i, j]
+    inv3 *= m
+    np.einsum('ijk,ij->ik', d, inv3, out=out)
+    np.negative(out, out=out)
+    return out
+
+
+def _planned_accelerations(r, m, out, potential, plan):
+    '''
+        accelerations() one block of plan.tile rows at a time
+    '''
+    r = plan.gather(r)
+    m = plan.gather(m)
+    a = out if plan.order is None else np.empty_like(out)
+    e = 0.0
+    for start in range(0, len(m), plan.tile):
+        stop = min(start + plan.tile, len(m))
+        rows = np.arange(stop - start)
+        d = r[start:stop, np.newaxis, :] - r[np.newaxis, :, :]
+
+        dist2 = np.einsum('ijk,ijk->ij', d, d)
+        dist2[rows, rows + start] = np.inf
+        inv3 = dist2 ** (-1.5)
+
+        if potential is not None:
+            np.sqrt(dist2, out=dist2)
+            np.reciprocal(dist2, out=dist2)
+            e -= 0.5 * np.dot(m[start:stop], np.dot(dist2, m))
+
+        inv3 *= m
+        np.einsum('ijk,ij->ik', d, inv3, out=a[start:stop])
+    np.negative(a, out=a)
+    if potential is not None:
+        potential[0] = e
+    return plan.scatter(a, out)
+
+
+def _backend(backend, plan=None):
+    '''
+        accelerations function of a force backend, using plan if given
+    '''
+    if backend == 'dense':
+        accel = accelerations
+    elif backend == 'tiled':
+        # Only the tiled backend needs numba
+        import nbody_tiled
+        accel = nbody_tiled.accelerations
+    else:
+        raise ValueError("Unknown backend %r, must be 'dense' or 'tiled'" % (backend,))
+    if plan is None:
+        return accel
+    return functools.partial(accel, plan=plan)
+
+
+# Add iterations
+# Pass arrays instead of BODIES
+def advance(dt, iterations, r, v, m, integrator='euler', monitor=None, backend='dense', plan=None):
+    '''
+        advance the system iterations timesteps in place
+        integrator - name or function from nbody_integrators,
+                     'euler' is the update of all other nbody_* variants
+        monitor - optional nbody_integrators.EnergyMonitor, records energies
+                  from the pair distances of the force computation
+        backend - 'dense' for accelerations() with (N,N,3) temporaries,
+                  'tiled' for the O(N) memory kernel of nbody_tiled
+        plan - optional nbody_plan.InteractionPlan, tile and order of the backend
+    '''
+    # Update vs with all pairs at once, then rs
+    integrate = nbody_integrators.get_integrator(integrator)
+    accel = _backend(backend, plan)
+    if monitor is None:
+        return integrate(dt, iterations, r, v, m, accel)
+    if integrate not in nbody_integrators.MONITORED:
+        raise ValueError('Energy monitoring needs the euler or verlet integrator')
+    return integrate(dt, iterations, r, v, m, accel, monitor)
+
+
+def pair_indices(n):
+    '''
+        index arrays (i, j) of all pairs i < j, in the same order
+        as combinations(range(n), 2)
+    '''
+    return np.triu_indices(n, 1)
+
+
+def report_energy(r, v, m, pairs=None, e=0.0):
+    '''
+        compute the energy and return it so that it can be printed
+        pairs - optional cached result of pair_indices(len(m))
+    '''
+    if pairs is None:
+        pairs = pair_indices(len(m))
+    i, j = pairs
+
+    # Compute potential energy over all pairs
+    d = r[i] - r[j]
+    e -= np.sum(m[i] * m[j] / np.sqrt(np.einsum('ij,ij->i', d, d)))
+
+    # Compute kinetic energy
+    e += np.sum(m * np.einsum('ij,ij->i', v, v)) / 2.
+
+    return float(e)
+
+
+def recenter(v, m):
+    '''
+        remove the total momentum that round-off added since offset_momentum(),
+        spread over all bodies by mass so the relative velocities don't change
+    '''
+    v -= np.dot(m, v) / np.sum(m)
+    return v
+
+
+def estimate_energy(r, v, m, samples=100000, seed=None):
+    '''
+        estimate the energy from a random sample of pairs
+        the potential energy is the mean over sampled pairs times the number of pairs,
+        kinetic energy is exact; O(samples) instead of O(N^2)
+    '''
+    n = len(m)
+    pairs = n * (n - 1) // 2
+    if pairs <= samples:
+        return report_energy(r, v, m)
+
+    # Uniform random pairs i != j
+    rng = np.random.default_rng(seed)
+    i = rng.integers(0, n, samples)
+    j = rng.integers(0, n - 1, samples)
+    j += (j >= i)
+
+    d = r[i] - r[j]
+    e = -pairs * np.mean(m[i] * m[j] / np.sqrt(np.einsum('ij,ij->i', d, d)))
+    e += np.sum(m * np.einsum('ij,ij->i', v, v)) / 2.
+    return float(e)
+
+
+def offset_momentum(ref, v, m):
+    '''
+        ref is the index of the body in the center of the system
+        offset values from this reference so the total momentum is zero
+    '''
+    p = -np.dot(m, v)
+    v[ref] += p / m[ref]
+    return v
+
+
+def nbody(loops, reference, iterations, bodies=None, integrator='euler', dt=0.01,
+          checkpoint=None, checkpoint_every=1, trajectory=None, energy_every=None,
+          recenter_every=None, plan=None):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - index of body at center of system
+        iterations - number of timesteps to advance
+        bodies - optional (r, v, m) arrays, e.g. from nbody_loader,
+                 the five planets of initialize() if None
+        integrator - name or function from nbody_integrators
+        dt - size of one timestep
+        checkpoint - optional checkpoint file, the run resumes from it if it exists
+        checkpoint_every - save a checkpoint after this many loops
+        trajectory - optional nbody_trajectory.TrajectoryWriter that gets
+                     every trajectory.every-th step, closed by the caller,
+                     cut back to the checkpoint's step on resume
+        energy_every - print the energy of every energy_every-th step, taken from
+                       the force computation, instead of report_energy() per loop
+        recenter_every - remove the accumulated total momentum after this many loops
+        plan - optional nbody_plan.InteractionPlan, pairs for report_energy(),
+               tile and order of accelerations()
+
+        Return:
+            relative energy drift per step, (E_end / E_start - 1) / steps,
+            from the start of the run also when it resumed from a checkpoint
+    '''
+    integrator = nbody_integrators.get_integrator(integrator)
+    if bodies is None:
+        r, v, m = initialize()
+    else:
+        r, v, m = bodies
+    pairs = pair_indices(len(m)) if plan is None else plan.indices()
+
+    writer = None
+    start = 0
+    if checkpoint is not None:
+        writer = nbody_checkpoint.Checkpointer(checkpoint, len(m))
+        state = writer.latest()
+        if state is not None:
+            # Continue where the last run stopped, momentum is already offset
+            r, v, m = state['r'], state['v'], state['m']
+            nbody_checkpoint.restore_integrator(integrator, state['h'], state['compensation'])
+            start = state['step'] // iterations
+            if trajectory is not None:
+                # Frames the stopped run wrote after this checkpoint come again
+                trajectory.truncate(start * iterations)
+
+    monitor = None
+    if energy_every is not None:
+        monitor = nbody_integrators.EnergyMonitor(energy_every, start * iterations)
+
+    if start == 0:
+        offset_momentum(reference, v, m)
+        if trajectory is not None:
+            trajectory.write(0, r, v)
+        e0 = report_energy(r, v, m, pairs)
+    else:
+        # Drift is measured from the start of the run, not from the resume
+        e0 = state['energy']
+
+    for loop in range(start, loops):
+        if trajectory is None:
+            advance(dt, iterations, r, v, m, integrator, monitor, plan=plan)
+        else:
+            # Stop at every step the trajectory records
+            step = loop * iterations
+            end = step + iterations
+            while step < end:
+                k = min(trajectory.every - step % trajectory.every, end - step)
+                advance(dt, k, r, v, m, integrator, monitor, plan=plan)
+                step += k
+                trajectory.write(step, r, v)
+
+        if recenter_every is not None and (loop + 1) % recenter_every == 0:
+            recenter(v, m)
+
+        if monitor is None:
+            print(report_energy(r, v, m, pairs))
+        else:
+            for e in monitor.pop()[1]:
+                print(e)
+
+        if writer is not None and (loop + 1) % checkpoint_every == 0:
+            step = (loop + 1) * iterations
+            writer.save(step, step * dt, r, v, m, integrator, e0)
+
+    if writer is not None:
+        writer.close()
+
+    steps = loops * iterations
+    return (report_energy(r, v, m, pairs) / e0 - 1.0) / steps if steps else 0.0
+
+
+if __name__ == '__main__':
+
+    # Compute total runtime for 1 run
+    import timeit
+    print(timeit.timeit("nbody(100, 0, 20000)", setup="from __main__ import nbody", number=1))
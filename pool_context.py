@@ -0,0 +1,16 @@
+"""
+    Start method of the process pools of nbody_pool and mandelbrot_zoom.
+
+    Forking a process that already ran numba parallel kernels can deadlock
+    in the threading layer, so workers start from a fresh interpreter.
+    spawn rather than forkserver, which leaves a server process running
+    after the pool is shut down.
+"""
+import multiprocessing
+
+
+def pool_context():
+    '''
+        multiprocessing context to pass as mp_context of a ProcessPoolExecutor
+    '''
+    return multiprocessing.get_context('spawn')
@@ -0,0 +1,54 @@
+'''
+Test script for calculator.py.
+To run test: python -m unittest test_calculator
+'''
+
+import unittest
+import numpy as np
+import calculator
+
+
+class TestHypotenuse(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = rng.standard_normal((1000, 30))
+        self.y = rng.standard_normal((1000, 30))
+        self.expected = np.hypot(self.x, self.y)
+
+    def test_chunks(self):
+        '''
+        Any chunk size should give np.hypot(), also one that spans several
+        blocks with a short last one, or is smaller than one row.
+        '''
+        for chunk in (calculator.CHUNK, 30 * 7, 5, 1):
+            self.assertTrue(np.allclose(calculator.hypotenuse(self.x, self.y, chunk=chunk), self.expected,
+                                        rtol=1e-15, atol=0.0))
+
+    def test_out_aliases_input(self):
+        for chunk in (calculator.CHUNK, 64, 5):
+            x = self.x.copy()
+            self.assertIs(calculator.hypotenuse(x, self.y, out=x, chunk=chunk), x)
+            self.assertTrue(np.allclose(x, self.expected, rtol=1e-15, atol=0.0))
+
+            y = self.y.copy()
+            self.assertIs(calculator.hypotenuse(self.x, y, out=y, chunk=chunk), y)
+            self.assertTrue(np.allclose(y, self.expected, rtol=1e-15, atol=0.0))
+
+    def test_broadcast(self):
+        x = np.ones((10000, 3))
+        for y in (np.ones((1, 3)), np.ones(3), np.float64(1.0)):
+            z = calculator.hypotenuse(x, y)
+            self.assertEqual(z.shape, x.shape)
+            self.assertTrue(np.allclose(z, np.sqrt(2.0)))
+            z = calculator.hypotenuse(y, x, out=x.copy())
+            self.assertTrue(np.allclose(z, np.sqrt(2.0)))
+        self.assertEqual(calculator.hypotenuse(3.0, 4.0), 5.0)
+        for shape in ((0, 3), (3, 0), (0,)):
+            self.assertEqual(calculator.hypotenuse(np.empty(shape), np.empty(shape)).shape, shape)
+        self.assertRaises(ValueError, calculator.hypotenuse, x, np.ones((2, 3)))
+        self.assertRaises(ValueError, calculator.hypotenuse, x, np.ones((1, 3)), out=np.empty((1, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
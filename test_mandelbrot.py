@@ -0,0 +1,228 @@
+'''
+Test script for the CPU Mandelbrot backends.
+To run test: python -m unittest test_mandelbrot
+'''
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import mandelbrot_cpu
+import mandelbrot_tiles
+import mandelbrot_disk
+import mandelbrot_zoom
+
+
+def reference(min_x, max_x, min_y, max_y, image, iters):
+    '''
+    One mandel() call per pixel, with the pixel mapping of mandelbrot_gpu.py.
+    '''
+    height, width = image.shape
+    pixel_size_x = (max_x - min_x) / width
+    pixel_size_y = (max_y - min_y) / height
+    for y in range(height):
+        for x in range(width):
+            image[y, x] = mandelbrot_cpu.mandel(min_x + x * pixel_size_x, min_y + y * pixel_size_y, iters)
+    return image
+
+
+class TestMandelbrotCpu(unittest.TestCase):
+
+    def test_identical(self):
+        '''
+        The row-tiled kernel should give exactly the counts of mandel(),
+        also for heights that aren't a multiple of the tile.
+        '''
+        for (view, iters) in (((-2.0, 1.0, -1.0, 1.0), 20), ((-0.75, -0.74, 0.1, 0.11), 100)):
+            image = np.zeros((61, 90), dtype=np.uint8)
+            mandelbrot_cpu.compute_mandel(view[0], view[1], view[2], view[3], image, iters)
+            expected = reference(view[0], view[1], view[2], view[3], np.zeros_like(image), iters)
+            self.assertTrue(np.array_equal(image, expected))
+
+    def test_render(self):
+        image = np.zeros((32, 48), dtype=np.uint8)
+        expected = reference(-2.0, 1.0, -1.0, 1.0, np.zeros_like(image), 20)
+        if not mandelbrot_cpu.cuda_available():
+            mandelbrot_cpu.render(-2.0, 1.0, -1.0, 1.0, image, 20)
+            self.assertTrue(np.array_equal(image, expected))
+        mandelbrot_cpu.render(-2.0, 1.0, -1.0, 1.0, image, 20, backend='cpu')
+        self.assertTrue(np.array_equal(image, expected))
+        self.assertRaises(ValueError, mandelbrot_cpu.render, -2.0, 1.0, -1.0, 1.0, image, 20, 'opencl')
+
+
+class TestMandelbrotTiles(unittest.TestCase):
+
+    def test_escape(self):
+        '''
+        Cardioid, bulb and cycle shortcuts should never change a count.
+        '''
+        for x in np.linspace(-2.0, 1.0, 61):
+            for y in np.linspace(-1.0, 1.0, 41):
+                self.assertEqual(mandelbrot_tiles.escape(x, y, 200), mandelbrot_cpu.mandel(x, y, 200))
+
+    def test_render(self):
+        expected = np.zeros((150, 200), dtype=np.uint8)
+        mandelbrot_cpu.compute_mandel(-2.0, 1.0, -1.0, 1.0, expected, 100)
+
+        image = np.zeros_like(expected)
+        mandelbrot_tiles.render(-2.0, 1.0, -1.0, 1.0, image, 100, tile=32, fill=False)
+        self.assertTrue(np.array_equal(image, expected))
+
+        mandelbrot_tiles.render(-2.0, 1.0, -1.0, 1.0, image, 100, tile=32)
+        self.assertLess(np.count_nonzero(image != expected), 10)
+
+    def test_known_pixels(self):
+        '''
+        A rectangle is only filled if the counts already known inside it
+        match its border, a mismatch is split until it is iterated around.
+        '''
+        (pixel_size_x, pixel_size_y) = mandelbrot_tiles.pixel_size(-0.3, -0.1, -0.1, 0.1, 40, 40)
+        for seed in (None, 5):
+            counts = np.full((40, 40), -1, dtype=np.int32)
+            if seed is not None:
+                counts[20, 20] = seed
+            filled = np.zeros(counts.shape, dtype=np.bool_)
+            mandelbrot_tiles.render_counts(-0.3, -0.1, pixel_size_x, pixel_size_y, counts, 0, 0, 100, 64, True,
+                                           filled)
+            if seed is None:
+                everywhere = np.count_nonzero(filled)
+                self.assertTrue(np.all(counts == 100))
+            else:
+                self.assertEqual(counts[20, 20], 5)
+                self.assertFalse(np.any(filled[19:22, 19:22]))
+                self.assertLess(np.count_nonzero(filled), everywhere)
+
+    def test_progressive(self):
+        image = np.zeros((100, 130), dtype=np.uint8)
+        steps = list(mandelbrot_tiles.progressive(-2.0, 1.0, -1.0, 1.0, image, 50, levels=3, fill=False))
+        self.assertEqual(steps, [4, 2, 1])
+        expected = np.zeros_like(image)
+        mandelbrot_cpu.compute_mandel(-2.0, 1.0, -1.0, 1.0, expected, 50)
+        self.assertTrue(np.array_equal(image, expected))
+
+
+class TestMandelbrotDisk(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'image.npy')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_render_to_disk(self):
+        '''
+        Tiles at global offsets should give the image of one render(),
+        and a second run should find every tile done.
+        '''
+        expected = np.zeros((90, 130), dtype=np.uint16)
+        mandelbrot_tiles.render(-2.0, 1.0, -1.0, 1.0, expected, 300, fill=False)
+
+        done = mandelbrot_disk.render_to_disk(self.path, -2.0, 1.0, -1.0, 1.0, expected.shape, 300,
+                                              tile=40, fill=False)
+        self.assertEqual(done, (12, 0))
+        image = mandelbrot_disk.load(self.path)
+        self.assertEqual(image.dtype, np.uint16)
+        self.assertTrue(np.array_equal(image, expected))
+        del image
+
+        done = mandelbrot_disk.render_to_disk(self.path, -2.0, 1.0, -1.0, 1.0, expected.shape, 300,
+                                              tile=40, fill=False)
+        self.assertEqual(done, (0, 12))
+        self.assertRaises(ValueError, mandelbrot_disk.render_to_disk, self.path,
+                          -2.0, 1.0, -1.0, 1.0, expected.shape, 500, tile=40)
+        # Filled tiles can differ, so fill is a parameter of the image too
+        self.assertRaises(ValueError, mandelbrot_disk.render_to_disk, self.path,
+                          -2.0, 1.0, -1.0, 1.0, expected.shape, 300, tile=40, fill=True)
+
+    def test_resume(self):
+        '''
+        Only tiles not marked done are rendered again.
+        '''
+        mandelbrot_disk.render_to_disk(self.path, -2.0, 1.0, -1.0, 1.0, (60, 60), 50, tile=32)
+        flags = np.load(self.path + '.tiles.npy', mmap_mode='r+')
+        flags[1, :] = 0
+        flags.flush()
+        del flags
+        self.assertEqual(mandelbrot_disk.render_to_disk(self.path, -2.0, 1.0, -1.0, 1.0, (60, 60), 50, tile=32),
+                         (2, 2))
+
+    def test_dtype(self):
+        self.assertRaises(ValueError, mandelbrot_disk.render_to_disk, self.path,
+                          -2.0, 1.0, -1.0, 1.0, (10, 10), 300, dtype='uint8')
+        self.assertRaises(ValueError, mandelbrot_disk.render_to_disk, self.path,
+                          -2.0, 1.0, -1.0, 1.0, (10, 10), 100, dtype='int8')
+
+        mandelbrot_disk.render_to_disk(self.path, -2.0, 1.0, -1.0, 1.0, (40, 60), 100, dtype='float32')
+        image = mandelbrot_disk.load(self.path)
+        counts = np.zeros((40, 60), dtype=np.uint32)
+        mandelbrot_cpu.compute_mandel(-2.0, 1.0, -1.0, 1.0, counts, 100)
+        # Smooth counts are within one of the integer counts
+        self.assertEqual(image.dtype, np.float32)
+        self.assertTrue(np.all(image[counts == 100] == 100))
+        self.assertTrue(np.all(np.abs(image - counts)[counts < 100] <= 1.0))
+        del image
+
+class TestMandelbrotZoom(unittest.TestCase):
+
+    def test_shared_pixels(self):
+        '''
+        A pan by whole pixels shares all but the new columns and rows,
+        a zoom by two every other row and column.
+        '''
+        shape = (40, 60)
+        pan = mandelbrot_zoom.zoom_path((-0.8, 0.0, 0.5), (-0.7, 0.1, 0.5), 5, shape)
+        (rows, columns, previous_rows, previous_columns) = mandelbrot_zoom.shared_pixels(pan[1], pan[0], shape)
+        self.assertGreater(len(rows) * len(columns), shape[0] * shape[1] // 2)
+        self.assertEqual(len(set(previous_rows - rows)), 1)
+        self.assertEqual(len(set(previous_columns - columns)), 1)
+
+        zoom = mandelbrot_zoom.zoom_path((-0.75, 0.1, 2.0), (-0.75, 0.1, 0.5), 3, shape)
+        (rows, columns, previous_rows, previous_columns) = mandelbrot_zoom.shared_pixels(zoom[1], zoom[0], shape)
+        self.assertEqual((len(rows), len(columns)), (shape[0] // 2, shape[1] // 2))
+
+    def test_render_sequence(self):
+        '''
+        Frames built on the previous one are the frames rendered alone.
+        '''
+        shape = (30, 40)
+        views = mandelbrot_zoom.zoom_path((-0.8, 0.0, 0.5), (-0.75, 0.05, 0.25), 4, shape)
+        with tempfile.TemporaryDirectory() as directory:
+            reused = mandelbrot_zoom.render_sequence(views, shape, 300, directory, workers=1, fill=False)
+            self.assertEqual(reused[0], 0)
+            self.assertGreater(reused.sum(), 0)
+            for (frame, view) in enumerate(views):
+                expected = np.zeros(shape, dtype=np.uint16)
+                mandelbrot_cpu.compute_mandel(view[0], view[1], view[2], view[3], expected, 300)
+                with open(os.path.join(directory, 'frame_%05d.pgm' % frame), 'rb') as f:
+                    self.assertEqual(f.readline() + f.readline() + f.readline(), b'P5\n40 30\n300\n')
+                    image = np.frombuffer(f.read(), dtype='>u2').reshape(shape)
+                self.assertTrue(np.array_equal(image, expected))
+            # Two runs of two frames, the second starts from scratch
+            reused = mandelbrot_zoom.render_sequence(views, shape, 300, directory, workers=2, fill=False)
+            self.assertEqual((reused[0], reused[2]), (0, 0))
+            self.assertGreater(reused[1], 0)
+            self.assertRaises(ValueError, mandelbrot_zoom.render_sequence, views, shape, 70000, directory)
+
+    def test_fill(self):
+        '''
+        With fill only iterated pixels are copied, and a frame built on them
+        is no less exact than its render from scratch.
+        '''
+        shape = (60, 80)
+        views = mandelbrot_zoom.zoom_path((-0.8, 0.0, 0.5), (-0.7, 0.1, 0.5), 4, shape)
+        previous = None
+        exact = None
+        for view in views:
+            (counts, known, copied) = mandelbrot_zoom.render_frame(view, shape, 300, previous, exact)
+            (scratch, _, _) = mandelbrot_zoom.render_frame(view, shape, 300)
+            expected = np.zeros(shape, dtype=np.int32)
+            mandelbrot_cpu.compute_mandel(view[0], view[1], view[2], view[3], expected, 300)
+            self.assertTrue(np.any(known < 0))
+            self.assertTrue(np.array_equal(known[known >= 0], expected[known >= 0]))
+            self.assertLessEqual(np.count_nonzero(counts != expected), np.count_nonzero(scratch != expected))
+            self.assertEqual(copied > 0, previous is not None)
+            (previous, exact) = (view, known)
+
+if __name__ == '__main__':
+    unittest.main()
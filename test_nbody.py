@@ -0,0 +1,667 @@
+'''
+Test script for the array based N-body engines.
+To run test: python -m unittest test_nbody
+'''
+
+import io
+import os
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from itertools import combinations
+import numpy as np
+import nbody_bh
+import nbody_cells
+import nbody_checkpoint
+import nbody_ensemble
+import nbody_integrators
+import nbody_numba
+import nbody_opt
+import nbody_plan
+import nbody_pool
+import nbody_profile
+import nbody_soa
+import nbody_tiled
+import nbody_trajectory
+import nbody_loader
+import nbody_vec
+
+
+class TestNbodyVec(unittest.TestCase):
+
+    def setUp(self):
+        self.BODIES = nbody_opt.initialize()
+        self.cached_body_pairs = list(combinations(self.BODIES.keys(), 2))
+        nbody_opt.offset_momentum(self.BODIES['sun'], self.BODIES)
+
+        self.r, self.v, self.m = nbody_vec.initialize()
+        nbody_vec.offset_momentum(0, self.v, self.m)
+
+    def test_initial_energy(self):
+        '''
+        Energy of the array layout should equal report_energy() of nbody_opt.
+        '''
+        expected = nbody_opt.report_energy(self.BODIES, self.cached_body_pairs)
+        self.assertAlmostEqual(expected, nbody_vec.report_energy(self.r, self.v, self.m), places=14)
+
+    def test_advance(self):
+        '''
+        After the same number of timesteps both engines should report the same energy
+        and the same positions, up to round-off from the summation order.
+        '''
+        for _ in range(5):
+            nbody_opt.advance(0.01, 200, self.BODIES, self.cached_body_pairs)
+            nbody_vec.advance(0.01, 200, self.r, self.v, self.m)
+            expected = nbody_opt.report_energy(self.BODIES, self.cached_body_pairs)
+            self.assertAlmostEqual(expected, nbody_vec.report_energy(self.r, self.v, self.m), places=12)
+
+        r = np.array([self.BODIES[body][0] for body in self.BODIES.keys()])
+        self.assertTrue(np.allclose(r, self.r, rtol=1e-10, atol=1e-12))
+
+class TestNbodyPlan(unittest.TestCase):
+
+    def test_default_order(self):
+        '''
+        Up to one tile the plan should list pairs like combinations().
+        '''
+        plan = nbody_plan.InteractionPlan(5)
+        self.assertEqual(plan.tuples(), list(combinations(range(5), 2)))
+        self.assertEqual(plan.names('abcde'), list(combinations('abcde', 2)))
+        self.assertEqual(plan.pairs.dtype, np.int32)
+
+    def test_tiled(self):
+        (r, v, m) = nbody_loader.plummer(300, seed=0)
+        expected = set(combinations(range(300), 2))
+        for plan in (nbody_plan.InteractionPlan(300, tile=16),
+                     nbody_plan.InteractionPlan.from_positions(r, tile=16)):
+            self.assertEqual(len(plan), len(expected))
+            self.assertEqual(set(plan.tuples()), expected)
+        self.assertAlmostEqual(nbody_vec.report_energy(r, v, m, plan.indices()),
+                               nbody_vec.report_energy(r, v, m))
+
+    def test_force_kernels(self):
+        '''
+        Force kernels given a plan should only change the order of the sums,
+        and never build the pair list.
+        '''
+        (r, v, m) = nbody_loader.plummer(300, seed=0)
+        expected = np.zeros(1)
+        a = nbody_vec.accelerations(r, m, potential=expected)
+        for plan in (nbody_plan.InteractionPlan(300, tile=16),
+                     nbody_plan.InteractionPlan.from_positions(r, tile=16)):
+            for module in (nbody_vec, nbody_tiled):
+                potential = np.zeros(1)
+                b = module.accelerations(r, m, potential=potential, plan=plan)
+                self.assertTrue(np.allclose(a, b, rtol=1e-12, atol=1e-12))
+                self.assertAlmostEqual(potential[0], expected[0], places=12)
+            self.assertIsNone(plan._i)
+
+        (r2, v2, m2) = [x.copy() for x in (r, v, m)]
+        nbody_vec.advance(1e-3, 10, r, v, m)
+        nbody_vec.advance(1e-3, 10, r2, v2, m2, plan=plan)
+        self.assertTrue(np.allclose(r, r2, rtol=1e-12, atol=1e-12))
+
+
+class TestNbodySoa(unittest.TestCase):
+
+    def test_matches_opt(self):
+        system = nbody_soa.initialize()
+        pairs = system.pairs()
+        nbody_soa.offset_momentum('sun', system)
+        BODIES = nbody_opt.initialize()
+        cached_body_pairs = list(combinations(BODIES.keys(), 2))
+        nbody_opt.offset_momentum(BODIES['sun'], BODIES)
+
+        nbody_soa.advance(0.01, 100, system, pairs)
+        nbody_opt.advance(0.01, 100, BODIES, cached_body_pairs)
+        self.assertEqual(nbody_soa.report_energy(system, pairs),
+                         nbody_opt.report_energy(BODIES, cached_body_pairs))
+        self.assertEqual(list(system['jupiter'].r), BODIES['jupiter'][0])
+
+    def test_views(self):
+        '''
+        Name based views should let nbody_opt run unchanged on a BodySystem.
+        '''
+        system = nbody_soa.initialize()
+        pairs = list(combinations(system.keys(), 2))
+        nbody_opt.offset_momentum(system['sun'], system)
+        nbody_opt.advance(0.01, 10, system, pairs)
+
+        expected = nbody_soa.initialize()
+        nbody_soa.offset_momentum('sun', expected)
+        nbody_soa.advance(0.01, 10, expected, expected.pairs())
+        self.assertEqual(list(system.x), list(expected.x))
+
+        (r, v, m) = system['sun']
+        v[0] = 1.0
+        self.assertEqual(system.vx[0], 1.0)
+
+    def test_arrays(self):
+        (r, v, m) = nbody_vec.initialize()
+        system = nbody_soa.BodySystem.from_arrays(r, v, m)
+        for (a, b) in zip(system.to_arrays(), (r, v, m)):
+            self.assertTrue(np.array_equal(a, b))
+
+
+class TestNbodyLoader(unittest.TestCase):
+
+    def test_round_trip(self):
+        '''
+        Saving and loading a system should give back the same arrays in every format.
+        '''
+        r, v, m = nbody_vec.initialize()
+        with tempfile.TemporaryDirectory() as tmp:
+            for fmt in nbody_loader.FORMATS:
+                path = os.path.join(tmp, 'bodies.' + fmt)
+                nbody_loader.save_bodies(path, r, v, m)
+                (r2, v2, m2) = nbody_loader.load_bodies(path)
+                self.assertTrue(np.array_equal(r, r2))
+                self.assertTrue(np.array_equal(v, v2))
+                self.assertTrue(np.array_equal(m, m2))
+                self.assertTrue(r2.flags['C_CONTIGUOUS'] and v2.flags['C_CONTIGUOUS'])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, nbody_loader.load_bodies, 'bodies.txt')
+
+    def test_plummer(self):
+        '''
+        A Plummer sphere should be reproducible from its seed,
+        be at rest in its center of mass frame and be close to virial equilibrium.
+        '''
+        (r, v, m) = nbody_loader.plummer(2000, seed=1)
+        (r2, v2, m2) = nbody_loader.plummer(2000, seed=1)
+        self.assertTrue(np.array_equal(r, r2) and np.array_equal(v, v2))
+        self.assertTrue(np.allclose(np.dot(m, v), 0.0))
+
+        kinetic = np.sum(m * np.sum(v * v, axis=1)) / 2.
+        potential = nbody_vec.report_energy(r, v, m) - kinetic
+        self.assertAlmostEqual(2 * kinetic / -potential, 1.0, delta=0.1)
+
+    def test_uniform(self):
+        (r, v, m) = nbody_loader.uniform(500, seed=2, radius=3.0)
+        self.assertEqual(r.shape, (500, 3))
+        self.assertTrue(np.all(np.sqrt(np.sum(r * r, axis=1)) < 6.0))
+        self.assertAlmostEqual(np.sum(m), 1.0)
+
+class TestNbodyBarnesHut(unittest.TestCase):
+
+    def setUp(self):
+        (self.r, self.v, self.m) = nbody_loader.plummer(1000, seed=3)
+
+    def test_exact_with_zero_theta(self):
+        '''
+        With theta = 0 every cell is opened and the result is the exact pairwise one.
+        '''
+        (max_error, rms_error) = nbody_bh.force_error(self.r, self.m, 0.0)
+        self.assertLess(max_error, 1e-12)
+
+    def test_force_error(self):
+        '''
+        Error should be small and grow with theta.
+        '''
+        (max_small, rms_small) = nbody_bh.force_error(self.r, self.m, 0.3)
+        (max_large, rms_large) = nbody_bh.force_error(self.r, self.m, 0.8)
+        self.assertLess(rms_small, 1e-2)
+        self.assertLess(rms_small, rms_large)
+
+    def test_energy(self):
+        self.assertAlmostEqual(nbody_vec.report_energy(self.r, self.v, self.m),
+                               nbody_bh.report_energy(self.r, self.v, self.m), places=10)
+
+class TestNbodyTiled(unittest.TestCase):
+
+    def test_matches_dense(self):
+        '''
+        Tiles that don't divide N evenly should give the same forces and potential.
+        '''
+        (r, v, m) = nbody_loader.plummer(300, seed=0)
+        expected = np.zeros(1)
+        a = nbody_vec.accelerations(r, m, potential=expected)
+        for tile in (7, 64, 1000):
+            potential = np.zeros(1)
+            b = nbody_tiled.accelerations(r, m, potential=potential,
+                                          plan=nbody_plan.InteractionPlan(300, tile=tile))
+            self.assertTrue(np.allclose(a, b, rtol=1e-12, atol=1e-12))
+            self.assertAlmostEqual(potential[0], expected[0], places=12)
+
+    def test_backend(self):
+        (r, v, m) = nbody_vec.initialize()
+        (r2, v2, m2) = [x.copy() for x in (r, v, m)]
+        nbody_vec.advance(0.01, 100, r, v, m)
+        nbody_vec.advance(0.01, 100, r2, v2, m2, backend='tiled')
+        self.assertTrue(np.allclose(r, r2, rtol=1e-12))
+        self.assertRaises(ValueError, nbody_vec.advance, 0.01, 1, r, v, m, backend='gpu')
+
+
+class TestNbodyCells(unittest.TestCase):
+
+    def setUp(self):
+        (self.r, self.v, self.m) = nbody_loader.uniform(1000, seed=6, radius=1.0)
+
+    def test_pairs(self):
+        '''
+        The cell list should find exactly the pairs a brute force search finds.
+        '''
+        (i, j) = nbody_cells.build_pairs(self.r, 0.25)
+        (bi, bj) = nbody_vec.pair_indices(len(self.m))
+        d = self.r[bi] - self.r[bj]
+        close = np.sum(d * d, axis=1) < 0.25 * 0.25
+        self.assertEqual(sorted(zip(i, j)), sorted(zip(bi[close], bj[close])))
+
+    def test_all_pairs_limit(self):
+        '''
+        With a cutoff larger than the system and no softening, forces are the exact pairwise ones.
+        '''
+        neighbors = nbody_cells.NeighborList(10.0)
+        a = np.empty_like(self.r)
+        nbody_cells.make_accelerations(neighbors, 0.0)(self.r, self.m, a)
+        self.assertTrue(np.allclose(a, nbody_vec.accelerations(self.r, self.m)))
+
+    def test_rebuild(self):
+        '''
+        The list is only rebuilt after a body moved more than half the skin.
+        '''
+        neighbors = nbody_cells.NeighborList(0.2, skin=0.02)
+        self.assertTrue(neighbors.update(self.r))
+        self.r[0, 0] += 0.009
+        self.assertFalse(neighbors.update(self.r))
+        self.r[0, 0] += 0.002
+        self.assertTrue(neighbors.update(self.r))
+        self.assertEqual(neighbors.builds, 2)
+
+class TestNbodyIntegrators(unittest.TestCase):
+
+    def energy_error(self, integrator, dt, time=100.0):
+        (r, v, m) = nbody_vec.initialize()
+        nbody_vec.offset_momentum(0, v, m)
+        e0 = nbody_vec.report_energy(r, v, m)
+        nbody_vec.advance(dt, int(round(time / dt)), r, v, m, integrator)
+        return abs(nbody_vec.report_energy(r, v, m) / e0 - 1.0)
+
+    def test_higher_order(self):
+        '''
+        With a 5x larger dt, higher order schemes should still beat symplectic Euler.
+        '''
+        euler = self.energy_error('euler', 0.01)
+        self.assertLess(self.energy_error('verlet', 0.05), euler)
+        self.assertLess(self.energy_error('yoshida4', 0.05), euler)
+
+    def test_yoshida_order(self):
+        '''
+        Halving dt should reduce the error of the 4th order scheme by about 16x.
+        '''
+        ratio = self.energy_error('yoshida4', 0.04) / self.energy_error('yoshida4', 0.02)
+        self.assertGreater(ratio, 8.0)
+
+    def test_adaptive(self):
+        '''
+        Adaptive steps should end at the requested time, close to a fine fixed step run.
+        '''
+        (r, v, m) = nbody_vec.initialize()
+        nbody_vec.offset_momentum(0, v, m)
+        (r2, v2, m2) = [x.copy() for x in (r, v, m)]
+        adaptive = nbody_integrators.Adaptive(1e-10)
+        nbody_vec.advance(0.1, 10, r, v, m, adaptive)
+        nbody_vec.advance(0.001, 1000, r2, v2, m2, 'yoshida4')
+        self.assertTrue(np.allclose(r, r2, atol=1e-7))
+        self.assertGreater(adaptive.steps, 10)
+
+    def test_unknown_integrator(self):
+        self.assertRaises(ValueError, nbody_integrators.get_integrator, 'rk4')
+
+    def test_compensated(self):
+        '''
+        Kahan compensated updates should keep float32 runs much closer to float64.
+        '''
+        (r, v, m) = nbody_vec.initialize()
+        nbody_vec.offset_momentum(0, v, m)
+        (r64, v64, m64) = [x.copy() for x in (r, v, m)]
+        nbody_vec.advance(0.01, 5000, r64, v64, m64)
+
+        errors = []
+        for integrator in ('euler', 'euler_kahan'):
+            (r32, v32, m32) = [x.astype(np.float32) for x in (r, v, m)]
+            integrate = nbody_integrators.get_integrator(integrator)
+            for _ in range(5):
+                nbody_vec.advance(0.01, 1000, r32, v32, m32, integrate)
+            errors.append(np.max(np.abs(r32 - r64)))
+        self.assertLess(errors[1], errors[0] / 4.0)
+        self.assertRaises(ValueError, nbody_integrators.Compensated, 'yoshida4')
+
+    def test_recenter(self):
+        (r, v, m) = nbody_vec.initialize()
+        v += 1e-3
+        relative = v[1] - v[0]
+        nbody_vec.recenter(v, m)
+        self.assertTrue(np.allclose(np.dot(m, v), 0.0, atol=1e-15))
+        self.assertTrue(np.allclose(v[1] - v[0], relative))
+
+    def test_energy_monitor(self):
+        '''
+        Energies taken from the force computation should match report_energy at the same steps.
+        '''
+        for integrator in ('euler', 'verlet'):
+            (r, v, m) = nbody_vec.initialize()
+            nbody_vec.offset_momentum(0, v, m)
+            monitor = nbody_integrators.EnergyMonitor(every=10)
+            expected = []
+            for _ in range(3):
+                expected.append(nbody_vec.report_energy(r, v, m))
+                nbody_vec.advance(0.01, 10, r, v, m, integrator, monitor)
+            steps, energies = monitor.pop()
+            self.assertEqual(steps[:3], [0, 10, 20])
+            self.assertTrue(np.allclose(energies[:3], expected, rtol=1e-12))
+        self.assertRaises(ValueError, nbody_vec.advance, 0.01, 1, r, v, m, 'yoshida4', monitor)
+
+    def test_estimate_energy(self):
+        (r, v, m) = nbody_loader.plummer(2000, seed=0)
+        exact = nbody_vec.report_energy(r, v, m)
+        self.assertAlmostEqual(nbody_vec.estimate_energy(r, v, m, seed=0) / exact, 1.0, delta=0.02)
+
+class TestNbodyCheckpoint(unittest.TestCase):
+
+    def run_nbody(self, loops, path, integrator='adaptive'):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            drift = nbody_vec.nbody(loops, 0, 100, integrator=integrator, checkpoint=path)
+        return [float(line) for line in out.getvalue().split()], drift
+
+    def test_resume(self):
+        '''
+        A run stopped after 2 loops and resumed to 4 should print the same energies
+        and drift as an uninterrupted run, also with the compensation of a Kahan integrator.
+        '''
+        for integrator in ('adaptive', 'euler_kahan', 'verlet_kahan'):
+            with tempfile.TemporaryDirectory() as tmp:
+                (expected, drift) = self.run_nbody(4, os.path.join(tmp, 'full.chk'), integrator)
+                path = os.path.join(tmp, 'resumed.chk')
+                (first, _) = self.run_nbody(2, path, integrator)
+                self.assertEqual(nbody_checkpoint.load_checkpoint(path)['step'], 200)
+                (second, resumed_drift) = self.run_nbody(4, path, integrator)
+                self.assertEqual(expected, first + second)
+                self.assertEqual(drift, resumed_drift)
+
+    def test_slots(self):
+        '''
+        The newest snapshot wins and the older slot is the one overwritten.
+        '''
+        (r, v, m) = nbody_vec.initialize()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bodies.chk')
+            writer = nbody_checkpoint.Checkpointer(path, len(m))
+            self.assertEqual(writer.latest(), None)
+            for step in range(1, 4):
+                r[0, 0] = step
+                writer.save(step, 0.01 * step, r, v, m)
+                writer.wait()
+            writer.close()
+
+            state = nbody_checkpoint.load_checkpoint(path)
+            self.assertEqual(state['step'], 3)
+            self.assertTrue(np.array_equal(state['r'], r))
+            self.assertEqual(state['integrator'], '')
+
+    def test_error_in_writer_thread(self):
+        '''
+        A snapshot the thread can't write should be raised, not block forever.
+        '''
+        (r, v, m) = nbody_vec.initialize()
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = nbody_checkpoint.Checkpointer(os.path.join(tmp, 'bodies.chk'), len(m))
+            writer.save(1, 0.01, r[:3], v[:3], m[:3])
+            self.assertRaises(ValueError, writer.wait)
+            self.assertRaises(ValueError, writer.save, 2, 0.02, r, v, m)
+            self.assertRaises(ValueError, writer.close)
+
+class TestNbodyTrajectory(unittest.TestCase):
+
+    def test_frames(self):
+        '''
+        Every 30th step should be recorded, in order, with the same positions
+        as a run without trajectory output.
+        '''
+        with tempfile.TemporaryDirectory() as tmp:
+            for compress in (False, True):
+                path = os.path.join(tmp, 'frames%d.traj' % compress)
+                with nbody_trajectory.TrajectoryWriter(path, 5, every=30, chunk=4, compress=compress) as writer:
+                    with redirect_stdout(io.StringIO()):
+                        nbody_vec.nbody(5, 0, 100, trajectory=writer)
+                (steps, r_frames, v_frames) = nbody_trajectory.read_trajectory(path)
+                self.assertEqual(list(steps), list(range(0, 501, 30)))
+
+                (r2, v2, m2) = nbody_vec.initialize()
+                nbody_vec.offset_momentum(0, v2, m2)
+                nbody_vec.advance(0.01, 480, r2, v2, m2)
+                self.assertTrue(np.array_equal(r_frames[-1], r2))
+                self.assertTrue(np.array_equal(v_frames[-1], v2))
+
+    def test_resume_after_torn_chunk(self):
+        '''
+        Frames written after a crash mid-chunk should follow the last full chunk.
+        '''
+        (r, v, m) = nbody_vec.initialize()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'torn.traj')
+            with nbody_trajectory.TrajectoryWriter(path, 5, chunk=2) as writer:
+                for step in range(4):
+                    writer.write(step, r, v)
+            with open(path, 'r+b') as f:
+                f.truncate(os.path.getsize(path) - 10)
+
+            with nbody_trajectory.TrajectoryWriter(path, 5, chunk=2) as writer:
+                for step in range(2, 6):
+                    writer.write(step, r, v)
+            (steps, r_frames, v_frames) = nbody_trajectory.read_trajectory(path)
+            self.assertEqual(list(steps), [0, 1, 2, 3, 4, 5])
+
+    def test_resume_from_checkpoint(self):
+        '''
+        A run resumed from a checkpoint older than its last frames should
+        record every step once, as an uninterrupted run does.
+        '''
+        with tempfile.TemporaryDirectory() as tmp:
+            for compress in (False, True):
+                def run(loops, name):
+                    path = os.path.join(tmp, '%s%d.traj' % (name, compress))
+                    with nbody_trajectory.TrajectoryWriter(path, 5, every=30, chunk=2, compress=compress) as writer:
+                        with redirect_stdout(io.StringIO()):
+                            nbody_vec.nbody(loops, 0, 100, trajectory=writer, checkpoint_every=2,
+                                            checkpoint=os.path.join(tmp, '%s%d.chk' % (name, compress)))
+                    return nbody_trajectory.read_trajectory(path)
+
+                expected = run(5, 'full')
+                # Stopped after loop 3, the last checkpoint is at step 200
+                run(3, 'resumed')
+                resumed = run(5, 'resumed')
+                self.assertEqual(list(resumed[0]), list(range(0, 501, 30)))
+                for (a, b) in zip(expected, resumed):
+                    self.assertTrue(np.array_equal(a, b))
+
+    def test_error_in_writer_thread(self):
+        '''
+        A frame the writer thread can't take should raise, not block write() or close().
+        '''
+        (r, v, m) = nbody_vec.initialize()
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = nbody_trajectory.TrajectoryWriter(os.path.join(tmp, 'bad.traj'), 5, queue_size=1)
+            writer.write(0, r[:3], v[:3])
+            with self.assertRaises(ValueError):
+                for step in range(1, 10):
+                    writer.write(step, r, v)
+            self.assertRaises(ValueError, writer.close)
+
+class TestNbodyEnsemble(unittest.TestCase):
+
+    def test_matches_single_system(self):
+        '''
+        Every system of the ensemble should evolve like the same system run alone.
+        '''
+        (r, v, m) = nbody_ensemble.initialize(4, seed=5, scale=1e-3)
+        nbody_ensemble.offset_momentum(0, v, m)
+        self.assertTrue(np.allclose(np.einsum('sn,snk->sk', m, v), 0.0))
+        expected = []
+        for s in range(4):
+            (rs, vs, ms) = (r[s].copy(), v[s].copy(), m[s].copy())
+            nbody_vec.advance(0.01, 300, rs, vs, ms)
+            expected.append(nbody_vec.report_energy(rs, vs, ms))
+
+        nbody_ensemble.advance(0.01, 300, r, v, m)
+        self.assertTrue(np.allclose(nbody_ensemble.report_energy(r, v, m), expected, rtol=1e-12))
+
+    def test_precision(self):
+        '''
+        Reduced precision should keep float32 storage and stay close to the float64 run.
+        '''
+        (r, v, m) = nbody_ensemble.initialize(2, seed=5, precision='mixed')
+        self.assertEqual(r.dtype, np.float32)
+        report = nbody_ensemble.compare_precision(2, 200, 8)
+        self.assertEqual(report['float64']['error'], 0.0)
+        self.assertLess(report['mixed']['error'], 1e-4)
+        self.assertLess(report['float32']['error'], 1e-3)
+
+class TestNbodyProfile(unittest.TestCase):
+
+    def test_instrument(self):
+        advance = nbody_opt.advance
+        with nbody_profile.instrument(nbody_opt) as profiler:
+            with redirect_stdout(io.StringIO()):
+                nbody_opt.nbody(3, 'sun', 10)
+        self.assertIs(nbody_opt.advance, advance)
+
+        report = profiler.report()
+        self.assertEqual(report['steps'], 30)
+        self.assertEqual(report['phases']['advance']['calls'], 3)
+        self.assertEqual(report['phases']['offset_momentum']['calls'], 1)
+        self.assertAlmostEqual(report['pairs_per_second'], 10 * report['steps_per_second'])
+
+    def test_single_step_advance(self):
+        '''
+        Variants whose advance() does one step should count one step per call.
+        '''
+        with nbody_profile.instrument(nbody_vec) as profiler:
+            (r, v, m) = nbody_vec.initialize()
+            nbody_vec.advance(0.01, 7, r, v, m)
+        self.assertEqual(profiler.steps, 7)
+        with nbody_profile.instrument(nbody_vec) as profiler:
+            nbody_vec.advance(dt=0.01, iterations=3, r=r, v=v, m=m)
+        self.assertEqual(profiler.steps, 3)
+        profiler = nbody_profile.Profiler()
+        profiler.wrap('advance', lambda dt: None)(0.01)
+        self.assertEqual(profiler.steps, 1)
+
+
+class TestNbodyPool(unittest.TestCase):
+
+    def test_matches_serial(self):
+        '''
+        Every job should stream its energies loop by loop and end in the serial state.
+        '''
+        bodies = [nbody_loader.plummer(n, seed=n) for n in (20, 30, 40)]
+        energies = dict((job, []) for job in range(3))
+        states = {}
+        for (job, loop, energy, state) in nbody_pool.run_jobs(bodies, 2, 10, dt=1e-3, workers=2):
+            self.assertEqual(loop, len(energies[job]))
+            energies[job].append(energy)
+            self.assertEqual(state is None, loop < 2)
+            if state is not None:
+                states[job] = state
+
+        for job in range(3):
+            (r0, v0, m0) = bodies[job]
+            (r, v, m) = states[job]
+            nbody_vec.offset_momentum(0, v0, m0)
+            self.assertAlmostEqual(energies[job][0], nbody_vec.report_energy(r0, v0, m0))
+            nbody_vec.advance(1e-3, 10, r0, v0, m0)
+            self.assertAlmostEqual(energies[job][1], nbody_vec.report_energy(r0, v0, m0))
+            nbody_vec.advance(1e-3, 10, r0, v0, m0)
+            self.assertAlmostEqual(energies[job][2], nbody_vec.report_energy(r0, v0, m0))
+            self.assertTrue(np.allclose(r, r0) and np.allclose(v, v0))
+            self.assertTrue(np.array_equal(m, m0))
+
+    def test_adaptive(self):
+        '''
+        The adaptive step size should carry over from loop to loop in a job.
+        '''
+        bodies = nbody_loader.plummer(20, seed=1)
+        results = list(nbody_pool.run_jobs([bodies], 3, 10, dt=1e-3, reference=None,
+                                           integrator='adaptive', workers=1))
+        (r, v, m) = results[-1][3]
+        (r0, v0, m0) = bodies
+        integrator = nbody_integrators.Adaptive()
+        for loop in range(3):
+            nbody_vec.advance(1e-3, 10, r0, v0, m0, integrator)
+        self.assertTrue(np.array_equal(r, r0) and np.array_equal(v, v0))
+
+    def test_failed_job(self):
+        '''
+        An error in a worker should be raised, not wait for energies forever.
+        '''
+        with self.assertRaises(ValueError):
+            list(nbody_pool.run_jobs([nbody_vec.initialize()], 1, 1, integrator='rk4', workers=1))
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            next(nbody_pool.run_jobs([nbody_vec.initialize()], 1, 1, engine='gpu'))
+
+    def test_close_early(self):
+        '''
+        Leaving the loop early should stop the jobs instead of waiting for them.
+        '''
+        bodies = [nbody_loader.plummer(20, seed=seed) for seed in range(4)]
+        jobs = nbody_pool.run_jobs(bodies, 20000, 1, dt=1e-3, workers=2)
+        next(jobs)
+        start = time.perf_counter()
+        jobs.close()
+        self.assertLess(time.perf_counter() - start, 5.0)
+
+        for (job, loop, energy, state) in nbody_pool.run_jobs(bodies, 20000, 1, dt=1e-3, workers=2):
+            break
+
+
+class TestNbodyNumbaParallel(unittest.TestCase):
+
+    def test_advance_parallel(self):
+        '''
+        Row parallel advance should match the serial pair loop of advance().
+        '''
+        BODIES = nbody_numba.initialize()
+        nbody_numba.offset_momentum(0, BODIES, 0.0, 0.0, 0.0)
+        expected = BODIES.copy()
+        cached_body_pairs = np.array(list(combinations(range(5), 2)), dtype=np.int32)
+        acc = np.empty((5, 3), dtype=np.float64)
+
+        nbody_numba.set_threads()
+        nbody_numba.advance(0.01, 1000, expected, cached_body_pairs)
+        nbody_numba.advance_parallel(0.01, 1000, BODIES, acc)
+        self.assertTrue(np.allclose(expected, BODIES, rtol=1e-10, atol=1e-12))
+
+    def test_precision(self):
+        '''
+        The precision kernel in float64 should be advance_parallel(),
+        float32 storage should stay close to it.
+        '''
+        BODIES = nbody_numba.initialize()
+        expected = BODIES.copy()
+        acc = np.empty((5, 3), dtype=np.float64)
+        nbody_numba.advance_parallel(0.01, 100, expected, acc)
+        nbody_numba._advance_precision(np.array([0.01, -1.5, 0.0]), 100, BODIES, acc)
+        self.assertTrue(np.array_equal(expected, BODIES))
+
+        report = nbody_numba.compare_precision(2, 200)
+        self.assertEqual(report['float64']['error'], 0.0)
+        self.assertLess(report['mixed']['error'], 1e-5)
+        self.assertLess(report['float32']['error'], 1e-4)
+        self.assertRaises(ValueError, nbody_numba.nbody_parallel, 1, 0, 1, precision='half')
+
+    def test_plan_order(self):
+        '''
+        Bodies in plan order should give the energies of index order.
+        '''
+        plan = nbody_plan.InteractionPlan(5, order=[3, 0, 4, 1, 2])
+        expected = list(nbody_numba._energies(2, 0, 100, None, None, 'float64'))
+        energies = list(nbody_numba._energies(2, 0, 100, None, plan, 'float64'))
+        self.assertTrue(np.allclose(energies, expected, rtol=1e-12))
+
+if __name__ == '__main__':
+    unittest.main()